@@ -0,0 +1,151 @@
+/**
+ * Decoder for the columnar binary format (server/columnar.py), served when a
+ * request sends `Accept: application/vnd.sensor-planner.columnar`.
+ *
+ * Numeric columns are read as typed-array views straight over the response
+ * buffer (every section is 8-byte aligned), strings are decoded once from the
+ * shared string table, and rows are rebuilt as the same objects the JSON
+ * routes return.
+ */
+
+export const COLUMNAR_MIMETYPE = "application/vnd.sensor-planner.columnar";
+
+const MAGIC = "SPCF";
+const FORMAT_VERSION = 1;
+const NULL = 0xffffffff;
+
+type Section = [number, number]; // [byte offset from the start of data, byte length]
+
+interface Column {
+  type: "str" | "strs" | "f32" | "i32" | "time" | "points" | "json";
+  data: Section;
+  offsets?: Section;
+}
+
+interface Header {
+  version: number;
+  meta: Record<string, any>;
+  strings: { count: number; offsets: Section; data: Section };
+  collections: Record<string, { count: number; columns: Record<string, Column> }>;
+}
+
+export interface ColumnarPayload {
+  meta: Record<string, any>;
+  collections: Record<string, Record<string, any>[]>;
+}
+
+export const decodeColumnar = (buffer: ArrayBuffer): ColumnarPayload => {
+  const view = new DataView(buffer);
+  const text = new TextDecoder();
+  if (text.decode(new Uint8Array(buffer, 0, 4)) !== MAGIC) {
+    throw new Error("Not a columnar payload");
+  }
+  const version = view.getUint16(4, true);
+  if (version !== FORMAT_VERSION) {
+    throw new Error(`Unsupported columnar version ${version}`);
+  }
+  const headerLength = view.getUint32(8, true);
+  const header: Header = JSON.parse(text.decode(new Uint8Array(buffer, 12, headerLength)));
+  const dataStart = Math.ceil((12 + headerLength) / 8) * 8;
+
+  const bytes = ([offset, length]: Section) => {
+    if (offset < 0 || length < 0 || dataStart + offset + length > buffer.byteLength) {
+      throw new Error("Columnar section out of bounds");
+    }
+    return [dataStart + offset, length];
+  };
+  const u32 = (section: Section) => {
+    const [start, length] = bytes(section);
+    return new Uint32Array(buffer, start, length / 4);
+  };
+  const i32 = (section: Section) => {
+    const [start, length] = bytes(section);
+    return new Int32Array(buffer, start, length / 4);
+  };
+  const f32 = (section: Section) => {
+    const [start, length] = bytes(section);
+    return new Float32Array(buffer, start, length / 4);
+  };
+  const f64 = (section: Section) => {
+    const [start, length] = bytes(section);
+    return new Float64Array(buffer, start, length / 8);
+  };
+
+  const stringOffsets = u32(header.strings.offsets);
+  const [blobStart, blobLength] = bytes(header.strings.data);
+  const blob = new Uint8Array(buffer, blobStart, blobLength);
+  const strings: string[] = new Array(header.strings.count);
+  for (let i = 0; i < strings.length; i++) {
+    strings[i] = text.decode(blob.subarray(stringOffsets[i], stringOffsets[i + 1]));
+  }
+  const str = (index: number) => (index === NULL ? null : strings[index]);
+  const nullable = (value: number) => (Number.isNaN(value) ? null : value);
+
+  // The JSON routes write event timestamps as epoch milliseconds and the
+  // date_* columns as naive UTC ISO strings; time columns decode to match.
+  const time = (key: string): ((ms: number) => number | string | null) =>
+    key === "timestamp"
+      ? nullable
+      : (ms: number) => (Number.isNaN(ms) ? null : new Date(ms).toISOString().slice(0, -1));
+
+  const decodeColumn = (key: string, column: Column, count: number): any[] => {
+    switch (column.type) {
+      case "str":
+        return Array.from(u32(column.data), str);
+      case "json":
+        return Array.from(u32(column.data), (i) => (i === NULL ? null : JSON.parse(strings[i])));
+      case "f32":
+        return Array.from(f32(column.data), nullable);
+      case "time":
+        return Array.from(f64(column.data), time(key));
+      case "i32":
+        return Array.from(i32(column.data));
+      case "strs": {
+        const offsets = u32(column.offsets!);
+        const flat = u32(column.data);
+        const values = new Array(count);
+        for (let row = 0; row < count; row++) {
+          values[row] = Array.from(flat.subarray(offsets[row], offsets[row + 1]), str);
+        }
+        return values;
+      }
+      case "points": {
+        const offsets = u32(column.offsets!);
+        const xy = f32(column.data);
+        const values = new Array(count);
+        for (let row = 0; row < count; row++) {
+          const path = [];
+          for (let p = offsets[row]; p < offsets[row + 1]; p++) {
+            path.push({ x: xy[2 * p], y: xy[2 * p + 1] });
+          }
+          values[row] = path;
+        }
+        return values;
+      }
+      default:
+        throw new Error(`Unknown column type ${(column as Column).type}`);
+    }
+  };
+
+  const collections: Record<string, Record<string, any>[]> = {};
+  for (const [name, collection] of Object.entries(header.collections)) {
+    const keys = Object.keys(collection.columns);
+    const columns = keys.map((key) => {
+      const values = decodeColumn(key, collection.columns[key], collection.count);
+      if (values.length !== collection.count) {
+        throw new Error(`Column ${name}.${key} has ${values.length} values, expected ${collection.count}`);
+      }
+      return values;
+    });
+    const rows = new Array(collection.count);
+    for (let row = 0; row < collection.count; row++) {
+      const item: Record<string, any> = {};
+      keys.forEach((key, k) => {
+        item[key] = columns[k][row];
+      });
+      rows[row] = item;
+    }
+    collections[name] = rows;
+  }
+  return { meta: header.meta ?? {}, collections };
+};
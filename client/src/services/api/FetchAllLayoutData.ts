@@ -1,28 +1,23 @@
-import {
-  fetchDevices,
-  fetchSensors,
-  fetchPeople,
-  fetchEvents,
-} from "./Requests";
+import { fetchLayoutSnapshot } from "./Requests";
 
 /**
  * Fetch all layout-related data (devices, sensors, people, events)
  * for a given layoutId (e.g., "layout-3", "layout-a1b2c3d4").
+ *
+ * Uses the single snapshot endpoint in the columnar binary format (see
+ * Columnar.ts); the browser revalidates it with If-None-Match, so switching
+ * back to an unchanged floor is a 304. The snapshot holds every sensor; like
+ * GET /sensors, only motion sensors are returned.
  */
 export const FetchAllLayoutData = async (layoutId: string) => {
   try {
-    const [devices, sensors, people, events] = await Promise.all([
-      fetchDevices(layoutId),
-      fetchSensors(layoutId),
-      fetchPeople(layoutId),
-      fetchEvents(layoutId),
-    ]);
+    const snapshot = await fetchLayoutSnapshot(layoutId);
 
     return {
-      devices,
-      sensors,
-      people,
-      events,
+      devices: snapshot.devices,
+      sensors: snapshot.sensors.filter((sensor: any) => sensor.type === "motion"),
+      people: snapshot.persons,
+      events: snapshot.events,
     };
   } catch (error) {
     console.error("Failed to fetch layout data:", error);
@@ -1,4 +1,5 @@
 import axios from "axios";
+import { COLUMNAR_MIMETYPE, decodeColumnar } from "./Columnar";
 
 axios.defaults.baseURL = "http://192.168.2.11:5000"; // Default base route for local development
 
@@ -17,6 +18,17 @@ export const deleteLayout = async (layoutId: string) => {
   return response.data;
 };
 
+// Snapshot: rooms, devices, sensors, persons and events in one ETag'd response,
+// fetched in the columnar binary format and decoded into the same shape as the JSON
+export const fetchLayoutSnapshot = async (layoutId: string) => {
+  const response = await axios.get(`/layouts/${layoutId}/snapshot`, {
+    headers: { Accept: COLUMNAR_MIMETYPE },
+    responseType: "arraybuffer",
+  });
+  const { meta, collections } = decodeColumnar(response.data);
+  return { layout: meta.layout, ...collections };
+};
+
 // Devices
 export const fetchDevices = async (layoutId: string) => {
   const response = await axios.get(`/layouts/${layoutId}/devices`);
@@ -1,10 +1,17 @@
  
 
 
-from datetime import datetime
+import base64
+import binascii
+from datetime import datetime, timedelta
+import logging
+import math
+from urllib.parse import urlencode
 import uuid
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, stream_with_context
 from flask_cors import CORS
+from sqlalchemy import and_, inspect, insert, or_, select, update
+from sqlalchemy.orm import load_only, selectinload
 
 
 
@@ -19,21 +26,81 @@ from models import (
    Log,
    Person,
    SimulationEvent,
+   Job,
 )
+from bulk import DEVICE_SPEC, PERSON_SPEC, SENSOR_SPEC, bulk_upsert
+from changes import change_feed, changes_since, record_deletes, record_rows
+from columnar import COLUMNAR_MIMETYPE, decode as decode_columnar, encode_collection
+from connectivity import compute_connectivity, connection_changes
+from coverage import coverage_cache, DEFAULT_COVERAGE_RESOLUTION, HEATMAP_ENCODINGS
+import dbconfig
+from encoding import json_bytes, json_dumps
+from ingest import WriteBehindBuffer
+from interference import (
+   compute_interference,
+   DEVICE_FIELDS,
+   SENSOR_FIELDS,
+   needs_recompute,
+   remove_node_interference,
+   update_node_interference,
+)
+from jobs import JobRunner
+from layouts import clone_layout_rows, delete_layout_rows
+import metrics
+from optimizer import DEFAULT_CATALOGUE, DEFAULT_RESOLUTION, optimize
+from propagation import floor_model, floor_propagation, propagation_cache
+from retention import RESOLUTIONS, RetentionCompactor, compact_layout, event_counts, retention_seconds
+from scenarios import ScenarioBase, check_variation, run_scenarios
+from serialize import DEVICE_ROWS, EVENT_ROWS, PERSON_ROWS, SENSOR_ROWS, stream_array
+from simulation import MotionSimulation, room_rects
+from snapshot import layout_etag, snapshot_bytes, snapshot_cache, touch_layout
+from spatial_index import floor_indexes
+from stats import STATS_DEFAULT_INTERVAL, last_log_id, stats_cache
+
 
 
 
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": "*"}})  # dev only
+CORS(app, resources={r"/*": {"origins": "*", "expose_headers": ["ETag", "Link", "X-Next-Cursor"]}})  # dev only
 
  
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///smart.db"
+# DATABASE_URL / DATABASE_READ_URL and pool/pragma settings, see dbconfig.py.
+dbconfig.configure(app)
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
 
  
 db.init_app(app)
+dbconfig.install(db, app)
+ingest_buffer = WriteBehindBuffer(app)
+job_runner = JobRunner(app)
+retention_compactor = RetentionCompactor(app)
+# Installed after the hooks above so every request is timed, including /metrics itself.
+metrics.install(app)
+metrics.registry.gauge("ingest_pending_events", "Events buffered for write-behind.", ingest_buffer.pending)
+metrics.registry.gauge("ingest_written_events", "Events written by the ingest buffer.", lambda: ingest_buffer.written)
+metrics.registry.gauge("ingest_dropped_events", "Events the ingest buffer failed to write.", lambda: ingest_buffer.dropped)
+
+
+@app.before_request
+def start_retention() -> None:
+   # Started by the first request whatever the server; RETENTION_INTERVAL=0 leaves it to `python retention.py`.
+   retention_compactor.start()
+
+
+def error_response(e: Exception, status: int = 500):
+   """The {"error": ...} body for an exception a route caught; 500s are logged with their traceback."""
+   metrics.record_error(e)
+   if status >= 500:
+       logger.exception("%s %s failed", request.method, request.path)
+   return jsonify({"error": str(e)}), status
+
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+   return app.response_class(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
 
 
 
@@ -41,6 +108,68 @@ db.init_app(app)
 def create_tables() -> None:
    
    db.create_all()
+   # create_all() never alters existing tables; add columns and indexes introduced since.
+   columns = {c["name"] for c in inspect(db.engine).get_columns("layout")}
+   if "version" not in columns:
+       with db.engine.begin() as conn:
+           conn.exec_driver_sql("ALTER TABLE layout ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+   if "change_log_start" not in columns:
+       # Floors written before the change log existed can only be delta-synced from now on.
+       with db.engine.begin() as conn:
+           conn.exec_driver_sql("ALTER TABLE layout ADD COLUMN change_log_start INTEGER NOT NULL DEFAULT 0")
+           conn.exec_driver_sql("UPDATE layout SET change_log_start = version")
+   if "event_retention_seconds" not in columns:
+       with db.engine.begin() as conn:
+           conn.exec_driver_sql("ALTER TABLE layout ADD COLUMN event_retention_seconds INTEGER")
+   if "motion_active" not in columns:
+       with db.engine.begin() as conn:
+           conn.exec_driver_sql("ALTER TABLE layout ADD COLUMN motion_active JSON")
+   if "propagation_model" not in columns:
+       with db.engine.begin() as conn:
+           conn.exec_driver_sql("ALTER TABLE layout ADD COLUMN propagation_model VARCHAR")
+   if "triggers" not in {c["name"] for c in inspect(db.engine).get_columns("event_rollup")}:
+       with db.engine.begin() as conn:
+           conn.exec_driver_sql("ALTER TABLE event_rollup ADD COLUMN triggers INTEGER NOT NULL DEFAULT 0")
+   if "heartbeat_at" not in {c["name"] for c in inspect(db.engine).get_columns("job")}:
+       with db.engine.begin() as conn:
+           conn.exec_driver_sql("ALTER TABLE job ADD COLUMN heartbeat_at TIMESTAMP")
+   for table in db.metadata.sorted_tables:
+       for index in table.indexes:
+           index.create(bind=db.engine, checkfirst=True)
+
+
+
+
+def encode_cursor(value: str) -> str:
+   """Opaque, URL-safe pagination cursor."""
+   return base64.urlsafe_b64encode(value.encode()).decode().rstrip("=")
+
+
+
+
+def decode_cursor(cursor: str) -> str:
+   return base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+
+
+
+
+def wants_columnar() -> bool:
+   """Whether the client prefers the columnar binary format (columnar.py) over JSON."""
+   return request.accept_mimetypes.best_match(["application/json", COLUMNAR_MIMETYPE]) == COLUMNAR_MIMETYPE
+
+
+def collection_response(name: str, spec, query):
+   """
+   `query`'s rows as a JSON array (serialize.py) streamed in batches as they
+   are read, or as one columnar payload when the client asks for it.
+   """
+   if wants_columnar():
+       body = encode_collection(name, spec, db.session.connection().execute(query).all())
+       response = app.response_class(body, mimetype=COLUMNAR_MIMETYPE)
+   else:
+       response = app.response_class(stream_with_context(stream_array(spec, query)), mimetype="application/json")
+   response.vary.add("Accept")
+   return response
 
 
 
@@ -52,28 +181,10 @@ def get_devices(layout_id: str):
        return add_or_update_device(layout_id)
 
 
-  
-   devices = Device.query.filter_by(floor=layout_id).all()
-   result = []
-   for device in devices:
-       result.append({
-           "id": device.id,
-           "x": device.x,
-           "y": device.y,
-           "type": device.type,
-           "label": device.label,
-           "name": device.name,
-           "device_rad": device.device_rad,
-           "connectivity": device.connectivity,
-           "compatibleSensors": device.compatibleSensors,
-           "interferenceProtocols": device.interferenceProtocols,
-           "connectedSensorIds": device.connectedSensorIds,
-           "interferenceIds": device.interferenceIds,
-           "floor": device.floor,
-           "date_created": device.date_created.isoformat() if device.date_created else None,
-           "date_modified": device.date_modified.isoformat() if device.date_modified else None,
-       })
-   return jsonify(result), 200
+   try:
+       return collection_response("devices", DEVICE_ROWS, DEVICE_ROWS.select().where(Device.floor == layout_id))
+   except Exception as e:
+       return error_response(e)
 
 
 
@@ -88,6 +199,9 @@ def add_or_update_device(layout_id: str):
 
        # Attempt to fetch an existing device
        device = Device.query.get(data["id"])
+       previous_floor = device.floor if device else None
+       previous_interference = list(device.interferenceIds or []) if device else []
+       recompute = device is None or previous_floor != layout_id or needs_recompute(device, data, DEVICE_FIELDS)
 
 
        if device:
@@ -132,13 +246,19 @@ def add_or_update_device(layout_id: str):
            status = 201
 
 
+       if recompute:
+           update_node_interference("device", device, previous_interference)
+       touch_layout(layout_id)
+       if previous_floor is not None and previous_floor != layout_id:
+           touch_layout(previous_floor)
        db.session.commit()
+       floor_indexes.upsert(layout_id, "device", device.id, device.x, device.y, device.device_rad, previous_floor)
        return jsonify({"message": message}), status
 
 
    except Exception as e:
        db.session.rollback()
-       return jsonify({"error": str(e)}), 400
+       return error_response(e, 400)
 
 
 
@@ -153,12 +273,15 @@ def delete_device(layout_id: str, device_id: str):
            return jsonify({"error": "Device not found"}), 404
 
 
+       remove_node_interference("device", device)
        db.session.delete(device)
+       touch_layout(layout_id)
        db.session.commit()
+       floor_indexes.remove(layout_id, "device", device_id)
        return jsonify({"message": f"Device '{device_id}' deleted from layout '{layout_id}'."}), 200
    except Exception as e:
        db.session.rollback()
-       return jsonify({"error": str(e)}), 500
+       return error_response(e)
 
 
 
@@ -168,26 +291,10 @@ def get_motion_sensors(layout_id: str):
    
    try:
        # Filter by layout ID and sensor type
-       sensors = Sensor.query.filter_by(floor=layout_id, type="motion").all()
-       result = []
-       for sensor in sensors:
-           result.append({
-               "id": sensor.id,
-               "type": sensor.type,
-               "name": sensor.name,
-               "x": sensor.x,
-               "y": sensor.y,
-               "sensor_rad": sensor.sensor_rad,
-               "connectivity": sensor.connectivity,
-               "connectedDeviceIds": sensor.connectedDeviceIds,
-               "interferenceIds": sensor.interferenceIds,
-               "floor": sensor.floor,
-               "date_created": sensor.date_created.isoformat() if sensor.date_created else None,
-               "date_modified": sensor.date_modified.isoformat() if sensor.date_modified else None,
-           })
-       return jsonify(result), 200
+       query = SENSOR_ROWS.select().where(Sensor.floor == layout_id, Sensor.type == "motion")
+       return collection_response("sensors", SENSOR_ROWS, query)
    except Exception as e:
-       return jsonify({"error": str(e)}), 500
+       return error_response(e)
 
 
 
@@ -203,6 +310,9 @@ def add_or_update_sensor(layout_id: str):
 
 
        sensor = Sensor.query.get(data["id"])
+       previous_floor = sensor.floor if sensor else None
+       previous_interference = list(sensor.interferenceIds or []) if sensor else []
+       recompute = sensor is None or previous_floor != layout_id or needs_recompute(sensor, data, SENSOR_FIELDS)
        if sensor:
            # Update existing sensor
            sensor.type = data.get("type", sensor.type)
@@ -234,11 +344,17 @@ def add_or_update_sensor(layout_id: str):
            db.session.add(sensor)
 
 
+       if recompute:
+           update_node_interference("sensor", sensor, previous_interference)
+       touch_layout(layout_id)
+       if previous_floor is not None and previous_floor != layout_id:
+           touch_layout(previous_floor)
        db.session.commit()
+       floor_indexes.upsert(layout_id, "sensor", sensor.id, sensor.x, sensor.y, sensor.sensor_rad, previous_floor)
        return jsonify({"message": "Sensor saved successfully"}), 200
    except Exception as e:
        db.session.rollback()
-       return jsonify({"error": str(e)}), 500
+       return error_response(e)
 
 
 
@@ -250,12 +366,15 @@ def delete_sensor(layout_id: str, sensor_id: str):
        sensor = Sensor.query.filter_by(id=sensor_id, floor=layout_id).first()
        if not sensor:
            return jsonify({"error": "Sensor not found"}), 404
+       remove_node_interference("sensor", sensor)
        db.session.delete(sensor)
+       touch_layout(layout_id)
        db.session.commit()
+       floor_indexes.remove(layout_id, "sensor", sensor_id)
        return jsonify({"message": f"Sensor '{sensor_id}' deleted successfully."}), 200
    except Exception as e:
        db.session.rollback()
-       return jsonify({"error": str(e)}), 500
+       return error_response(e)
 
 
 
@@ -266,11 +385,9 @@ def delete_sensor(layout_id: str, sensor_id: str):
 def get_persons(layout_id: str):
    
    try:
-       persons = Person.query.filter_by(floor=layout_id).all()
-       result = [person.to_dict() for person in persons]
-       return jsonify(result), 200
+       return collection_response("persons", PERSON_ROWS, PERSON_ROWS.select().where(Person.floor == layout_id))
    except Exception as e:
-       return jsonify({"error": str(e)}), 500
+       return error_response(e)
 
 
 
@@ -287,6 +404,7 @@ def add_or_update_person(layout_id: str):
        if "animationSpeed" not in data:
            return jsonify({"error": "animationSpeed is required"}), 400
        person = Person.query.get(data["id"])
+       previous_floor = person.floor if person else None
        if person:
            # Update existing person
            person.name = data.get("name", person.name)
@@ -318,11 +436,14 @@ def add_or_update_person(layout_id: str):
            db.session.add(person)
            message = "Person added"
            status = 201
+       touch_layout(layout_id)
+       if previous_floor is not None and previous_floor != layout_id:
+           touch_layout(previous_floor)
        db.session.commit()
        return jsonify({"message": message}), status
    except Exception as e:
        db.session.rollback()
-       return jsonify({"error": str(e)}), 500
+       return error_response(e)
 
 
 
@@ -330,15 +451,131 @@ def add_or_update_person(layout_id: str):
  
 
 
+EVENT_PAGE_SIZE = 1000
+EVENT_MAX_PAGE_SIZE = 10000
+
+
+
+
+def parse_ms_timestamp(value) -> datetime:
+   """Milliseconds since epoch (number or numeric string) -> naive UTC datetime."""
+   return datetime.utcfromtimestamp(float(value) / 1000.0)
+
+
+
+
 @app.route("/layouts/<layout_id>/events", methods=["GET"])
 def get_simulation_events(layout_id: str):
-   
+   """
+   Return a floor's events ordered by (timestamp, id).
+
+   Filters: since/until (ms since epoch, inclusive/exclusive), event_type, node_id.
+   Pages hold `limit` events (default 1000, max 10000); the next page's cursor is
+   in X-Next-Cursor. With format=ndjson (or Accept: application/x-ndjson) events
+   are streamed one JSON object per line, unbounded unless `limit` is given, and a
+   trailing {"next_cursor": ...} line marks a truncated page.
+   """
+   ndjson = request.args.get("format") == "ndjson" or (
+       request.accept_mimetypes.best == "application/x-ndjson"
+   )
    try:
-       events = SimulationEvent.query.filter_by(floor=layout_id).all()
-       result = [event.to_dict() for event in events]
-       return jsonify(result), 200
+       limit = request.args.get("limit")
+       limit = int(limit) if limit is not None else (None if ndjson else EVENT_PAGE_SIZE)
+       if limit is not None:
+           if limit < 1:
+               raise ValueError
+           limit = min(limit, EVENT_MAX_PAGE_SIZE)
+   except ValueError:
+       return jsonify({"error": "limit must be a positive integer"}), 400
+
+   # The raw timestamp rides along after the spec's columns for the cursor.
+   query = EVENT_ROWS.select(SimulationEvent.timestamp.label("cursor_ts")).where(SimulationEvent.floor == layout_id)
+   try:
+       if request.args.get("since"):
+           query = query.where(SimulationEvent.timestamp >= parse_ms_timestamp(request.args["since"]))
+       if request.args.get("until"):
+           query = query.where(SimulationEvent.timestamp < parse_ms_timestamp(request.args["until"]))
+   except (ValueError, OverflowError, OSError):
+       return jsonify({"error": "since/until must be milliseconds since epoch"}), 400
+   if request.args.get("event_type"):
+       query = query.where(SimulationEvent.event_type == request.args["event_type"])
+   if request.args.get("node_id"):
+       query = query.where(SimulationEvent.node_id == request.args["node_id"])
+   if request.args.get("cursor"):
+       try:
+           ts_value, event_id = decode_cursor(request.args["cursor"]).split("|", 1)
+           ts = datetime.fromisoformat(ts_value)
+       except (binascii.Error, UnicodeDecodeError, ValueError):
+           return jsonify({"error": "Invalid cursor"}), 400
+       query = query.where(or_(
+           SimulationEvent.timestamp > ts,
+           and_(SimulationEvent.timestamp == ts, SimulationEvent.id > event_id),
+       ))
+   query = query.order_by(SimulationEvent.timestamp, SimulationEvent.id)
+   if limit is not None:
+       # One extra row tells us whether there is a next page.
+       query = query.limit(limit + 1)
+
+   def event_cursor(row) -> str:
+       return encode_cursor(f"{row.cursor_ts.isoformat()}|{row.id}")
+
+   if ndjson:
+       def generate():
+           count = 0
+           last = None
+           result = db.session.connection().execute(query.execution_options(yield_per=EVENT_PAGE_SIZE))
+           for batch in result.partitions(EVENT_PAGE_SIZE):
+               if limit is not None and count + len(batch) > limit:
+                   batch = batch[:limit - count]
+                   if batch:
+                       yield b"".join(json_bytes(EVENT_ROWS.row(row)) + b"\n" for row in batch)
+                       last = batch[-1]
+                   yield json_bytes({"next_cursor": event_cursor(last)}) + b"\n"
+                   return
+               yield b"".join(json_bytes(EVENT_ROWS.row(row)) + b"\n" for row in batch)
+               count += len(batch)
+               last = batch[-1]
+
+       return app.response_class(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+   try:
+       rows = db.session.connection().execute(query).all()
+       has_more = len(rows) > limit
+       rows = rows[:limit]
+       response = app.response_class(json_bytes(EVENT_ROWS.rows(rows)), mimetype="application/json")
+       if has_more:
+           response.headers["X-Next-Cursor"] = event_cursor(rows[-1])
+       return response, 200
+   except Exception as e:
+       return error_response(e)
+
+
+
+
+@app.route("/layouts/<layout_id>/events/counts", methods=["GET"])
+def get_simulation_event_counts(layout_id: str):
+   """
+   Event counts per bucket, node and event type: resolution=minute|hour (default hour),
+   since/until in ms since epoch, optional event_type and node_id. Ranges older than the
+   floor's retention window are answered from the rollups compaction leaves behind,
+   newer ones from the raw events, so totals do not change when events are compacted.
+   """
+   resolution = request.args.get("resolution", "hour")
+   if resolution not in RESOLUTIONS:
+       return jsonify({"error": f"resolution must be one of {sorted(RESOLUTIONS)}"}), 400
+   try:
+       since = parse_ms_timestamp(request.args["since"]) if request.args.get("since") else None
+       until = parse_ms_timestamp(request.args["until"]) if request.args.get("until") else None
+   except (ValueError, OverflowError, OSError):
+       return jsonify({"error": "since/until must be milliseconds since epoch"}), 400
+   try:
+       buckets = event_counts(
+           layout_id, resolution, since, until,
+           node_id=request.args.get("node_id"), event_type=request.args.get("event_type"),
+       )
+       return app.response_class(json_bytes(buckets), mimetype="application/json"), 200
    except Exception as e:
-       return jsonify({"error": str(e)}), 500
+       return error_response(e)
 
 
 
@@ -360,13 +597,13 @@ def add_or_update_simulation_event(layout_id: str):
        if ts_value is not None:
            try:
                # allow numeric or string representation
-               ts_ms = float(ts_value)
-               event_time = datetime.utcfromtimestamp(ts_ms / 1000.0)
+               event_time = parse_ms_timestamp(ts_value)
            except Exception:
                return jsonify({"error": "Invalid timestamp value"}), 400
        else:
            event_time = datetime.utcnow()
        event = SimulationEvent.query.get(data["id"])
+       previous_floor = event.floor if event else None
        if event:
            # Update existing event
            event.floor = layout_id
@@ -394,11 +631,831 @@ def add_or_update_simulation_event(layout_id: str):
            db.session.add(event)
            message = "Event added"
            status = 201
+       touch_layout(layout_id)
+       if previous_floor is not None and previous_floor != layout_id:
+           touch_layout(previous_floor)
        db.session.commit()
        return jsonify({"message": message}), status
    except Exception as e:
        db.session.rollback()
-       return jsonify({"error": str(e)}), 500
+       return error_response(e)
+
+
+
+
+def bulk_save(spec, layout_id: str, spatial: bool, collection: str):
+   """
+   Shared body of the :bulk routes. Accepts a JSON array (or {"items": [...]}),
+   or a columnar payload (columnar.py) holding the route's collection, writes
+   every valid item in one transaction and reports a status per item.
+   interferenceIds/connected*Ids are stored as posted; use the recompute routes
+   to derive them server-side.
+   """
+   try:
+       if request.mimetype == COLUMNAR_MIMETYPE:
+           try:
+               _, collections = decode_columnar(request.get_data())
+           except ValueError as e:
+               return error_response(e, 400)
+           if collection not in collections:
+               return jsonify({"error": f"Columnar payload has no {collection} collection"}), 400
+           items = collections[collection]
+       else:
+           data = request.get_json(force=True)
+           items = data.get("items") if isinstance(data, dict) else data
+       if not isinstance(items, list):
+           return jsonify({"error": "A JSON array of items is required"}), 400
+
+       statuses, rows, previous_floors = bulk_upsert(spec, layout_id, items)
+       touched = {layout_id, *previous_floors.values()} if rows else set()
+       record_rows(layout_id, collection, rows)
+       for item_id, floor in previous_floors.items():
+           if floor != layout_id:
+               record_deletes(floor, collection, [item_id])
+       for floor in touched:
+           touch_layout(floor)
+       db.session.commit()
+
+       if spatial:
+           # Cheaper to rebuild lazily on the next query than to patch thousands of cells.
+           for floor in touched:
+               floor_indexes.drop(floor)
+
+       counts = {"created": 0, "updated": 0, "error": 0}
+       for status in statuses:
+           counts[status["status"]] += 1
+       return jsonify({
+           "created": counts["created"],
+           "updated": counts["updated"],
+           "errors": counts["error"],
+           "items": statuses,
+       }), 200
+   except Exception as e:
+       db.session.rollback()
+       return error_response(e)
+
+
+
+
+@app.route("/layouts/<layout_id>/devices:bulk", methods=["PUT"])
+def bulk_save_devices(layout_id: str):
+   
+   return bulk_save(DEVICE_SPEC, layout_id, spatial=True, collection="devices")
+
+
+
+
+@app.route("/layouts/<layout_id>/sensors:bulk", methods=["PUT"])
+def bulk_save_sensors(layout_id: str):
+   
+   return bulk_save(SENSOR_SPEC, layout_id, spatial=True, collection="sensors")
+
+
+
+
+@app.route("/layouts/<layout_id>/persons:bulk", methods=["PUT"])
+def bulk_save_persons(layout_id: str):
+   
+   return bulk_save(PERSON_SPEC, layout_id, spatial=False, collection="persons")
+
+
+
+
+@app.route("/layouts/<layout_id>/snapshot", methods=["GET"])
+def get_layout_snapshot(layout_id: str):
+   """
+   Rooms, devices, sensors, persons and events of a floor in one response, ETag'd by layout version.
+   Accept: application/vnd.sensor-planner.columnar selects the binary format (columnar.py).
+   """
+   try:
+       layout = db.session.get(Layout, layout_id)
+       if layout is None:
+           return jsonify({"error": "Layout not found"}), 404
+
+       columnar = wants_columnar()
+       etag = layout_etag(layout.id, layout.version) + (":columnar" if columnar else "")
+       if request.if_none_match.contains(etag):
+           response = app.response_class(status=304)
+       elif columnar:
+           response = app.response_class(snapshot_bytes(layout, "columnar"), status=200, mimetype=COLUMNAR_MIMETYPE)
+       else:
+           response = app.response_class(snapshot_bytes(layout), status=200, mimetype="application/json")
+       response.set_etag(etag)
+       response.vary.add("Accept")
+       response.headers["Cache-Control"] = "no-cache"
+       return response
+   except Exception as e:
+       return error_response(e)
+
+
+
+
+STREAM_KEEPALIVE = 15.0  # seconds between comment lines on an idle stream
+STREAM_RETRY_MS = 3000
+
+
+
+
+@app.route("/layouts/<layout_id>/stream", methods=["GET"])
+def stream_layout_changes(layout_id: str):
+   """
+   Server-sent events of the floor's changes. Each `change` event carries
+   {"upserted": {collection: [rows]}, "deleted": {collection: [ids]}} for one
+   layout version, which is also its event id. Upserted rows may be partial
+   (e.g. only connectedDeviceIds after a recompute); merge them by id.
+
+   A reconnect with Last-Event-ID (or ?since=) replays what it missed, from
+   the in-memory feed or else as one change event built from the change log;
+   when neither reaches back that far a `reset` event tells the client to
+   refetch /snapshot and continue from the id it carries. A version skipped
+   by the live feed is filled in the same way before the change after it.
+   `deleted` ends the stream.
+   """
+   last_id = request.headers.get("Last-Event-ID") or request.args.get("since")
+   try:
+       after = int(last_id) if last_id not in (None, "") else None
+   except ValueError:
+       return jsonify({"error": "Last-Event-ID/since must be a layout version"}), 400
+
+   try:
+       layout = db.session.execute(
+           select(Layout.version, Layout.change_log_start).where(Layout.id == layout_id)
+       ).first()
+       if layout is None:
+           return jsonify({"error": "Layout not found"}), 404
+       version = layout.version
+       generation = change_feed.generation(layout_id)
+       catch_up = None
+       if after is not None and not change_feed.resumable(layout_id, after, version):
+           catch_up = logged_delta(layout_id, layout.change_log_start, after, version)
+   except Exception as e:
+       return error_response(e)
+   finally:
+       db.session.remove()  # the stream may stay open for hours; hold no connection
+
+   def generate():
+       cursor = after
+       yield f"retry: {STREAM_RETRY_MS}\n\n"
+       if catch_up is not None:
+           yield f"id: {version}\nevent: change\ndata: {catch_up}\n\n"
+           cursor = version
+       elif cursor is None or not change_feed.resumable(layout_id, cursor, version):
+           event = "ready" if cursor is None else "reset"
+           yield f'id: {version}\nevent: {event}\ndata: {{"version": {version}}}\n\n'
+           cursor = version
+       while True:
+           entries = change_feed.wait(layout_id, cursor, generation, STREAM_KEEPALIVE)
+           if entries is None:
+               yield f'event: deleted\ndata: {{"layout_id": {json_dumps(layout_id)}}}\n\n'
+               return
+           if not entries:
+               yield ": keepalive\n\n"
+           for entry_version, data in entries:
+               if entry_version > cursor + 1:
+                   # Versions bumped without reaching the feed (another worker, a
+                   # fallback write): send them together with this one from the log.
+                   gap = fill_gap(layout_id, cursor, entry_version)
+                   event = "reset" if gap is None else "change"
+                   data = f'{{"version": {entry_version}}}' if gap is None else gap
+               else:
+                   event = "change"
+               yield f"id: {entry_version}\nevent: {event}\ndata: {data}\n\n"
+               cursor = entry_version
+
+   response = app.response_class(generate(), mimetype="text/event-stream")
+   response.headers["Cache-Control"] = "no-cache"
+   response.headers["X-Accel-Buffering"] = "no"  # don't let a proxy buffer the stream
+   return response
+
+
+
+
+def logged_delta(layout_id: str, log_start: int, after: int, until: int):
+   """The change log's delta for versions after < v <= until as JSON, or None when the log starts later."""
+   if not log_start <= after < until:
+       return None
+   return json_dumps(compact_delta(changes_since(layout_id, after, until)))
+
+
+def fill_gap(layout_id: str, after: int, until: int):
+   """logged_delta for a stream outside any request; None (send reset) if the log can't be read either."""
+   with app.app_context():
+       try:
+           log_start = db.session.execute(
+               select(Layout.change_log_start).where(Layout.id == layout_id)
+           ).scalar()
+           if log_start is None:
+               return None
+           return logged_delta(layout_id, log_start, after, until)
+       except Exception:
+           logger.exception("Could not read the change log of %s", layout_id)
+           return None
+       finally:
+           db.session.remove()
+
+
+def compact_delta(changes: dict) -> dict:
+   """Leave out empty upserted/deleted sections, as the live feed does."""
+   return {key: value for key, value in changes.items() if value}
+
+
+
+
+@app.route("/layouts/<layout_id>/changes", methods=["GET"])
+def get_layout_changes(layout_id: str):
+   """
+   Devices, sensors, persons and events written on the floor after version
+   ?since=N (current rows), plus the ids deleted or moved off it since.
+   Apply to the state at N and continue from the returned version.
+
+   410 when N predates the change log (or is from another database); refetch
+   /snapshot then.
+   """
+   try:
+       since = int(request.args["since"])
+       if since < 0:
+           raise ValueError
+   except (KeyError, ValueError):
+       return jsonify({"error": "since must be a layout version >= 0"}), 400
+
+   try:
+       layout = db.session.get(Layout, layout_id)
+       if layout is None:
+           return jsonify({"error": "Layout not found"}), 404
+       version = layout.version
+       if since < layout.change_log_start or since > version:
+           return jsonify({"error": "Changes since this version are not available", "version": version}), 410
+
+       etag = f"{layout_etag(layout.id, version)}:changes:{since}"
+       if request.if_none_match.contains(etag):
+           response = app.response_class(status=304)
+       else:
+           changes = changes_since(layout_id, since, version) if since < version else {"upserted": {}, "deleted": {}}
+           body = {"layout_id": layout_id, "since": since, "version": version}
+           body.update(changes)
+           response = app.response_class(json_bytes(body), status=200, mimetype="application/json")
+       response.set_etag(etag)
+       response.headers["Cache-Control"] = "no-cache"
+       return response
+   except Exception as e:
+       return error_response(e)
+
+
+
+
+@app.route("/layouts/<layout_id>/coverage", methods=["GET"])
+def get_layout_coverage(layout_id: str):
+   """
+   Share of each room's area covered by at least one / two sensors, from a
+   rasterised grid cached per layout version (see coverage.py).
+
+   ?resolution= sets the cell size in pixels; ?heatmap=png|rle adds the grid.
+   """
+   try:
+       resolution = float(request.args.get("resolution", DEFAULT_COVERAGE_RESOLUTION))
+       if resolution <= 0:
+           raise ValueError
+   except ValueError:
+       return jsonify({"error": "resolution must be a number > 0"}), 400
+   heatmap = request.args.get("heatmap") or None
+   if heatmap is not None and heatmap not in HEATMAP_ENCODINGS:
+       return jsonify({"error": f"heatmap must be one of {', '.join(HEATMAP_ENCODINGS)}"}), 400
+
+   try:
+       layout = db.session.get(Layout, layout_id)
+       if layout is None:
+           return jsonify({"error": "Layout not found"}), 404
+
+       etag = f"{layout_etag(layout.id, layout.version)}:coverage:{resolution:g}:{heatmap or ''}"
+       if request.if_none_match.contains(etag):
+           response = app.response_class(status=304)
+       else:
+           body = coverage_cache.cached(layout.id, resolution, layout.version, heatmap)
+           if body is None:
+               rooms = db.session.execute(
+                   select(Room.id, Room.name, Room.x, Room.y, Room.width, Room.height)
+                   .where(Room.layout_id == layout_id)
+                   .order_by(Room.id)
+               ).all()
+               sensors = db.session.execute(
+                   select(Sensor.id, Sensor.x, Sensor.y, Sensor.sensor_rad).where(Sensor.floor == layout_id)
+               ).all()
+               body = coverage_cache.render(layout.id, resolution, layout.version, heatmap, rooms, sensors)
+           response = app.response_class(body, status=200, mimetype="application/json")
+       response.set_etag(etag)
+       response.headers["Cache-Control"] = "no-cache"
+       return response
+   except ValueError as e:
+       return error_response(e, 400)
+   except Exception as e:
+       return error_response(e)
+
+
+
+
+@app.route("/layouts/<layout_id>/stats", methods=["GET"])
+def get_layout_stats(layout_id: str):
+   """
+   Per-sensor trigger counts and START -> END dwell times, per-room trigger
+   histograms (`interval` seconds per bucket, a multiple of 60), the busiest
+   buckets and log counts per room and effect. Compacted events count by the
+   hour; dwell covers the raw events in `dwell_range`. See stats.py.
+   """
+   try:
+       interval = int(request.args.get("interval", STATS_DEFAULT_INTERVAL))
+       if interval <= 0 or interval % 60:
+           raise ValueError
+   except ValueError:
+       return jsonify({"error": "interval must be a positive multiple of 60 seconds"}), 400
+
+   try:
+       layout = db.session.execute(
+           select(Layout.id, Layout.version, Layout.change_log_start).where(Layout.id == layout_id)
+       ).first()
+       if layout is None:
+           return jsonify({"error": "Layout not found"}), 404
+       # Logs do not bump the layout version, so the newest one is part of the validator.
+       log_id = last_log_id(layout_id)
+       etag = f"{layout_etag(layout.id, layout.version)}:stats:{log_id or 0}:{interval}"
+       if request.if_none_match.contains(etag):
+           response = app.response_class(status=304)
+       else:
+           body = stats_cache.cached(layout.id, layout.version, log_id, interval)
+           if body is None:
+               body = stats_cache.render(layout.id, layout.version, layout.change_log_start, log_id, interval)
+           response = app.response_class(body, status=200, mimetype="application/json")
+       response.set_etag(etag)
+       response.headers["Cache-Control"] = "no-cache"
+       return response
+   except Exception as e:
+       db.session.rollback()
+       return error_response(e)
+
+
+
+
+@app.route("/layouts/<layout_id>/nodes/near", methods=["GET"])
+def get_nodes_near(layout_id: str):
+   """Return sensors and devices whose centre lies within r of (x, y), nearest first."""
+   try:
+       x = float(request.args["x"])
+       y = float(request.args["y"])
+       r = float(request.args["r"])
+   except (KeyError, ValueError):
+       return jsonify({"error": "Numeric x, y and r query parameters are required"}), 400
+   if not all(math.isfinite(v) for v in (x, y, r)):
+       return jsonify({"error": "x, y and r must be finite"}), 400
+   if r < 0:
+       return jsonify({"error": "r must be non-negative"}), 400
+   kind = request.args.get("type")
+   if kind not in (None, "sensor", "device"):
+       return jsonify({"error": "type must be 'sensor' or 'device'"}), 400
+
+   try:
+       result = []
+       for node_kind, node_id, distance, (nx, ny, radius) in floor_indexes.query(layout_id, x, y, r, kind):
+           result.append({
+               "id": node_id,
+               "type": node_kind,
+               "x": nx,
+               "y": ny,
+               "radius": radius,
+               "distance": distance,
+           })
+       return jsonify(result), 200
+   except Exception as e:
+       return error_response(e)
+
+
+
+
+def store_model(layout_id: str, model: str) -> None:
+   """Remember the floor's propagation model for later recomputes and upserts; the caller commits."""
+   db.session.execute(
+       update(Layout).where(Layout.id == layout_id).values(propagation_model=None if model == "radius" else model)
+   )
+
+
+
+
+@app.route("/layouts/<layout_id>/connectivity/recompute", methods=["POST"])
+def recompute_connectivity(layout_id: str):
+   """
+   Recompute sensor/device connections for a floor and persist both adjacency lists.
+
+   ?model=walls attenuates each link by the room walls it crosses (see
+   propagation.py) instead of the plain radius check. The model is stored on
+   the floor and used when ?model is left out, here, for interference
+   recomputes and by the upsert routes' incremental interference updates.
+   """
+   model = request.args.get("model")
+   if model not in (None, "radius", "walls"):
+       return jsonify({"error": "model must be radius or walls"}), 400
+   try:
+       model = model or floor_model(layout_id)
+       sensors = db.session.execute(
+           select(
+               Sensor.id, Sensor.name, Sensor.type, Sensor.x, Sensor.y, Sensor.sensor_rad,
+               Sensor.connectivity, Sensor.connectedDeviceIds,
+           ).where(Sensor.floor == layout_id)
+       ).all()
+       devices = db.session.execute(
+           select(
+               Device.id, Device.x, Device.y, Device.device_rad, Device.connectivity,
+               Device.compatibleSensors, Device.connectedSensorIds,
+           ).where(Device.floor == layout_id)
+       ).all()
+
+       sensor_links, device_links = compute_connectivity(sensors, devices, floor_propagation(layout_id, model))
+       store_model(layout_id, model)
+       now = datetime.utcnow()
+
+       sensor_updates = []
+       events = []
+       for sensor in sensors:
+           links = sensor_links[sensor.id]
+           if links == (sensor.connectedDeviceIds or []):
+               continue
+           sensor_updates.append({"id": sensor.id, "connectedDeviceIds": links, "date_modified": now})
+           added, removed = connection_changes(sensor.connectedDeviceIds, links)
+           for device_id, verb in [(d, "connected to") for d in added] + [(d, "disconnected from") for d in removed]:
+               events.append({
+                   "id": str(uuid.uuid4()),
+                   "floor": layout_id,
+                   "node_id": sensor.id,
+                   "node_type": "sensor",
+                   "event_type": "connectivity",
+                   "timestamp": now,
+                   "message": f'Sensor "{sensor.name}" {verb} Device ID "{device_id}"',
+                   "date_created": now,
+                   "date_modified": now,
+               })
+
+       device_updates = [
+           {"id": device.id, "connectedSensorIds": device_links[device.id], "date_modified": now}
+           for device in devices
+           if device_links[device.id] != (device.connectedSensorIds or [])
+       ]
+
+       # Single transaction: both adjacency lists and the change events land together.
+       if sensor_updates:
+           db.session.execute(update(Sensor), sensor_updates)
+       if device_updates:
+           db.session.execute(update(Device), device_updates)
+       if events:
+           db.session.execute(insert(SimulationEvent), events)
+       if sensor_updates or device_updates:
+           record_rows(layout_id, "sensors", sensor_updates)
+           record_rows(layout_id, "devices", device_updates)
+           record_rows(layout_id, "events", events)
+           touch_layout(layout_id)
+       db.session.commit()
+
+       return jsonify({
+           "message": "Connectivity recomputed",
+           "model": model,
+           "sensors_updated": len(sensor_updates),
+           "devices_updated": len(device_updates),
+           "connections": sum(len(ids) for ids in sensor_links.values()),
+           "events": len(events),
+       }), 200
+   except Exception as e:
+       db.session.rollback()
+       return error_response(e)
+
+
+
+
+@app.route("/layouts/<layout_id>/interference/recompute", methods=["POST"])
+def recompute_interference(layout_id: str):
+   """
+   Rebuild interferenceIds for a whole floor; the upsert routes keep it current afterwards.
+
+   ?model=walls counts only pairs still in range through the walls between
+   them; the model is stored on the floor as for connectivity/recompute.
+   """
+   model = request.args.get("model")
+   if model not in (None, "radius", "walls"):
+       return jsonify({"error": "model must be radius or walls"}), 400
+   try:
+       model = model or floor_model(layout_id)
+       sensors = db.session.execute(
+           select(
+               Sensor.id, Sensor.x, Sensor.y, Sensor.sensor_rad, Sensor.connectivity,
+               Sensor.connectedDeviceIds, Sensor.interferenceIds,
+           ).where(Sensor.floor == layout_id)
+       ).all()
+       devices = db.session.execute(
+           select(
+               Device.id, Device.x, Device.y, Device.device_rad, Device.connectivity,
+               Device.interferenceProtocols, Device.connectedSensorIds, Device.interferenceIds,
+           ).where(Device.floor == layout_id)
+       ).all()
+
+       sensor_links, device_links = compute_interference(sensors, devices, floor_propagation(layout_id, model))
+       store_model(layout_id, model)
+       now = datetime.utcnow()
+       sensor_updates = [
+           {"id": s.id, "interferenceIds": sensor_links[s.id], "date_modified": now}
+           for s in sensors
+           if sensor_links[s.id] != (s.interferenceIds or [])
+       ]
+       device_updates = [
+           {"id": d.id, "interferenceIds": device_links[d.id], "date_modified": now}
+           for d in devices
+           if device_links[d.id] != (d.interferenceIds or [])
+       ]
+       if sensor_updates:
+           db.session.execute(update(Sensor), sensor_updates)
+       if device_updates:
+           db.session.execute(update(Device), device_updates)
+       if sensor_updates or device_updates:
+           record_rows(layout_id, "sensors", sensor_updates)
+           record_rows(layout_id, "devices", device_updates)
+           touch_layout(layout_id)
+       db.session.commit()
+
+       return jsonify({
+           "message": "Interference recomputed",
+           "model": model,
+           "sensors_updated": len(sensor_updates),
+           "devices_updated": len(device_updates),
+           "pairs": sum(len(ids) for ids in sensor_links.values()),
+       }), 200
+   except Exception as e:
+       db.session.rollback()
+       return error_response(e)
+
+
+
+
+SIMULATION_DEFAULT_DT = 1 / 60
+SIMULATION_MAX_STEPS = 1_000_000
+
+
+
+
+@app.route("/layouts/<layout_id>/simulate", methods=["POST"])
+def simulate_layout(layout_id: str):
+   """
+   Advance every person on the floor by `duration` seconds in steps of `dt`,
+   record motion START/END events and persist the people's final positions.
+   Detections still open at the end are stored on the layout, so the next
+   call continues the same timeline instead of starting every one again.
+   Events are timestamped so the simulated span ends at the time of the call.
+   """
+   try:
+       duration = float(request.args.get("duration", 1.0))
+       dt = float(request.args.get("dt", SIMULATION_DEFAULT_DT))
+       if duration < 0 or dt <= 0:
+           raise ValueError
+   except ValueError:
+       return jsonify({"error": "duration must be >= 0 and dt > 0 (seconds)"}), 400
+   steps = int(round(duration / dt))
+   if steps > SIMULATION_MAX_STEPS:
+       return jsonify({"error": f"duration/dt exceeds {SIMULATION_MAX_STEPS} steps"}), 400
+
+   try:
+       people = db.session.execute(
+           select(
+               Person.id, Person.name, Person.path, Person.currentIndex, Person.direction,
+               Person.progress, Person.animationSpeed,
+           ).where(Person.floor == layout_id)
+       ).all()
+       sensors = db.session.execute(
+           select(Sensor.id, Sensor.name, Sensor.type, Sensor.x, Sensor.y, Sensor.sensor_rad)
+           .where(Sensor.floor == layout_id)
+       ).all()
+
+       active = db.session.execute(select(Layout.motion_active).where(Layout.id == layout_id)).scalar()
+
+       sim = MotionSimulation(people, sensors)
+       sim.restore_active(active)
+       events = sim.run(duration, dt)
+
+       now = datetime.utcnow()
+       person_updates = [dict(state, date_modified=now) for state in sim.person_states()]
+       # The simulated span ends now, so a long run is back-dated rather than stamped in the future.
+       event_rows = sim.event_rows(events, layout_id, now - timedelta(seconds=sim.elapsed))
+       if person_updates:
+           db.session.execute(update(Person), person_updates)
+       if event_rows:
+           db.session.execute(insert(SimulationEvent), event_rows)
+       if person_updates or event_rows:
+           record_rows(layout_id, "persons", person_updates)
+           record_rows(layout_id, "events", event_rows)
+           touch_layout(layout_id)
+       active_pairs = sim.active_pairs()
+       if active_pairs != (active or []):
+           db.session.execute(update(Layout).where(Layout.id == layout_id).values(motion_active=active_pairs))
+       db.session.commit()
+
+       return jsonify({
+           "message": "Simulation complete",
+           "steps": steps,
+           "persons": len(people),
+           "sensors": len(sim.sensors),
+           "motion_starts": sum(1 for e in events if e[1] == "START"),
+           "motion_ends": sum(1 for e in events if e[1] == "END"),
+       }), 200
+   except Exception as e:
+       db.session.rollback()
+       return error_response(e)
+
+
+
+
+def parse_scenario_params(layout_id: str, data: dict) -> dict:
+   """Validated scenario-run parameters; ValueError on bad input."""
+   if layout_id is None:
+       raise ValueError("layout_id is required")
+   variations = data.get("variations") or []
+   try:
+       duration = float(data.get("duration", 3600.0))
+       dt = float(data.get("dt", SIMULATION_DEFAULT_DT))
+       workers = int(data["workers"]) if data.get("workers") is not None else None
+       if duration < 0 or dt <= 0 or (workers is not None and workers < 1):
+           raise ValueError
+   except (TypeError, ValueError):
+       raise ValueError("duration must be >= 0, dt > 0 (seconds) and workers >= 1") from None
+   if not isinstance(variations, list) or not all(isinstance(v, dict) for v in variations):
+       raise ValueError("variations must be a list of objects")
+   for variation in variations:
+       check_variation(variation)
+   return {"duration": duration, "dt": dt, "workers": workers, "variations": variations}
+
+
+
+
+@job_runner.handler("scenarios", parse_scenario_params)
+def scenario_results(layout_id: str, params: dict, progress=None) -> dict:
+   """Load the floor, then fast-forward it and every variation (see scenarios.py)."""
+   rooms = db.session.execute(
+       select(Room.id, Room.x, Room.y, Room.width, Room.height)
+       .where(Room.layout_id == layout_id)
+       .order_by(Room.id)
+   ).all()
+   people = db.session.execute(
+       select(
+           Person.id, Person.path, Person.currentIndex, Person.direction,
+           Person.progress, Person.animationSpeed,
+       ).where(Person.floor == layout_id)
+   ).all()
+   sensors = db.session.execute(
+       select(Sensor.id, Sensor.type, Sensor.x, Sensor.y, Sensor.sensor_rad, Sensor.connectivity)
+       .where(Sensor.floor == layout_id)
+   ).all()
+   devices = db.session.execute(
+       select(Device.id, Device.x, Device.y, Device.device_rad, Device.connectivity, Device.compatibleSensors)
+       .where(Device.floor == layout_id)
+   ).all()
+   db.session.rollback()  # release the read transaction while the workers run
+
+   dt, variations = params["dt"], params["variations"]
+   steps = int(round(params["duration"] / dt))
+   base = ScenarioBase(rooms, people, sensors, devices, variations)
+   results = run_scenarios(base, variations, steps, dt, params["workers"], progress)
+   return {"steps": steps, "dt": dt, "scenarios": results}
+
+
+
+
+@app.route("/layouts/<layout_id>/scenarios", methods=["POST"])
+def run_layout_scenarios(layout_id: str):
+   """
+   Fast-forward the floor and each variation in the body over `duration`
+   seconds (in parallel worker processes) and return comparable totals.
+
+   Body: {"duration": 3600, "dt": 0.1, "workers": 8, "variations": [...]};
+   see scenarios.py for the variation fields. Nothing is persisted. For long
+   runs, POST /jobs with kind "scenarios" and the same body as params.
+   """
+   try:
+       params = parse_scenario_params(layout_id, request.get_json(silent=True) or {})
+       return jsonify(scenario_results(layout_id, params)), 200
+   except ValueError as e:
+       return error_response(e, 400)
+   except Exception as e:
+       db.session.rollback()
+       return error_response(e)
+
+
+
+
+def parse_optimize_params(layout_id: str, data: dict) -> dict:
+   """Validated placement-optimisation parameters; ValueError on bad input."""
+   if layout_id is None:
+       raise ValueError("layout_id is required")
+   try:
+       params = {
+           "budget": float(data["budget"]),
+           "catalogue": [
+               {"type": str(c["type"]), "radius": float(c["radius"]), "cost": float(c["cost"])}
+               for c in (data.get("catalogue") or DEFAULT_CATALOGUE)
+           ],
+           "resolution": float(data.get("resolution", DEFAULT_RESOLUTION)),
+           "population": int(data.get("population", 40)),
+           "generations": int(data.get("generations", 60)),
+           "seed": int(data["seed"]) if data.get("seed") is not None else None,
+           "workers": int(data["workers"]) if data.get("workers") is not None else None,
+       }
+   except (KeyError, TypeError, ValueError):
+       raise ValueError("budget is required; catalogue entries need type, radius and cost") from None
+   if params["budget"] <= 0 or params["resolution"] <= 0 or params["population"] < 2 or params["generations"] < 1:
+       raise ValueError("budget and resolution must be > 0, population >= 2 and generations >= 1")
+   return params
+
+
+
+
+@job_runner.handler("optimize", parse_optimize_params)
+def optimize_placement(layout_id: str, params: dict, progress=None) -> dict:
+   """Best sensor placement for the floor's rooms (see optimizer.py)."""
+   rooms = db.session.execute(
+       select(Room.x, Room.y, Room.width, Room.height).where(Room.layout_id == layout_id).order_by(Room.id)
+   ).all()
+   db.session.rollback()
+   return optimize(room_rects(rooms), progress=progress, **params)
+
+
+
+
+@app.route("/layouts/<layout_id>/optimize", methods=["POST"])
+def optimize_layout(layout_id: str):
+   """
+   Start a sensor placement optimisation over the floor's rooms.
+
+   Body: {"budget": 12, "catalogue": [{"type", "radius", "cost"}, ...],
+   "resolution": 10, "population": 40, "generations": 60, "seed": 1}.
+   Runs may take minutes, so this answers 202 with a job to poll at /jobs/<id>.
+   """
+   if not layout_has_rooms(layout_id):
+       return jsonify({"error": "Layout has no rooms"}), 404
+   return enqueue_job("optimize", layout_id, request.get_json(silent=True) or {})
+
+
+def layout_has_rooms(layout_id) -> bool:
+   """Checked before queueing an optimisation, which has nothing to place sensors in otherwise."""
+   return db.session.execute(select(Room.id).where(Room.layout_id == layout_id).limit(1)).first() is not None
+
+
+
+
+def enqueue_job(kind: str, layout_id, data: dict):
+   """Queue a job owned by the layout's session and answer 202 with its Location."""
+   session_id = None
+   if layout_id is not None:
+       session_id = db.session.execute(
+           select(Layout.owner_session_id).where(Layout.id == layout_id)
+       ).scalar()
+       if session_id is None:
+           return jsonify({"error": "Layout not found"}), 404
+   try:
+       job = job_runner.enqueue(kind, layout_id, session_id, data)
+   except ValueError as e:
+       return error_response(e, 400)
+   return jsonify(job.to_dict()), 202, {"Location": f"/jobs/{job.id}"}
+
+
+
+
+@app.route("/jobs", methods=["POST"])
+def create_job():
+   """
+   Queue a background job.
+
+   Body: {"kind": "optimize" | "scenarios", "layout_id": "...", "params": {...}};
+   params are the body the matching layout route takes.
+   """
+   data = request.get_json(silent=True) or {}
+   params = data.get("params") or {}
+   if not isinstance(params, dict):
+       return jsonify({"error": "params must be an object"}), 400
+   if data.get("kind") == "optimize" and data.get("layout_id") is not None and not layout_has_rooms(data["layout_id"]):
+       return jsonify({"error": "Layout has no rooms"}), 404
+   return enqueue_job(data.get("kind"), data.get("layout_id"), params)
+
+
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id: str):
+   """Status, progress (0-1) and, once done, the result or error of a job."""
+   job = db.session.get(Job, job_id)
+   if job is None:
+       return jsonify({"error": "Job not found"}), 404
+   return jsonify(job.to_dict()), 200
+
+
+
+
+@app.route("/jobs/<job_id>/cancel", methods=["POST"])
+def cancel_job(job_id: str):
+   """Cancel a queued job, or ask a running one to stop at its next progress report."""
+   job = job_runner.cancel(job_id)
+   if job is None:
+       return jsonify({"error": "Job not found"}), 404
+   return jsonify(job.to_dict()), 200
 
 
 
@@ -456,35 +1513,83 @@ def create_layout_with_rooms():
        return jsonify({"message": "Layout and rooms created successfully", "layout_id": layout.id}), 201
    except Exception as e:
        db.session.rollback()
-       return jsonify({"error": str(e)}), 400
+       return error_response(e, 400)
+
+
+
+
+LAYOUT_FIELDS = ("id", "name", "owner_session_id", "version", "rooms")
+LAYOUT_PAGE_SIZE = 100
+LAYOUT_MAX_PAGE_SIZE = 500
 
 
 
 
 @app.route("/layouts", methods=["GET"])
 def get_all_layouts():
-   """Return a list of all layouts and their rooms."""
-   layouts = Layout.query.all()
+   """
+   Return one page of layouts (ordered by id) and their rooms.
+
+   Query params: owner_session_id, limit (default 100, max 500), cursor (from the
+   previous page's X-Next-Cursor header) and fields (comma-separated subset of
+   id,name,owner_session_id,version,rooms). The body stays a plain array; the
+   next page is advertised via X-Next-Cursor and a Link header.
+   """
+   try:
+       limit = min(int(request.args.get("limit", LAYOUT_PAGE_SIZE)), LAYOUT_MAX_PAGE_SIZE)
+       if limit < 1:
+           raise ValueError
+   except ValueError:
+       return jsonify({"error": "limit must be a positive integer"}), 400
+
+   fields = LAYOUT_FIELDS
+   if request.args.get("fields"):
+       fields = tuple(f.strip() for f in request.args["fields"].split(",") if f.strip())
+       unknown = [f for f in fields if f not in LAYOUT_FIELDS]
+       if unknown:
+           return jsonify({"error": f"Unknown fields: {', '.join(unknown)}"}), 400
+
+   query = Layout.query.order_by(Layout.id)
+   owner = request.args.get("owner_session_id")
+   if owner:
+       query = query.filter(Layout.owner_session_id == owner)
+   cursor = request.args.get("cursor")
+   if cursor:
+       try:
+           query = query.filter(Layout.id > decode_cursor(cursor))
+       except (binascii.Error, UnicodeDecodeError, ValueError):
+           return jsonify({"error": "Invalid cursor"}), 400
+
+   columns = [getattr(Layout, f) for f in fields if f not in ("id", "rooms")]
+   query = query.options(load_only(Layout.id, *columns))
+   if "rooms" in fields:
+       # One extra IN query for the whole page instead of one per layout.
+       query = query.options(selectinload(Layout.rooms))
+
+   # Fetch one extra row to know whether another page exists.
+   layouts = query.limit(limit + 1).all()
+   has_more = len(layouts) > limit
+   layouts = layouts[:limit]
+
    result = []
    for layout in layouts:
-       layout_data = {
-           "id": layout.id,
-           "name": layout.name,
-           "owner_session_id": layout.owner_session_id,
-           "rooms": [
-               {
-                   "id": room.id,
-                   "name": room.name,
-                   "x": room.x,
-                   "y": room.y,
-                   "width": room.width,
-                   "height": room.height,
-               }
-               for room in layout.rooms
-           ],
-       }
+       layout_data = {}
+       for field in fields:
+           if field == "rooms":
+               layout_data["rooms"] = [room.to_dict() for room in layout.rooms]
+           else:
+               layout_data[field] = getattr(layout, field)
        result.append(layout_data)
-   return jsonify(result), 200
+
+   response = jsonify(result)
+   if has_more:
+       next_cursor = encode_cursor(layouts[-1].id)
+       args = request.args.to_dict()
+       args["cursor"] = next_cursor
+       next_url = f"{request.base_url}?{urlencode(args)}"
+       response.headers["X-Next-Cursor"] = next_cursor
+       response.headers["Link"] = f'<{next_url}>; rel="next"'
+   return response, 200
 
 
 
@@ -493,21 +1598,108 @@ def get_all_layouts():
 def delete_layout(layout_id: str):
    
    try:
-       layout = Layout.query.filter_by(id=layout_id).first()
-       if not layout:
+       if db.session.execute(select(Layout.id).where(Layout.id == layout_id)).first() is None:
            return jsonify({"error": "Layout not found"}), 404
-       # Delete devices and sensors on this layout
-       Device.query.filter_by(floor=layout_id).delete(synchronize_session=False)
-       Sensor.query.filter_by(floor=layout_id).delete(synchronize_session=False)
-       # Delete rooms (cascades to nothing else now)
-       Room.query.filter_by(layout_id=layout_id).delete(synchronize_session=False)
-       # Delete the layout itself
-       db.session.delete(layout)
+       # Set-based: one DELETE per table in this transaction, nothing loaded into the session.
+       deleted = delete_layout_rows(layout_id)
+       db.session.commit()
+       floor_indexes.drop(layout_id)
+       snapshot_cache.drop(layout_id)
+       coverage_cache.drop(layout_id)
+       propagation_cache.drop(layout_id)
+       stats_cache.drop(layout_id)
+       change_feed.drop(layout_id)
+       return jsonify({"message": f"Layout {layout_id} deleted successfully", "deleted": deleted}), 200
+   except Exception as e:
+       db.session.rollback()
+       return error_response(e)
+
+
+@app.route("/layouts/<layout_id>/clone", methods=["POST"])
+def clone_layout(layout_id: str):
+   """
+   Copy a floor (rooms, devices, sensors, persons and, unless "events": false,
+   its simulation events and their rollups) with INSERT ... SELECT statements in one transaction.
+   Optional body: {"name", "owner_session_id", "events"}.
+   """
+   data = request.get_json(silent=True) or {}
+   try:
+       source = db.session.execute(
+           select(Layout.name, Layout.owner_session_id, Layout.event_retention_seconds).where(Layout.id == layout_id)
+       ).first()
+       if source is None:
+           return jsonify({"error": "Layout not found"}), 404
+       result = clone_layout_rows(
+           layout_id,
+           name=data.get("name") or f"{source.name} (copy)",
+           owner_session_id=data.get("owner_session_id", source.owner_session_id),
+           events=bool(data.get("events", True)),
+           event_retention_seconds=source.event_retention_seconds,
+       )
        db.session.commit()
-       return jsonify({"message": f"Layout {layout_id} deleted successfully"}), 200
+       return jsonify(result), 201
    except Exception as e:
        db.session.rollback()
-       return jsonify({"error": str(e)}), 500
+       return error_response(e, 400)
+
+
+
+
+@app.route("/layouts/<layout_id>/retention", methods=["GET", "PUT"])
+def layout_retention(layout_id: str):
+   """How long the floor keeps raw simulation events; PUT {"event_retention_seconds": n | null (default)}."""
+   layout = db.session.get(Layout, layout_id)
+   if layout is None:
+       return jsonify({"error": "Layout not found"}), 404
+   if request.method == "PUT":
+       data = request.get_json(force=True) or {}
+       value = data.get("event_retention_seconds")
+       if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 0):
+           return jsonify({"error": "event_retention_seconds must be a non-negative integer or null"}), 400
+       try:
+           layout.event_retention_seconds = value
+           db.session.commit()
+       except Exception as e:
+           db.session.rollback()
+           return error_response(e)
+   return jsonify({
+       "layout_id": layout.id,
+       "event_retention_seconds": layout.event_retention_seconds,
+       "effective_retention_seconds": retention_seconds(layout.event_retention_seconds),
+   }), 200
+
+
+@app.route("/layouts/<layout_id>/retention/compact", methods=["POST"])
+def compact_layout_events(layout_id: str):
+   """Run a compaction pass over the floor now instead of waiting for the background one."""
+   configured = db.session.execute(
+       select(Layout.event_retention_seconds).where(Layout.id == layout_id)
+   ).first()
+   if configured is None:
+       return jsonify({"error": "Layout not found"}), 404
+   db.session.rollback()
+   try:
+       return jsonify(compact_layout(layout_id, configured[0])), 200
+   except Exception as e:
+       db.session.rollback()
+       return error_response(e)
+
+
+
+
+def log_fields(data: dict) -> dict:
+   
+   return dict(
+       timestamp=datetime.fromisoformat(data.get('timestamp')) if data.get('timestamp') else datetime.utcnow(),
+       event=data['event'],
+       sensor_id=data.get('sensor_id'),
+       device_id=data.get('target_device_id'),
+       owner_session_id=data.get('owner_session_id'),
+       room=data.get('room'),  # room name
+       floor_id=data.get('floor-id'),  # JSON uses 'floor-id' not 'floor_id'
+       effect=data.get('effect'),
+       user_action=bool(data.get('user_action', False)),
+   )
 
 
 
@@ -517,29 +1709,96 @@ def log_event():
    
    try:
        data = request.get_json(force=True)
-       new_log = Log(
-           timestamp=datetime.fromisoformat(data.get('timestamp')) if data.get('timestamp') else datetime.utcnow(),
-           event=data['event'],
-           sensor_id=data.get('sensor_id'),
-           device_id=data.get('target_device_id'),
-           owner_session_id=data.get('owner_session_id'),
-           room=data.get('room'),  # room name
-           floor_id=data.get('floor-id'),  # JSON uses 'floor-id' not 'floor_id'
-           effect=data.get('effect'),
-           user_action=bool(data.get('user_action', False)),
-       )
+       new_log = Log(**log_fields(data))
        db.session.add(new_log)
        db.session.commit()
        return jsonify({"message": "Event logged successfully"}), 201
    except Exception as e:
        db.session.rollback()
-       return jsonify({"error": str(e)}), 500
+       return error_response(e)
+
+
+
+
+def enqueue_batch(table, items, build_row):
+   """
+   Validate a batch, queue the valid rows on the write-behind buffer and answer 202.
+   Rows become visible once the buffer flushes (within INGEST_FLUSH_INTERVAL).
+   """
+   if not isinstance(items, list):
+       return jsonify({"error": "A JSON array of items is required"}), 400
+   rows = []
+   errors = []
+   for index, item in enumerate(items):
+       try:
+           if not isinstance(item, dict):
+               raise ValueError("Item must be an object")
+           rows.append(build_row(item))
+       except KeyError as e:
+           errors.append({"index": index, "error": f"{e.args[0]} is required"})
+       except (TypeError, ValueError, OverflowError) as e:
+           errors.append({"index": index, "error": str(e)})
+   if rows and not ingest_buffer.put_many(table, rows):
+       response = jsonify({"error": "Ingest buffer is full, retry later"})
+       response.headers["Retry-After"] = "1"
+       return response, 429
+   return jsonify({"accepted": len(rows), "errors": errors}), 202
+
+
+
+
+@app.route('/logs:batch', methods=['POST'])
+def log_events_batch():
+   
+   data = request.get_json(force=True, silent=True)
+   items = data.get("items") if isinstance(data, dict) else data
+   return enqueue_batch(Log.__table__, items, log_fields)
+
+
+
+
+@app.route("/layouts/<layout_id>/events:batch", methods=["POST"])
+def add_simulation_events_batch(layout_id: str):
+   """Append events; ids are generated when missing and duplicates are dropped."""
+   data = request.get_json(force=True, silent=True)
+   items = data.get("items") if isinstance(data, dict) else data
+   now = datetime.utcnow()
+
+   def build_row(item: dict) -> dict:
+       for field in ("nodeId", "nodeType", "eventType", "message"):
+           if field not in item:
+               raise KeyError(field)
+       ts_value = item.get("timestamp")
+       return {
+           "id": item.get("id") or str(uuid.uuid4()),
+           "floor": layout_id,
+           "node_id": item["nodeId"],
+           "node_type": item["nodeType"],
+           "event_type": item["eventType"],
+           "timestamp": parse_ms_timestamp(ts_value) if ts_value is not None else now,
+           "message": item["message"],
+           "date_created": now,
+           "date_modified": now,
+       }
+
+   return enqueue_batch(SimulationEvent.__table__, items, build_row)
+
+
+
+
+@app.route("/health", methods=["GET"])
+def get_health():
+   """Database reachability and effective settings (see dbconfig.health_report)."""
+   report = dbconfig.health_report(db, app)
+   return jsonify(report), 200 if report["ok"] else 503
 
 
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     with app.app_context():
         create_tables()
+    dbconfig.log_health_report(db, app)
     app.run(debug=True, host="0.0.0.0", port=5000)
 
@@ -0,0 +1,11 @@
+"""
+Reproducible end-to-end benchmarks: `python -m bench` from server/.
+
+building.py generates synthetic floors of any size; run.py loads one
+through the API and times every route and engine, writing JSON results
+that can be compared across commits (see run.py for the options).
+"""
+
+from bench.building import generate_building
+
+__all__ = ["generate_building"]
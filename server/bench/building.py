@@ -0,0 +1,271 @@
+"""
+Synthetic buildings of any size, shaped like the client's demo floor.
+
+Rooms follow RoomData.ts: wings 684 px wide of three-room rows (bedroom,
+kitchen/bathroom, dining/living room), an interior hall under every row and a
+100 px hall down the side of each wing. Sensors and devices use the types,
+protocol lists, compatible sensors and interference protocols of
+SensorTypes.ts / DeviceTypes.ts; people walk between room centres.
+
+Everything comes from one random.Random(seed), so a seed and a set of sizes
+always give the same building. Items are shaped as the API takes them:
+rooms for POST /layouts, devices/sensors/persons for the :bulk routes, events
+for events:batch and logs for logs:batch.
+"""
+
+import random
+import time
+from typing import Dict, List, Optional
+
+
+# (type, connectivity) from SensorTypes.ts, with how often each is placed.
+SENSOR_TYPES = [
+   ("motion", ["Wi-Fi 2.4GHz", "Wi-Fi 5GHz", "BLE 5.0", "Zigbee 3.0", "Z-Wave"], 30),
+   ("occupancy", ["Wi-Fi 2.4GHz", "Wi-Fi 5GHz", "BLE 5.0", "Zigbee 3.0"], 8),
+   ("presence", ["BLE 5.0", "UWB", "Zigbee 3.0"], 5),
+   ("door", ["BLE 5.0", "Zigbee 3.0", "Z-Wave"], 10),
+   ("window", ["BLE 5.0", "Zigbee 3.0", "Z-Wave"], 8),
+   ("temperature", ["Wi-Fi 2.4GHz", "BLE 5.0", "Zigbee 3.0", "NB-IoT", "LoRaWAN"], 8),
+   ("humidity", ["Wi-Fi 2.4GHz", "BLE 5.0", "Zigbee 3.0"], 4),
+   ("co2", ["Wi-Fi 2.4GHz", "Wi-Fi 5GHz", "Zigbee 3.0"], 3),
+   ("light", ["Wi-Fi 2.4GHz", "BLE 5.0", "Zigbee 3.0"], 4),
+   ("sound", ["Wi-Fi 2.4GHz", "Wi-Fi 5GHz", "BLE 5.0"], 2),
+   ("vibration", ["BLE 5.0", "Zigbee 3.0"], 2),
+   ("pressure", ["BLE 5.0", "Wi-Fi 2.4GHz", "LoRaWAN"], 1),
+   ("gas", ["Wi-Fi 2.4GHz", "Zigbee 3.0"], 2),
+   ("smoke", ["Wi-Fi 2.4GHz", "Zigbee 3.0", "Z-Wave"], 6),
+   ("fall_detection", ["Wi-Fi 2.4GHz", "BLE 5.0", "LTE", "NB-IoT"], 2),
+   ("wifi", ["Wi-Fi 2.4GHz", "Wi-Fi 5GHz", "Wi-Fi 6"], 2),
+   ("bluetooth", ["BLE 4.2", "BLE 5.0", "BLE 5.1"], 2),
+   ("infrared", ["BLE 5.0", "Zigbee 3.0"], 1),
+]
+
+# (type, label, connectivity, compatibleSensors, interferenceProtocols, weight) from DeviceTypes.ts.
+DEVICE_TYPES = [
+   ("appliance", "Smart Thermostat", ["Wi-Fi 2.4GHz", "Wi-Fi 5GHz", "Zigbee 3.0", "Z-Wave", "Thread"],
+    ["temperature", "humidity", "occupancy"], ["Wi-Fi 2.4GHz", "Wi-Fi 5GHz"], 10),
+   ("appliance", "Smart Light Bulb", ["Wi-Fi 2.4GHz", "Zigbee 3.0", "BLE 5.0"],
+    ["light", "occupancy"], ["Wi-Fi 2.4GHz", "BLE 5.0"], 25),
+   ("appliance", "Smart Plug", ["Wi-Fi 2.4GHz", "Z-Wave", "Zigbee 3.0"],
+    ["power", "occupancy", "motion"], ["Wi-Fi 2.4GHz"], 15),
+   ("security", "Smart Door Lock", ["Zigbee 3.0", "Z-Wave", "BLE 5.0", "Wi-Fi 2.4GHz"],
+    ["door", "proximity", "occupancy"], ["Wi-Fi 2.4GHz", "BLE 5.0"], 10),
+   ("monitoring", "Smart Camera", ["Wi-Fi 2.4GHz", "Wi-Fi 5GHz", "LTE", "5G"],
+    ["occupancy", "presence", "camera"], ["Wi-Fi 2.4GHz", "Wi-Fi 5GHz", "LTE", "5G"], 10),
+   ("appliance", "Microwave Oven", [], [], ["Wi-Fi 2.4GHz"], 5),
+   ("monitoring", "Baby Monitor", ["Analog 900MHz", "Wi-Fi 2.4GHz"],
+    ["sound", "camera"], ["Analog 900MHz", "Wi-Fi 2.4GHz"], 5),
+   ("monitoring", "Wireless Security System", ["Z-Wave", "Wi-Fi 2.4GHz", "BLE 5.0"],
+    ["door", "window", "camera"], ["Wi-Fi 2.4GHz", "BLE 5.0"], 15),
+   ("communication", "Cordless Phone", ["DECT 6.0"], [], [], 5),
+]
+
+# Room rows of RoomData.ts: (name, type, width); neighbours share a 3 px wall.
+ROOM_ROWS = [
+   [("Bedroom", "bedroom", 260), ("Kitchen", "kitchen", 230), ("Dining Room", "dining", 200)],
+   [("Bedroom", "bedroom", 260), ("Bathroom", "bathroom", 150), ("Living Room", "living", 280)],
+]
+WALL = 3
+ROOM_HEIGHT = 153
+HALL_HEIGHT = 60
+WING_WIDTH = 684
+SPINE_WIDTH = 100
+ROW_PITCH = ROOM_HEIGHT + HALL_HEIGHT - 2 * WALL  # 207, as in RoomData.ts
+WING_PITCH = WING_WIDTH + SPINE_WIDTH - 6  # 778
+ROWS_PER_WING = 8
+
+SENSOR_RADIUS = (80.0, 200.0)  # the client's default is 150
+DEVICE_RADIUS = (100.0, 300.0)
+PERSON_SPEED = (40.0, 120.0)  # px/s; the canvas animates at 80 by default
+PERSON_COLORS = ["#ef4444", "#3b82f6", "#22c55e", "#eab308", "#a855f7", "#f97316"]
+DWELL_SECONDS = (5.0, 120.0)  # motion START -> END
+EVENT_SPAN_SECONDS = 24 * 3600  # events end at `now`
+LOG_EFFECTS = ["on", "off", "alert", "toggle"]
+
+
+def make_rooms(count: int) -> List[dict]:
+   """`count` rooms, wing after wing, with the side and interior halls counted as rooms."""
+   rooms: List[dict] = []
+   row = 0
+   while len(rooms) < count:
+       wing, row_in_wing = divmod(row, ROWS_PER_WING)
+       left = wing * WING_PITCH
+       top = row_in_wing * ROW_PITCH
+       if row_in_wing == 0:
+           rooms.append(room_item(len(rooms), f"Building Hall {wing + 1}", "hallway",
+                                  left + WING_WIDTH - WALL, -40, SPINE_WIDTH, ROWS_PER_WING * ROW_PITCH + 40))
+       x = left
+       for name, kind, width in ROOM_ROWS[row % 2]:
+           rooms.append(room_item(len(rooms), name, kind, x, top, width, ROOM_HEIGHT))
+           x += width - WALL
+       rooms.append(room_item(len(rooms), f"Room {row + 1}: Interior Hall", "hallway",
+                              left, top + ROOM_HEIGHT - WALL, WING_WIDTH, HALL_HEIGHT))
+       row += 1
+   return rooms[:count]
+
+
+def room_item(index: int, name: str, kind: str, x: float, y: float, width: float, height: float) -> dict:
+   return {"id": f"room-{index}", "name": name, "type": kind, "x": x, "y": y, "width": width, "height": height}
+
+
+def point_in(rng: random.Random, room: dict, margin: float = 10.0) -> dict:
+   mx = min(margin, room["width"] / 2)
+   my = min(margin, room["height"] / 2)
+   return {
+       "x": round(rng.uniform(room["x"] + mx, room["x"] + room["width"] - mx), 1),
+       "y": round(rng.uniform(room["y"] + my, room["y"] + room["height"] - my), 1),
+   }
+
+
+def centre(room: dict) -> dict:
+   return {"x": room["x"] + room["width"] / 2, "y": room["y"] + room["height"] / 2}
+
+
+def make_sensors(rng: random.Random, rooms: List[dict], count: int) -> List[dict]:
+   weights = [w for _, _, w in SENSOR_TYPES]
+   sensors = []
+   for i, (kind, protocols, _) in enumerate(rng.choices(SENSOR_TYPES, weights, k=count)):
+       room = rng.choice(rooms)
+       sensors.append({
+           "id": f"sensor-{i}",
+           "type": kind,
+           "name": f"{kind.replace('_', ' ').title()} {i}",
+           **point_in(rng, room),
+           "sensor_rad": round(rng.uniform(*SENSOR_RADIUS)),
+           # The add-sensor modal picks one protocol per sensor.
+           "connectivity": [rng.choice(protocols)],
+           "connectedDeviceIds": [],
+           "interferenceIds": [],
+       })
+   return sensors
+
+
+def make_devices(rng: random.Random, rooms: List[dict], count: int) -> List[dict]:
+   weights = [t[-1] for t in DEVICE_TYPES]
+   devices = []
+   for i, (kind, label, protocols, compatible, interference, _) in enumerate(
+       rng.choices(DEVICE_TYPES, weights, k=count)
+   ):
+       room = rng.choice(rooms)
+       devices.append({
+           "id": f"device-{i}",
+           "type": kind,
+           "label": label,
+           "name": f"{label} {i}",
+           **point_in(rng, room),
+           "device_rad": round(rng.uniform(*DEVICE_RADIUS)),
+           "connectivity": list(protocols),
+           "compatibleSensors": list(compatible),
+           "interferenceProtocols": list(interference),
+           "connectedSensorIds": [],
+           "interferenceIds": [],
+       })
+   return devices
+
+
+def make_persons(rng: random.Random, rooms: List[dict], count: int) -> List[dict]:
+   persons = []
+   for i in range(count):
+       # A walk between nearby room centres, so paths stay inside the building.
+       room = rng.choice(rooms)
+       path = [point_in(rng, room)]
+       for _ in range(rng.randint(2, 7)):
+           room = min(rng.sample(rooms, min(4, len(rooms))), key=lambda r: distance(centre(r), path[-1]))
+           path.append(point_in(rng, room))
+       persons.append({
+           "id": f"person-{i}",
+           "name": f"Person {i}",
+           "path": path,
+           "currentIndex": 0,
+           "direction": 1,
+           "color": rng.choice(PERSON_COLORS),
+           "animationSpeed": round(rng.uniform(*PERSON_SPEED)),
+           "progress": 0.0,
+       })
+   return persons
+
+
+def distance(a: dict, b: dict) -> float:
+   return ((a["x"] - b["x"]) ** 2 + (a["y"] - b["y"]) ** 2) ** 0.5
+
+
+def make_events(rng: random.Random, sensors: List[dict], persons: List[dict], count: int, now_ms: int) -> List[dict]:
+   """Motion START/END pairs on motion sensors (as the simulation records them), plus status events."""
+   motion = [s for s in sensors if s["type"] == "motion"] or sensors
+   start_ms = now_ms - EVENT_SPAN_SECONDS * 1000
+   events = []
+   while len(events) < count:
+       if not motion or rng.random() < 0.1:
+           node = rng.choice(sensors) if sensors else {"id": "unknown", "name": "unknown"}
+           events.append(event_item(len(events), node["id"], "status", rng.randint(start_ms, now_ms),
+                                    f'Sensor "{node["name"]}" reported status'))
+           continue
+       sensor = rng.choice(motion)
+       person = rng.choice(persons)["name"] if persons else "Person"
+       started = rng.randint(start_ms, now_ms)
+       ended = min(now_ms, started + int(rng.uniform(*DWELL_SECONDS) * 1000))
+       events.append(event_item(len(events), sensor["id"], "motion", started,
+                                f'Motion START near "{sensor["name"]}" by "{person}"'))
+       if len(events) < count:
+           events.append(event_item(len(events), sensor["id"], "motion", ended,
+                                    f'Motion END near "{sensor["name"]}" from "{person}"'))
+   return events
+
+
+def event_item(index: int, node_id: str, event_type: str, timestamp: int, message: str) -> dict:
+   return {
+       "id": f"event-{index}",
+       "nodeId": node_id,
+       "nodeType": "sensor",
+       "eventType": event_type,
+       "timestamp": timestamp,
+       "message": message,
+   }
+
+
+def make_logs(
+   rng: random.Random, rooms: List[dict], sensors: List[dict], devices: List[dict], count: int, now_ms: int,
+) -> List[dict]:
+   """Log rows for logs:batch; owner_session_id and floor-id are filled in by the loader."""
+   start_ms = now_ms - EVENT_SPAN_SECONDS * 1000
+   logs = []
+   for _ in range(count):
+       timestamp = rng.randint(start_ms, now_ms) / 1000.0
+       logs.append({
+           "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(timestamp)),
+           "event": "sensor_triggered",
+           "sensor_id": rng.choice(sensors)["id"] if sensors else None,
+           "target_device_id": rng.choice(devices)["id"] if devices else None,
+           "room": rng.choice(rooms)["name"] if rooms else None,
+           "effect": rng.choice(LOG_EFFECTS),
+           "user_action": rng.random() < 0.2,
+       })
+   return logs
+
+
+def generate_building(
+   rooms: int,
+   sensors: int,
+   devices: int,
+   people: int,
+   events: int = 0,
+   logs: int = 0,
+   seed: int = 1,
+   now_ms: Optional[int] = None,
+) -> Dict[str, List[dict]]:
+   """A floor's payloads keyed rooms, sensors, devices, persons, events and logs."""
+   rng = random.Random(seed)
+   # Events and logs keep their layout relative to `now`, so retention treats every run alike.
+   now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+   room_items = make_rooms(max(rooms, 1))
+   sensor_items = make_sensors(rng, room_items, sensors)
+   device_items = make_devices(rng, room_items, devices)
+   person_items = make_persons(rng, room_items, people)
+   return {
+       "rooms": room_items,
+       "sensors": sensor_items,
+       "devices": device_items,
+       "persons": person_items,
+       "events": make_events(rng, sensor_items, person_items, events, now_ms),
+       "logs": make_logs(rng, room_items, sensor_items, device_items, logs, now_ms),
+   }
@@ -0,0 +1,421 @@
+"""
+Load a synthetic building through the API and time every route and engine.
+
+How to run (from server/):
+    python -m bench --size small --output results.json
+    python -m bench --size medium --baseline results.json
+
+The app runs in-process on Flask's test client against a throwaway SQLite
+file, so nothing needs to be running and the numbers do not include a
+network. Each case is one request repeated `--repeat` times; results hold
+the first (cold) and best/median/p95 wall times, response size and SQL
+statements per request, keyed by stable case names so runs can be diffed
+across commits. `--baseline` adds each case's median relative to an earlier
+results file. Exits 1 when a case answers with an unexpected status.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional, Union
+
+from bench.building import generate_building
+
+
+SIZES = {
+   "small": {"rooms": 40, "sensors": 200, "devices": 60, "people": 40, "events": 5000, "logs": 1000},
+   "medium": {"rooms": 200, "sensors": 1000, "devices": 300, "people": 200, "events": 50000, "logs": 10000},
+   "large": {"rooms": 1000, "sensors": 5000, "devices": 1500, "people": 1000, "events": 500000, "logs": 50000},
+}
+LOAD_CHUNK = 5000  # items per events:batch / logs:batch request, under the ingest buffer's bound
+INGEST_TIMEOUT = 600.0  # seconds to wait for the write-behind buffer to drain
+JOB_TIMEOUT = 600.0
+POLL_INTERVAL = 0.01
+RESULTS_VERSION = 1
+
+
+def percentile(values: List[float], fraction: float) -> float:
+   ordered = sorted(values)
+   return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def ms(seconds: float) -> float:
+   return round(seconds * 1000, 3)
+
+
+class Bench:
+   """Runs cases against one app and collects their results."""
+
+   def __init__(self, server, repeat: int) -> None:
+       self.server = server
+       self.client = server.app.test_client()
+       self.repeat = repeat
+       self.cases: Dict[str, dict] = {}
+       self.failures: List[str] = []
+
+   def statements(self) -> int:
+       """SQL statements run by requests so far (background threads are counted under "-")."""
+       metrics = self.server.metrics
+       with metrics.registry.lock:
+           return int(sum(v for labels, v in metrics.STATEMENTS.values.items() if labels != (("route", "-"),)))
+
+   def request(self, method: str, path: str, **kwargs):
+       """One request with its body fully read; returns (response, seconds, body size)."""
+       started = time.perf_counter()
+       response = self.client.open(path, method=method, **kwargs)
+       size = len(response.get_data())
+       elapsed = time.perf_counter() - started
+       response.close()  # runs the metrics' on-close hook for streamed bodies
+       return response, elapsed, size
+
+   def case(
+       self,
+       name: str,
+       method: str,
+       path: Union[str, Callable[[int], str]],
+       expect=(200,),
+       repeat: Optional[int] = None,
+       items: Optional[int] = None,
+       **kwargs,
+   ) -> Optional[dict]:
+       """Time `repeat` requests; `path` may vary per run. `items` adds a per-item rate."""
+       times, sizes = [], []
+       statements = self.statements()
+       response = None
+       runs = repeat or self.repeat
+       for run in range(runs):
+           response, elapsed, size = self.request(method, path(run) if callable(path) else path, **kwargs)
+           if response.status_code not in expect:
+               self.fail(name, response)
+               return None
+           times.append(elapsed)
+           sizes.append(size)
+       result = {
+           "status": response.status_code,
+           "runs": runs,
+           "first_ms": ms(times[0]),
+           "min_ms": ms(min(times)),
+           "median_ms": ms(statistics.median(times)),
+           "p95_ms": ms(percentile(times, 0.95)),
+           "mean_ms": ms(statistics.fmean(times)),
+           "bytes": int(statistics.median(sizes)),
+           "db_statements": round((self.statements() - statements) / runs, 1),
+       }
+       if items:
+           result["items"] = items
+           result["items_per_s"] = round(items / statistics.median(times), 1)
+       self.cases[name] = result
+       return result
+
+   def record(self, name: str, seconds: float, items: Optional[int] = None, **extra) -> None:
+       """A case timed by the caller (multi-request loads, jobs)."""
+       result = {"runs": 1, "first_ms": ms(seconds), "min_ms": ms(seconds), "median_ms": ms(seconds)}
+       if items:
+           result["items"] = items
+           result["items_per_s"] = round(items / seconds, 1) if seconds > 0 else None
+       result.update(extra)
+       self.cases[name] = result
+
+   def fail(self, name: str, response) -> None:
+       body = response.get_data(as_text=True)[:300]
+       self.failures.append(f"{name}: HTTP {response.status_code} {body}")
+       self.cases[name] = {"status": response.status_code, "error": body}
+
+   def json(self, method: str, path: str, expect=(200, 201, 202), **kwargs) -> dict:
+       """A setup request whose answer the run depends on; raises on failure."""
+       response = self.client.open(path, method=method, **kwargs)
+       if response.status_code not in expect:
+           raise RuntimeError(f"{method} {path}: HTTP {response.status_code} {response.get_data(as_text=True)[:300]}")
+       return response.get_json()
+
+   def wait_for_ingest(self, target: int) -> int:
+       """Block until the write-behind buffer has written or dropped `target` rows in total."""
+       buffer = self.server.ingest_buffer
+       deadline = time.monotonic() + INGEST_TIMEOUT
+       while buffer.written + buffer.dropped < target:
+           if time.monotonic() > deadline:
+               raise RuntimeError("Timed out waiting for the ingest buffer to drain")
+           time.sleep(POLL_INTERVAL)
+       return buffer.dropped
+
+   def batched(self, name: str, path: str, items: List[dict]) -> None:
+       """Post `items` in chunks to a write-behind batch route and time until all are written."""
+       buffer = self.server.ingest_buffer
+       target = buffer.written + buffer.dropped + len(items)
+       dropped = buffer.dropped
+       started = time.perf_counter()
+       request_seconds = 0.0
+       for start in range(0, len(items), LOAD_CHUNK):
+           chunk = items[start:start + LOAD_CHUNK]
+           while True:
+               response, elapsed, _ = self.request("POST", path, json=chunk)
+               request_seconds += elapsed
+               if response.status_code != 429:
+                   break
+               time.sleep(POLL_INTERVAL)  # backpressure: let the writer catch up
+           if response.status_code != 202 or response.get_json()["errors"]:
+               self.fail(name, response)
+               return
+       dropped = self.wait_for_ingest(target) - dropped
+       self.record(name, time.perf_counter() - started, len(items),
+                   request_ms=ms(request_seconds), dropped=dropped)
+
+   def job(self, name: str, kind: str, layout_id: str, params: dict) -> None:
+       """Queue a job and time it until it finishes."""
+       started = time.perf_counter()
+       response, _, _ = self.request("POST", "/jobs", json={"kind": kind, "layout_id": layout_id, "params": params})
+       if response.status_code != 202:
+           self.fail(name, response)
+           return
+       job_id = response.get_json()["id"]
+       deadline = time.monotonic() + JOB_TIMEOUT
+       while True:
+           job = self.client.get(f"/jobs/{job_id}").get_json()
+           if job["status"] not in ("queued", "running"):
+               break
+           if time.monotonic() > deadline:
+               self.client.post(f"/jobs/{job_id}/cancel")
+               self.failures.append(f"{name}: timed out")
+               return
+           time.sleep(POLL_INTERVAL)
+       if job["status"] != "done":
+           self.failures.append(f"{name}: job {job['status']}: {job.get('error')}")
+           self.cases[name] = {"status": job["status"], "error": job.get("error")}
+           return
+       self.record(name, time.perf_counter() - started)
+
+
+def load(bench: Bench, building: dict) -> str:
+   """Create a session and a floor, then save everything through the bulk and batch routes."""
+   session = bench.json("POST", "/session", json={"name": "bench"})
+   started = time.perf_counter()
+   created = bench.json("POST", "/layouts", json={
+       "id": "bench", "name": "Bench floor", "owner_session_id": session["id"], "rooms": building["rooms"],
+   })
+   bench.record("load.layout_rooms", time.perf_counter() - started, len(building["rooms"]))
+   layout_id = created["layout_id"]
+   for collection in ("devices", "sensors", "persons"):
+       items = building[collection]
+       bench.case(f"load.{collection}_bulk", "PUT", f"/layouts/{layout_id}/{collection}:bulk",
+                  repeat=1, items=len(items), json=items)
+   bench.batched("load.events_batch", f"/layouts/{layout_id}/events:batch", building["events"])
+   logs = [dict(item, owner_session_id=session["id"], **{"floor-id": layout_id}) for item in building["logs"]]
+   bench.batched("load.logs_batch", "/logs:batch", logs)
+   return layout_id
+
+
+def run_cases(bench: Bench, layout_id: str, building: dict) -> None:
+   base = f"/layouts/{layout_id}"
+   rooms, sensors, devices, persons = (building[k] for k in ("rooms", "sensors", "devices", "persons"))
+   columnar = {"Accept": bench.server.COLUMNAR_MIMETYPE}
+
+   # Engines that derive stored state: the first run writes, later ones find nothing to change.
+   bench.case("interference.recompute", "POST", f"{base}/interference/recompute")
+   bench.case("connectivity.recompute", "POST", f"{base}/connectivity/recompute")
+   bench.case("connectivity.recompute_walls", "POST", f"{base}/connectivity/recompute?model=walls")
+   bench.case("connectivity.recompute", "POST", f"{base}/connectivity/recompute")  # back to the radius model
+
+   # Reads.
+   bench.case("layouts.list", "GET", "/layouts")
+   for collection in ("devices", "sensors", "persons"):
+       bench.case(f"{collection}.get", "GET", f"{base}/{collection}")
+       bench.case(f"{collection}.get_columnar", "GET", f"{base}/{collection}", headers=columnar)
+   snapshot = bench.case("snapshot.get", "GET", f"{base}/snapshot")
+   bench.case("snapshot.get_columnar", "GET", f"{base}/snapshot", headers=columnar)
+   etag = bench.client.get(f"{base}/snapshot").headers.get("ETag")
+   if snapshot and etag:
+       bench.case("snapshot.not_modified", "GET", f"{base}/snapshot", expect=(304,), headers={"If-None-Match": etag})
+   layout = bench.json("GET", "/layouts?fields=id,version")
+   version = next(item["version"] for item in layout if item["id"] == layout_id)
+   bench.case("changes.since_start", "GET", f"{base}/changes?since=1", expect=(200, 410))
+   bench.case("changes.since_recent", "GET", f"{base}/changes?since={max(version - 5, 1)}", expect=(200, 410))
+   bench.case("events.page", "GET", f"{base}/events?limit=1000")
+   bench.case("events.ndjson", "GET", f"{base}/events?format=ndjson", items=len(building["events"]))
+   if sensors:
+       bench.case("events.by_node", "GET", lambda i: f"{base}/events?node_id={sensors[i % len(sensors)]['id']}")
+   bench.case("events.counts_hour", "GET", f"{base}/events/counts?resolution=hour")
+   bench.case("events.counts_minute", "GET", f"{base}/events/counts?resolution=minute")
+   centres = [(r["x"] + r["width"] / 2, r["y"] + r["height"] / 2) for r in rooms]
+   bench.case("nodes.near", "GET", lambda i: "{}/nodes/near?x={}&y={}&r=250".format(base, *centres[i % len(centres)]))
+   # Cold on the first run, cached per layout version after.
+   bench.case("coverage.get", "GET", f"{base}/coverage")
+   bench.case("coverage.heatmap_png", "GET", f"{base}/coverage?heatmap=png")
+   bench.case("stats.get", "GET", f"{base}/stats")
+   bench.case("stats.hourly", "GET", f"{base}/stats?interval=3600")
+   bench.case("retention.get", "GET", f"{base}/retention")
+   bench.case("health", "GET", "/health")
+   bench.case("metrics", "GET", "/metrics")
+   stream_first_event(bench, f"{base}/stream")
+
+   # Single-item writes.
+   if devices:
+       bench.case("devices.post_update", "POST", f"{base}/devices",
+                  json=dict(devices[0], x=devices[0]["x"] + 1))
+       bench.case("devices.post_create", "POST", f"{base}/devices", expect=(201,),
+                  repeat=1, json=dict(devices[0], id="bench-device"))
+       bench.case("devices.delete", "DELETE", f"{base}/devices/bench-device", repeat=1)
+   if sensors:
+       bench.case("sensors.post_update", "POST", f"{base}/sensors", json=dict(sensors[0], x=sensors[0]["x"] + 1))
+   if persons:
+       bench.case("persons.post_update", "POST", f"{base}/persons", json=persons[0])
+   if sensors:
+       bench.case("events.post", "POST", f"{base}/events", expect=(200, 201), json={
+           "id": "bench-event", "nodeId": sensors[0]["id"], "nodeType": "sensor",
+           "eventType": "status", "message": "bench",
+       })
+   bench.case("logs.post", "POST", "/logs", expect=(201,), json={"event": "bench", "floor-id": layout_id})
+
+   # Engines driven by requests.
+   bench.case("simulate", "POST", f"{base}/simulate?duration=10&dt=0.1")
+   bench.case("scenarios", "POST", f"{base}/scenarios", repeat=1, json={
+       "duration": 60, "dt": 0.5, "workers": 1,
+       "variations": [{"name": "wide", "sensor_radius_scale": 1.5}, {"name": "fast", "speed_scale": 2.0}],
+   })
+   bench.job("optimize.job", "optimize", layout_id, {
+       "budget": 8, "resolution": 20, "population": 8, "generations": 5, "seed": 1, "workers": 1,
+   })
+
+   # Whole-floor operations, on clones so the floor above stays as loaded.
+   clones = []
+   for _ in range(bench.repeat):
+       response, elapsed, _ = bench.request("POST", f"{base}/clone", json={"name": "bench clone"})
+       if response.status_code != 201:
+           bench.fail("layouts.clone", response)
+           break
+       clones.append((response.get_json()["layout_id"], elapsed))
+   if clones:
+       times = [elapsed for _, elapsed in clones]
+       bench.record("layouts.clone", statistics.median(times), first_ms=ms(times[0]), min_ms=ms(min(times)),
+                    runs=len(times))
+       # Keep one hour of the clone's day of events; the rest is rolled up and deleted.
+       bench.json("PUT", f"/layouts/{clones[0][0]}/retention", json={"event_retention_seconds": 3600})
+       bench.case("retention.compact", "POST", f"/layouts/{clones[0][0]}/retention/compact", repeat=1)
+       bench.case("layouts.delete", "DELETE", lambda i: f"/layouts/{clones[i][0]}", repeat=len(clones))
+
+
+def stream_first_event(bench: Bench, path: str) -> None:
+   """Time to the SSE stream's `ready` event; the stream itself never ends."""
+   started = time.perf_counter()
+   response = bench.client.get(path, buffered=False)
+   if response.status_code != 200:
+       bench.fail("stream.ready", response)
+       return
+   chunks = iter(response.response)
+   next(chunks)  # retry: line
+   next(chunks)  # ready event
+   bench.record("stream.ready", time.perf_counter() - started)
+   response.close()
+
+
+def environment() -> dict:
+   try:
+       commit = subprocess.run(
+           ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+           cwd=os.path.dirname(os.path.abspath(__file__)),
+       ).stdout.strip()
+   except (OSError, subprocess.CalledProcessError):
+       commit = None
+   import numpy
+   from encoding import orjson
+
+   return {
+       "commit": commit,
+       "python": platform.python_version(),
+       "platform": platform.platform(),
+       "cpus": os.cpu_count(),
+       "sqlite": sqlite3.sqlite_version,
+       "numpy": numpy.__version__,
+       "json_backend": "orjson" if orjson is not None else "json",
+   }
+
+
+def compare(results: dict, baseline_path: str) -> None:
+   """Add each case's median relative to the baseline's (above 1 is slower)."""
+   with open(baseline_path) as f:
+       baseline = json.load(f)["cases"]
+   for name, result in results["cases"].items():
+       before = baseline.get(name, {}).get("median_ms")
+       if before and result.get("median_ms") is not None:
+           result["baseline_median_ms"] = before
+           result["ratio"] = round(result["median_ms"] / before, 3)
+
+
+def summary(results: dict) -> str:
+   lines = [f"{'case':32} {'first ms':>10} {'median ms':>10} {'p95 ms':>10} {'bytes':>10} {'sql':>6} {'ratio':>6}"]
+   for name, r in results["cases"].items():
+       if "error" in r:
+           lines.append(f"{name:32} failed: HTTP {r.get('status')}")
+           continue
+       lines.append("{:32} {:>10} {:>10} {:>10} {:>10} {:>6} {:>6}".format(
+           name, r["first_ms"], r["median_ms"], r.get("p95_ms", ""), r.get("bytes", ""),
+           r.get("db_statements", ""), r.get("ratio", ""),
+       ))
+   return "\n".join(lines)
+
+
+def main(argv=None) -> int:
+   parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+   parser.add_argument("--size", choices=sorted(SIZES), default="small")
+   for name in SIZES["small"]:
+       parser.add_argument(f"--{name}", type=int, help=f"override the size's {name} count")
+   parser.add_argument("--seed", type=int, default=1)
+   parser.add_argument("--repeat", type=int, default=5)
+   parser.add_argument("--output", help="write results here instead of stdout")
+   parser.add_argument("--baseline", help="earlier results to compare medians against")
+   args = parser.parse_args(argv)
+   sizes = {name: getattr(args, name) if getattr(args, name) is not None else value
+            for name, value in SIZES[args.size].items()}
+
+   started_at = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+   building = generate_building(seed=args.seed, **sizes)
+   with tempfile.TemporaryDirectory() as tmp:
+       # app.py reads its settings at import time, so the environment is set first.
+       os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tmp, "bench.db")
+       os.environ["RETENTION_INTERVAL"] = "0"
+       import app as server
+
+       with server.app.app_context():
+           server.create_tables()
+       bench = Bench(server, args.repeat)
+       started = time.perf_counter()
+       try:
+           layout_id = load(bench, building)
+           run_cases(bench, layout_id, building)
+       finally:
+           server.ingest_buffer.close()
+           server.job_runner.close()
+           with server.app.app_context():
+               server.db.engine.dispose()
+
+   results = {
+       "version": RESULTS_VERSION,
+       "size": args.size,
+       "sizes": sizes,
+       "seed": args.seed,
+       "repeat": args.repeat,
+       "started_at": started_at,
+       "total_s": round(time.perf_counter() - started, 2),
+       "environment": environment(),
+       "cases": bench.cases,
+       "failures": bench.failures,
+   }
+   if args.baseline:
+       compare(results, args.baseline)
+   if args.output:
+       with open(args.output, "w") as f:
+           json.dump(results, f, indent=2)
+           f.write("\n")
+   else:
+       json.dump(results, sys.stdout, indent=2)
+       print()
+   print(summary(results), file=sys.stderr)
+   for failure in bench.failures:
+       print(f"FAILED {failure}", file=sys.stderr)
+   return 1 if bench.failures else 0
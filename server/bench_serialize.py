@@ -0,0 +1,136 @@
+"""
+Per-row cost of the collection read paths: ORM objects + to_dict() + stdlib
+json (the previous routes) against Core column tuples + serialize.py.
+
+How to run (from server/):
+    python bench_serialize.py --rows 50000 --repeat 3
+
+Builds a throwaway SQLite database with `rows` devices, sensors and persons
+on one floor and prints the best time per path and collection as JSON.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+from flask import Flask
+from sqlalchemy import insert
+
+from encoding import json_dumps, json_loads, orjson
+from models import db, Device, Layout, Person, Sensor, Session
+from serialize import DEVICE_ROWS, PERSON_ROWS, SENSOR_ROWS, stream_array
+
+
+PROTOCOLS = ["Zigbee 3.0", "Thread", "BLE 5.0", "Wi-Fi 2.4GHz", "Z-Wave"]
+
+
+def seed(rows: int) -> None:
+   db.create_all()
+   session = Session(name="bench")
+   db.session.add(session)
+   db.session.flush()
+   db.session.add(Layout(id="bench", name="bench", owner_session_id=session.id))
+   db.session.flush()
+   now = datetime.utcnow()
+   devices, sensors, persons = [], [], []
+   for i in range(rows):
+       x, y = float(i % 500) * 20, float(i // 500) * 20
+       protocols = PROTOCOLS[i % 3:i % 3 + 3]
+       devices.append({
+           "id": f"d{i}", "x": x, "y": y, "type": "hub", "label": "Hub", "name": f"Hub {i}", "device_rad": 40.0,
+           "connectivity": protocols, "compatibleSensors": ["motion"], "interferenceProtocols": protocols[:1],
+           "connectedSensorIds": [f"s{i}"], "interferenceIds": [], "floor": "bench",
+           "date_created": now, "date_modified": now,
+       })
+       sensors.append({
+           "id": f"s{i}", "x": x + 5, "y": y + 5, "type": "motion", "name": f"Sensor {i}", "sensor_rad": 80.0,
+           "connectivity": protocols, "connectedDeviceIds": [f"d{i}"], "interferenceIds": [], "floor": "bench",
+           "date_created": now, "date_modified": now,
+       })
+       persons.append({
+           "id": str(uuid.uuid4()), "name": f"Person {i}", "floor": "bench",
+           "path": [{"x": x + k * 10.0, "y": y + k * 7.0} for k in range(8)],
+           "currentIndex": 0, "direction": 1, "color": "#ff0000", "animationSpeed": 1.0, "progress": 0.0,
+           "date_created": now, "date_modified": now,
+       })
+   for model, values in ((Device, devices), (Sensor, sensors), (Person, persons)):
+       db.session.execute(insert(model.__table__), values)
+   db.session.commit()
+
+
+def make_app(uri: str, engine_options: dict) -> Flask:
+   app = Flask(__name__)
+   app.config["SQLALCHEMY_DATABASE_URI"] = uri
+   app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options
+   db.init_app(app)
+   return app
+
+
+def orm_body(model) -> bytes:
+   objects = model.query.filter_by(floor="bench").all()
+   body = json.dumps([o.to_dict() for o in objects]).encode()
+   db.session.expunge_all()
+   return body
+
+
+def core_body(spec, model) -> bytes:
+   return b"".join(stream_array(spec, spec.select().where(model.floor == "bench")))
+
+
+def best(fn, repeat: int) -> float:
+   times = []
+   for _ in range(repeat):
+       start = time.perf_counter()
+       fn()
+       times.append(time.perf_counter() - start)
+   return min(times)
+
+
+def main(argv=None) -> int:
+   parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+   parser.add_argument("--rows", type=int, default=50000)
+   parser.add_argument("--repeat", type=int, default=3)
+   args = parser.parse_args(argv)
+
+   with tempfile.TemporaryDirectory() as tmp:
+       uri = "sqlite:///" + os.path.join(tmp, "bench.db")
+       # The previous configuration (stdlib JSON column decoding) against the current one.
+       before = make_app(uri, {"json_serializer": json_dumps})
+       after = make_app(uri, {"json_serializer": json_dumps, "json_deserializer": json_loads})
+       with after.app_context():
+           seed(args.rows)
+       results = {"rows": args.rows, "json_backend": "orjson" if orjson is not None else "json"}
+       for name, spec, model in (
+           ("devices", DEVICE_ROWS, Device),
+           ("sensors", SENSOR_ROWS, Sensor),
+           ("persons", PERSON_ROWS, Person),
+       ):
+           with before.app_context():
+               expected = orm_body(model)
+               orm = best(lambda: orm_body(model), args.repeat)
+           with after.app_context():
+               body = core_body(spec, model)
+               core = best(lambda: core_body(spec, model), args.repeat)
+           if json.loads(expected) != json.loads(body):
+               raise SystemExit(f"{name}: serialised rows differ")
+           results[name] = {
+               "orm_us_per_row": round(orm / args.rows * 1e6, 2),
+               "core_us_per_row": round(core / args.rows * 1e6, 2),
+               "speedup": round(orm / core, 2),
+               "bytes": len(body),
+           }
+       for app in (before, after):
+           with app.app_context():
+               db.engine.dispose()
+   json.dump(results, sys.stdout, indent=2)
+   print()
+   return 0
+
+
+if __name__ == "__main__":
+   sys.exit(main())
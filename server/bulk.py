@@ -0,0 +1,147 @@
+"""
+Bulk upsert of devices, sensors and persons for one floor.
+
+Existing ids are prefetched with chunked IN queries, new rows go in with one
+executemany INSERT and existing rows with one executemany UPDATE by primary
+key, so a whole floor is saved in a handful of statements and a single commit.
+"""
+
+from datetime import datetime
+from typing import Dict, List, Sequence, Tuple
+
+from sqlalchemy import bindparam, insert, select, update
+
+from models import db, Device, Person, Sensor
+
+
+# Keeps IN lists under SQLite's bound-parameter limit on older builds.
+IN_CHUNK_SIZE = 500
+
+
+class BulkSpec:
+   """Which payload fields a model needs on insert, on every write, and their defaults."""
+
+   def __init__(
+       self,
+       model,
+       insert_required: Sequence[str],
+       defaults: Dict[str, object],
+       always_required: Sequence[str] = (),
+   ) -> None:
+       self.model = model
+       self.insert_required = tuple(insert_required)
+       self.always_required = tuple(always_required)
+       self.defaults = defaults
+       self.fields = self.insert_required + tuple(f for f in defaults if f not in self.insert_required)
+
+
+DEVICE_SPEC = BulkSpec(
+   Device,
+   insert_required=("x", "y", "type", "label", "name", "device_rad"),
+   defaults={
+       "connectivity": list,
+       "compatibleSensors": list,
+       "interferenceProtocols": list,
+       "connectedSensorIds": list,
+       "interferenceIds": list,
+   },
+)
+
+SENSOR_SPEC = BulkSpec(
+   Sensor,
+   insert_required=("type", "name", "x", "y", "sensor_rad"),
+   defaults={
+       "connectivity": list,
+       "connectedDeviceIds": list,
+       "interferenceIds": list,
+   },
+)
+
+PERSON_SPEC = BulkSpec(
+   Person,
+   insert_required=("name", "animationSpeed"),
+   always_required=("name", "animationSpeed"),
+   defaults={
+       "path": list,
+       "currentIndex": lambda: 0,
+       "direction": lambda: 1,
+       "color": lambda: None,
+       "progress": lambda: None,
+   },
+)
+
+
+def existing_floors(model, ids: Sequence[str]) -> Dict[str, str]:
+   """Map id -> current floor for the ids that already exist."""
+   found: Dict[str, str] = {}
+   for start in range(0, len(ids), IN_CHUNK_SIZE):
+       chunk = ids[start : start + IN_CHUNK_SIZE]
+       for row in db.session.execute(select(model.id, model.floor).where(model.id.in_(chunk))):
+           found[row.id] = row.floor
+   return found
+
+
+def bulk_update(table, rows: Sequence[dict]) -> None:
+   """executemany UPDATE ... WHERE id = ?, one statement per distinct set of columns."""
+   groups: Dict[Tuple[str, ...], List[dict]] = {}
+   for row in rows:
+       columns = tuple(sorted(k for k in row if k != "id"))
+       groups.setdefault(columns, []).append({"_id": row["id"], **{k: row[k] for k in columns}})
+   for columns, params in groups.items():
+       stmt = (
+           update(table)
+           .where(table.c.id == bindparam("_id"))
+           .values({k: bindparam(k) for k in columns})
+       )
+       db.session.execute(stmt, params)
+
+
+def bulk_upsert(spec: BulkSpec, layout_id: str, items: Sequence[dict]) -> Tuple[List[dict], List[dict], Dict[str, str]]:
+   """
+   Insert or update every valid item onto `layout_id`; the caller commits.
+
+   Returns (statuses, rows, previous_floors): one status per input item in
+   order, the rows actually written (payload fields plus id/floor), and the
+   previous floor of each updated id.
+   """
+   ids = [item.get("id") for item in items if isinstance(item, dict) and item.get("id")]
+   previous_floors = existing_floors(spec.model, list(dict.fromkeys(ids)))
+   now = datetime.utcnow()
+
+   statuses: List[dict] = []
+   inserts: Dict[str, dict] = {}
+   updates: Dict[str, dict] = {}
+   for item in items:
+       if not isinstance(item, dict) or not item.get("id"):
+           statuses.append({"id": None, "status": "error", "error": "ID is required"})
+           continue
+       item_id = item["id"]
+       exists = item_id in previous_floors or item_id in inserts
+       required = spec.always_required if exists else spec.insert_required
+       missing = [f for f in required if f not in item]
+       if missing:
+           statuses.append({"id": item_id, "status": "error", "error": f"{', '.join(missing)} is required"})
+           continue
+
+       if exists:
+           target = inserts.get(item_id)
+           if target is None:
+               target = updates.setdefault(item_id, {"id": item_id})
+           target.update({f: item[f] for f in spec.fields if f in item})
+           target["floor"] = layout_id
+           target["date_modified"] = now
+           statuses.append({"id": item_id, "status": "updated"})
+       else:
+           row = {"id": item_id, "floor": layout_id, "date_created": now, "date_modified": now}
+           for field in spec.fields:
+               row[field] = item[field] if field in item else spec.defaults[field]()
+           inserts[item_id] = row
+           statuses.append({"id": item_id, "status": "created"})
+
+   if inserts:
+       db.session.execute(insert(spec.model.__table__), list(inserts.values()))
+   if updates:
+       bulk_update(spec.model.__table__, list(updates.values()))
+
+   rows = list(inserts.values()) + list(updates.values())
+   return statuses, rows, {i: previous_floors[i] for i in updates}
@@ -0,0 +1,313 @@
+"""
+Per-layout change log and live change feed.
+
+Every write to a floor bumps `Layout.version` (snapshot.touch_layout), which
+doubles as the floor's change sequence. While a transaction is open, the rows
+it writes are collected per floor on the session: ORM objects automatically
+(before_flush), Core bulk writes through record_rows()/record_deletes().
+
+Before the transaction commits, one layout_change row per written node
+(a tombstone for deletes) is added under the version the transaction gave the
+floor, so changes_since() can answer "what changed after version N" by
+re-reading just those nodes. After the commit the same delta is published to
+the in-process feed, which keeps the last FEED_HISTORY deltas of a floor for
+the SSE stream; a rollback discards both.
+"""
+
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event, insert, inspect, select
+from sqlalchemy.orm import Session as OrmSession
+
+from encoding import json_dumps
+from models import db, Device, LayoutChange, Person, Sensor, SimulationEvent
+from serialize import DEVICE_ROWS, EVENT_ROWS, PERSON_ROWS, SENSOR_ROWS
+
+
+FEED_HISTORY = 1000  # deltas kept per layout
+CHANGES_CHUNK = 500  # ids per IN (...) when re-reading changed nodes
+
+# Collections a delta can carry, keyed by model.
+COLLECTIONS = {Device: "devices", Sensor: "sensors", Person: "persons", SimulationEvent: "events"}
+MODELS = {name: model for model, name in COLLECTIONS.items()}
+ROW_SPECS = {"devices": DEVICE_ROWS, "sensors": SENSOR_ROWS, "persons": PERSON_ROWS, "events": EVENT_ROWS}
+
+
+class Delta:
+   """What one transaction changed on one floor; upserts may be partial rows (merge by id)."""
+
+   def __init__(self) -> None:
+       self.upserted: Dict[str, Dict[str, dict]] = {}
+       self.deleted: Dict[str, Dict[str, None]] = {}
+
+   def upsert(self, collection: str, row: dict) -> None:
+       rows = self.upserted.setdefault(collection, {})
+       rows.setdefault(row["id"], {}).update(jsonable(row))
+       self.deleted.get(collection, {}).pop(row["id"], None)
+
+   def delete(self, collection: str, node_id: str) -> None:
+       self.upserted.get(collection, {}).pop(node_id, None)
+       self.deleted.setdefault(collection, {})[node_id] = None
+
+   def log_rows(self, layout_id: str, version: int) -> List[dict]:
+       """layout_change rows for this delta."""
+       rows = []
+       for deleted, collections in ((False, self.upserted), (True, self.deleted)):
+           for collection, ids in collections.items():
+               rows.extend(
+                   {"layout_id": layout_id, "version": version, "collection": collection, "node_id": node_id, "deleted": deleted}
+                   for node_id in ids
+               )
+       return rows
+
+   def to_dict(self) -> dict:
+       result = {}
+       upserted = {k: list(v.values()) for k, v in self.upserted.items() if v}
+       deleted = {k: list(v) for k, v in self.deleted.items() if v}
+       if upserted:
+           result["upserted"] = upserted
+       if deleted:
+           result["deleted"] = deleted
+       return result
+
+
+def jsonable(row: dict) -> dict:
+   return {k: v.isoformat() if isinstance(v, datetime) else v for k, v in row.items()}
+
+
+def event_dict(row: dict) -> dict:
+   """A simulation_event row (column names) in the SimulationEvent.to_dict() shape, without an ORM object."""
+   timestamp = row.get("timestamp")
+   return jsonable({
+       "id": row["id"],
+       "floor": row["floor"],
+       "nodeId": row["node_id"],
+       "nodeType": row["node_type"],
+       "eventType": row["event_type"],
+       "timestamp": int(timestamp.timestamp() * 1000) if timestamp else None,
+       "message": row["message"],
+       "date_created": row.get("date_created"),
+       "date_modified": row.get("date_modified"),
+   })
+
+
+def pending(session) -> Dict[str, Delta]:
+   return session.info.setdefault("layout_changes", {})
+
+
+def record_rows(layout_id: str, collection: str, rows: Iterable[dict]) -> None:
+   """Note rows written with Core statements (bulk inserts/updates) for the open transaction."""
+   delta = pending(db.session).setdefault(layout_id, Delta())
+   for row in rows:
+       delta.upsert(collection, event_dict(row) if collection == "events" else row)
+
+
+def record_deletes(layout_id: str, collection: str, ids: Iterable[str]) -> None:
+   delta = pending(db.session).setdefault(layout_id, Delta())
+   for node_id in ids:
+       delta.delete(collection, node_id)
+
+
+def record_version(session, layout_id: str, version: int) -> None:
+   session.info.setdefault("layout_versions", {})[layout_id] = version
+
+
+def collection_of(obj) -> Optional[str]:
+   return COLLECTIONS.get(type(obj))
+
+
+@event.listens_for(OrmSession, "before_flush")
+def collect_flushed(session, flush_context, instances) -> None:
+   """Note the tracked ORM objects this flush writes, per floor."""
+   changes = None
+   for obj in list(session.new) + list(session.dirty):
+       collection = collection_of(obj)
+       if collection is None or (obj not in session.new and not session.is_modified(obj)):
+           continue
+       changes = pending(session) if changes is None else changes
+       changes.setdefault(obj.floor, Delta()).upsert(collection, obj.to_dict())
+       moved_from = inspect(obj).attrs.floor.history.deleted
+       for floor in moved_from or ():
+           if floor and floor != obj.floor:
+               changes.setdefault(floor, Delta()).delete(collection, obj.id)
+   for obj in session.deleted:
+       collection = collection_of(obj)
+       if collection is not None:
+           changes = pending(session) if changes is None else changes
+           changes.setdefault(obj.floor, Delta()).delete(collection, obj.id)
+
+
+@event.listens_for(OrmSession, "before_commit")
+def log_pending(session) -> None:
+   """Write the transaction's layout_change rows alongside its changes."""
+   session.flush()  # collect what the commit's own flush would write
+   changes = session.info.get("layout_changes")
+   versions = session.info.get("layout_versions") or {}
+   rows = []
+   for layout_id, delta in (changes or {}).items():
+       if layout_id in versions:
+           rows.extend(delta.log_rows(layout_id, versions[layout_id]))
+   if rows:
+       session.execute(insert(LayoutChange), rows)
+
+
+@event.listens_for(OrmSession, "after_commit")
+def publish_committed(session) -> None:
+   changes = session.info.pop("layout_changes", None)
+   versions = session.info.pop("layout_versions", None) or {}
+   for layout_id, delta in (changes or {}).items():
+       version = versions.get(layout_id)
+       body = delta.to_dict()
+       # Writes that did not bump the floor's version have no sequence number to publish under.
+       if version is not None and body:
+           change_feed.publish(layout_id, version, body)
+
+
+@event.listens_for(OrmSession, "after_rollback")
+def discard_pending(session) -> None:
+   session.info.pop("layout_changes", None)
+   session.info.pop("layout_versions", None)
+
+
+def row_deltas(collection: str, rows: Iterable[dict]) -> Dict[str, Delta]:
+   """Deltas of rows written outside the ORM session (write-behind ingest), per floor."""
+   deltas: Dict[str, Delta] = {}
+   for row in rows:
+       delta = deltas.setdefault(row["floor"], Delta())
+       delta.upsert(collection, event_dict(row) if collection == "events" else row)
+   return deltas
+
+
+def log_deltas(conn, deltas: Dict[str, Delta], versions: Dict[str, int]) -> None:
+   rows = []
+   for layout_id, delta in deltas.items():
+       if layout_id in versions:
+           rows.extend(delta.log_rows(layout_id, versions[layout_id]))
+   if rows:
+       conn.execute(insert(LayoutChange.__table__), rows)
+
+
+def publish_deltas(deltas: Dict[str, Delta], versions: Dict[str, int]) -> None:
+   for layout_id, delta in deltas.items():
+       if layout_id in versions:
+           change_feed.publish(layout_id, versions[layout_id], delta.to_dict())
+
+
+def changes_since(layout_id: str, since: int, until: int) -> dict:
+   """
+   Current state of every node written on the floor at versions since < v <= until:
+   {"upserted": {collection: [rows]}, "deleted": {collection: [ids]}}.
+
+   Nodes are re-read from their tables, so a row may already reflect versions
+   after `until`; merging it again on the next sync is harmless.
+   """
+   latest: Dict[Tuple[str, str], bool] = {}
+   for collection, node_id, deleted in db.session.execute(
+       select(LayoutChange.collection, LayoutChange.node_id, LayoutChange.deleted)
+       .where(LayoutChange.layout_id == layout_id, LayoutChange.version > since, LayoutChange.version <= until)
+       .order_by(LayoutChange.version, LayoutChange.id)
+   ):
+       latest[(collection, node_id)] = deleted
+
+   upserted: Dict[str, List[dict]] = {}
+   deleted: Dict[str, List[str]] = {}
+   wanted: Dict[str, List[str]] = {}
+   for (collection, node_id), gone in latest.items():
+       if gone:
+           deleted.setdefault(collection, []).append(node_id)
+       elif collection in MODELS:
+           wanted.setdefault(collection, []).append(node_id)
+   for collection, ids in wanted.items():
+       model = MODELS[collection]
+       found = set()
+       spec = ROW_SPECS[collection]
+       for start in range(0, len(ids), CHANGES_CHUNK):
+           chunk = ids[start:start + CHANGES_CHUNK]
+           query = spec.select().where(model.floor == layout_id, model.id.in_(chunk))
+           rows = db.session.connection().execute(query).all()
+           if rows:
+               upserted.setdefault(collection, []).extend(spec.rows(rows))
+           found.update(row.id for row in rows)
+       # Written, then moved or deleted by a change not (yet) in range.
+       missing = [node_id for node_id in ids if node_id not in found]
+       if missing:
+           deleted.setdefault(collection, []).extend(missing)
+   return {"upserted": upserted, "deleted": deleted}
+
+
+class ChangeFeed:
+   """
+   The last FEED_HISTORY deltas of every floor, serialised once and shared
+   by all subscribers; waiters are woken on each publish.
+   """
+
+   def __init__(self, history: int = FEED_HISTORY) -> None:
+       self.history = history
+       self.entries: Dict[str, Deque[Tuple[int, str]]] = {}
+       # Oldest version after which every published change is still buffered.
+       self.known_from: Dict[str, int] = {}
+       self.deleted: Dict[str, int] = {}
+       self.cond = threading.Condition()
+
+   def publish(self, layout_id: str, version: int, delta: dict) -> None:
+       data = json_dumps(delta)
+       with self.cond:
+           entries = self.entries.get(layout_id)
+           if entries is None:
+               entries = self.entries[layout_id] = deque()
+               self.known_from[layout_id] = version - 1
+           if entries and entries[-1][0] >= version:
+               # Commits of concurrent writers can reach here out of order.
+               items = sorted([e for e in entries if e[0] != version] + [(version, data)])
+               entries.clear()
+               entries.extend(items)
+           else:
+               entries.append((version, data))
+           while len(entries) > self.history:
+               self.known_from[layout_id] = entries.popleft()[0]
+           self.cond.notify_all()
+
+   def drop(self, layout_id: str) -> None:
+       """Forget a deleted floor and end its streams."""
+       with self.cond:
+           self.entries.pop(layout_id, None)
+           self.known_from.pop(layout_id, None)
+           self.deleted[layout_id] = self.deleted.get(layout_id, 0) + 1
+           self.cond.notify_all()
+
+   def generation(self, layout_id: str) -> int:
+       with self.cond:
+           return self.deleted.get(layout_id, 0)
+
+   def resumable(self, layout_id: str, after: int, current: int) -> bool:
+       """
+       Whether every change after version `after` up to `current` is still
+       buffered. Versions bumped outside this process (another worker, an
+       offline script) leave gaps the feed cannot fill; clients then refetch.
+       """
+       if after == current:
+           return True
+       with self.cond:
+           known_from = self.known_from.get(layout_id)
+           return known_from is not None and known_from <= after <= current
+
+   def wait(self, layout_id: str, after: int, generation: int, timeout: float) -> Optional[List[Tuple[int, str]]]:
+       """
+       Deltas newer than `after`, blocking up to `timeout` seconds for one to
+       arrive ([] on timeout). None once the floor has been deleted.
+       """
+       with self.cond:
+           while True:
+               if self.deleted.get(layout_id, 0) != generation:
+                   return None
+               entries = self.entries.get(layout_id)
+               if entries and entries[-1][0] > after:
+                   return [e for e in entries if e[0] > after]
+               if not self.cond.wait(timeout):
+                   return []
+
+
+change_feed = ChangeFeed()
@@ -0,0 +1,238 @@
+"""
+Columnar binary encoding of floor collections (application/vnd.sensor-planner.columnar).
+
+Served instead of JSON by the devices/sensors/persons/snapshot routes when the
+client sends `Accept: application/vnd.sensor-planner.columnar`, and accepted by
+the :bulk routes with that Content-Type. The client reads snapshots in this
+format (client/src/services/api/Columnar.ts). All numbers are little-endian.
+
+    bytes 0-3   magic b"SPCF"
+    bytes 4-5   u16 format version (1)
+    bytes 6-7   reserved (0)
+    bytes 8-11  u32 header length H
+    bytes 12-   header, H bytes of UTF-8 JSON
+    data        starts at the next multiple of 8; every section is 8-byte aligned
+
+The header is
+    {"version": 1,
+     "meta": {...},                              # e.g. the snapshot's layout
+     "strings": {"count": n, "offsets": S, "data": S},
+     "collections": {"devices": {"count": rows, "columns": {"x": {"type": "f32", "data": S}, ...}}, ...}}
+where every section S is [byte offset from the start of data, byte length].
+
+Every string (ids, names, protocols, colours, messages) is interned once in
+the string table: `offsets` holds count + 1 u32 byte offsets into the UTF-8
+`data`. Column types:
+    str     u32 string index per row, 0xFFFFFFFF = null
+    strs    list of strings per row: u32 `offsets` (rows + 1) into u32 string indices `data`
+            (a null list is sent as empty)
+    f32     float32 per row, NaN = null (coordinates, radii, speeds)
+    i32     int32 per row
+    time    float64 milliseconds since the epoch (UTC), NaN = null
+    points  list of {x, y} per row: u32 `offsets` (rows + 1) in points into float32 x, y pairs `data`
+    json    u32 string index of the value's JSON text, for values no other type can carry
+
+Coordinates are float32, i.e. exact to about 1/1000 px on a 10 000 px canvas.
+"""
+
+import struct
+from itertools import chain
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from encoding import json_dumps, json_loads
+from serialize import RowSpec, decode_json
+
+
+COLUMNAR_MIMETYPE = "application/vnd.sensor-planner.columnar"
+MAGIC = b"SPCF"
+FORMAT_VERSION = 1
+NULL = 0xFFFFFFFF
+
+# Column types per collection, keyed like the JSON objects (serialize.py specs).
+SCHEMAS: Dict[str, Dict[str, str]] = {
+   "rooms": {"id": "str", "name": "str", "x": "f32", "y": "f32", "width": "f32", "height": "f32"},
+   "devices": {
+       "id": "str", "x": "f32", "y": "f32", "type": "str", "label": "str", "name": "str", "device_rad": "f32",
+       "connectivity": "strs", "compatibleSensors": "strs", "interferenceProtocols": "strs",
+       "connectedSensorIds": "strs", "interferenceIds": "strs", "floor": "str",
+       "date_created": "time", "date_modified": "time",
+   },
+   "sensors": {
+       "id": "str", "type": "str", "name": "str", "x": "f32", "y": "f32", "sensor_rad": "f32",
+       "connectivity": "strs", "connectedDeviceIds": "strs", "interferenceIds": "strs", "floor": "str",
+       "date_created": "time", "date_modified": "time",
+   },
+   "persons": {
+       "id": "str", "name": "str", "floor": "str", "path": "points", "currentIndex": "i32", "direction": "i32",
+       "color": "str", "animationSpeed": "f32", "progress": "f32", "date_created": "time", "date_modified": "time",
+   },
+   "events": {
+       "id": "str", "floor": "str", "nodeId": "str", "nodeType": "str", "eventType": "str", "timestamp": "time",
+       "message": "str", "date_created": "time", "date_modified": "time",
+   },
+}
+
+NUMERIC = {"f32": "<f4", "i32": "<i4", "time": "<f8"}
+EPOCH = np.datetime64(0, "ms")
+
+
+def is_points(values) -> bool:
+   return all(
+       isinstance(p, dict) and len(p) == 2 and isinstance(p.get("x"), (int, float)) and isinstance(p.get("y"), (int, float))
+       for p in values
+   )
+
+
+class ColumnarWriter:
+   """Accumulates interned strings and aligned sections, then writes the container."""
+
+   def __init__(self) -> None:
+       self.strings: Dict[str, int] = {}
+       self.sections: List[bytes] = []
+       self.size = 0
+       self.collections: Dict[str, dict] = {}
+
+   def section(self, array: np.ndarray) -> List[int]:
+       data = array.tobytes()
+       offset = self.size
+       self.sections.append(data + b"\0" * (-len(data) % 8))
+       self.size += len(self.sections[-1])
+       return [offset, len(data)]
+
+   def intern(self, values) -> np.ndarray:
+       table = self.strings
+       return np.fromiter(
+           (NULL if v is None else table.setdefault(v, len(table)) for v in values), dtype="<u4", count=len(values)
+       )
+
+   def column(self, kind: str, values: Sequence) -> dict:
+       if kind == "str":
+           if all(v is None or isinstance(v, str) for v in values):
+               return {"type": "str", "data": self.section(self.intern(values))}
+           kind = "json"
+       if kind in NUMERIC:
+           if kind == "time":
+               ms = np.array(values, dtype="datetime64[ms]")
+               array = np.where(np.isnat(ms), np.nan, (ms - EPOCH).astype(np.float64))
+           elif kind == "i32":
+               array = np.array(values, dtype="<i4")
+           else:
+               array = np.array([np.nan if v is None else v for v in values], dtype="<f4")
+           return {"type": kind, "data": self.section(array.astype(NUMERIC[kind]))}
+       if kind == "strs":
+           lists = [v or [] for v in values]
+           if all(isinstance(v, list) and all(isinstance(s, str) for s in v) for v in lists):
+               offsets = np.zeros(len(lists) + 1, dtype="<u4")
+               np.cumsum([len(v) for v in lists], out=offsets[1:])
+               flat = list(chain.from_iterable(lists))
+               return {"type": "strs", "offsets": self.section(offsets), "data": self.section(self.intern(flat))}
+           kind = "json"
+       if kind == "points":
+           paths = [v or [] for v in values]
+           if all(isinstance(v, list) and is_points(v) for v in paths):
+               offsets = np.zeros(len(paths) + 1, dtype="<u4")
+               np.cumsum([len(v) for v in paths], out=offsets[1:])
+               xy = np.array([(p["x"], p["y"]) for p in chain.from_iterable(paths)], dtype="<f4").reshape(-1, 2)
+               return {"type": "points", "offsets": self.section(offsets), "data": self.section(xy)}
+           kind = "json"
+       texts = [None if v is None else json_dumps(v) for v in values]
+       return {"type": "json", "data": self.section(self.intern(texts))}
+
+   def add_rows(self, name: str, spec: RowSpec, rows: Sequence[Sequence]) -> None:
+       """Add Core rows selected with spec.select(); JSON columns arrive as text and are decoded here."""
+       schema = SCHEMAS[name]
+       decoded = {index for index, fn in spec.convert if fn is decode_json}
+       columns = list(zip(*rows)) if rows else [()] * len(spec.keys)
+       result = {}
+       for index, key in enumerate(spec.keys):
+           values = columns[index]
+           if index in decoded:
+               values = [decode_json(v) for v in values]
+           result[key] = self.column(schema[key], values)
+       self.collections[name] = {"count": len(rows), "columns": result}
+
+   def finish(self, meta: Optional[dict] = None) -> bytes:
+       texts = [s.encode() for s in self.strings]
+       offsets = np.zeros(len(texts) + 1, dtype="<u4")
+       np.cumsum([len(t) for t in texts], out=offsets[1:])
+       strings = {
+           "count": len(texts),
+           "offsets": self.section(offsets),
+           "data": self.section(np.frombuffer(b"".join(texts), dtype=np.uint8)),
+       }
+       header = json_dumps({
+           "version": FORMAT_VERSION,
+           "meta": meta or {},
+           "strings": strings,
+           "collections": self.collections,
+       }).encode()
+       head = MAGIC + struct.pack("<HHI", FORMAT_VERSION, 0, len(header)) + header
+       head += b"\0" * (-len(head) % 8)
+       return head + b"".join(self.sections)
+
+
+def encode_collection(name: str, spec: RowSpec, rows: Sequence[Sequence], meta: Optional[dict] = None) -> bytes:
+   writer = ColumnarWriter()
+   writer.add_rows(name, spec, rows)
+   return writer.finish(meta)
+
+
+def decode(body: bytes) -> Tuple[dict, Dict[str, List[dict]]]:
+   """(meta, {collection: [row dicts]}) from a columnar payload; ValueError when malformed."""
+   try:
+       if body[:4] != MAGIC:
+           raise ValueError("not a columnar payload")
+       version, _, length = struct.unpack_from("<HHI", body, 4)
+       if version != FORMAT_VERSION:
+           raise ValueError(f"unsupported columnar version {version}")
+       header = json_loads(body[12:12 + length])
+       data = memoryview(body)[(12 + length + 7) // 8 * 8:]
+
+       def section(span, dtype) -> np.ndarray:
+           offset, size = span
+           if offset < 0 or size < 0 or offset + size > len(data):
+               raise ValueError("section out of bounds")
+           return np.frombuffer(data[offset:offset + size], dtype=dtype)
+
+       table = header["strings"]
+       string_offsets = section(table["offsets"], "<u4")
+       blob = section(table["data"], np.uint8).tobytes()
+       strings = [blob[a:b].decode() for a, b in zip(string_offsets[:-1], string_offsets[1:])]
+
+       def text(index) -> Optional[str]:
+           return None if index == NULL else strings[index]
+
+       collections = {}
+       for name, collection in header["collections"].items():
+           count = collection["count"]
+           values = {}
+           for key, column in collection["columns"].items():
+               kind = column["type"]
+               if kind == "str":
+                   values[key] = [text(i) for i in section(column["data"], "<u4").tolist()]
+               elif kind == "json":
+                   values[key] = [None if i == NULL else json_loads(strings[i]) for i in section(column["data"], "<u4").tolist()]
+               elif kind in ("f32", "time"):
+                   array = section(column["data"], NUMERIC[kind]).astype(np.float64)
+                   values[key] = [None if v != v else v for v in array.tolist()]
+               elif kind == "i32":
+                   values[key] = section(column["data"], "<i4").tolist()
+               elif kind == "strs":
+                   offsets = section(column["offsets"], "<u4").tolist()
+                   flat = [text(i) for i in section(column["data"], "<u4").tolist()]
+                   values[key] = [flat[a:b] for a, b in zip(offsets[:-1], offsets[1:])]
+               elif kind == "points":
+                   offsets = section(column["offsets"], "<u4").tolist()
+                   xy = section(column["data"], "<f4").reshape(-1, 2).tolist()
+                   values[key] = [[{"x": x, "y": y} for x, y in xy[a:b]] for a, b in zip(offsets[:-1], offsets[1:])]
+               else:
+                   raise ValueError(f"unknown column type {kind!r}")
+               if len(values[key]) != count:
+                   raise ValueError(f"column {name}.{key} has {len(values[key])} values, expected {count}")
+           keys = list(values)
+           collections[name] = [dict(zip(keys, row)) for row in zip(*values.values())]
+       return header.get("meta", {}), collections
+   except (KeyError, TypeError, IndexError, struct.error, UnicodeDecodeError) as e:
+       raise ValueError(f"malformed columnar payload: {e}") from e
@@ -0,0 +1,237 @@
+"""
+Vectorised sensor/device connectivity.
+
+Server-side port of client/src/components/utils/computations/DetectConnectedNodes.ts.
+A sensor and a device are connected when they are within range of each other
+(distance <= sensor_rad + device_rad), share at least one connectivity
+protocol, and the sensor's type is listed in the device's compatibleSensors.
+
+Protocol sets and compatible sensor types are encoded as bitmasks so the
+per-pair checks become integer ANDs evaluated with NumPy broadcasting.
+"""
+
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+DEFAULT_SENSOR_RADIUS = 150.0
+DEFAULT_DEVICE_RADIUS = 30.0
+
+# Rows of the sensor matrix evaluated per broadcast, keeps memory bounded on large floors.
+BLOCK_SIZE = 256
+
+
+class Vocabulary:
+   """Maps strings (protocols, sensor types) to bit positions."""
+
+   def __init__(self) -> None:
+       self.index: Dict[str, int] = {}
+
+   def add(self, value: str) -> int:
+       bit = self.index.get(value)
+       if bit is None:
+           bit = len(self.index)
+           self.index[value] = bit
+       return bit
+
+   @property
+   def words(self) -> int:
+       # Number of uint64 words needed to hold every bit, at least one.
+       return max(1, (len(self.index) + 63) // 64)
+
+
+def encode_sets(values: Sequence[Iterable[str]], vocab: Vocabulary) -> np.ndarray:
+   """Encode a list of string sets as an (n, words) uint64 bitmask matrix."""
+   rows = []
+   for items in values:
+       mask = 0
+       for v in items or []:
+           if v and v.strip():
+               mask |= 1 << vocab.add(v)
+       rows.append(mask)
+   words = vocab.words
+   masks = np.zeros((len(rows), words), dtype=np.uint64)
+   for word in range(words):
+       shift = 64 * word
+       masks[:, word] = [(m >> shift) & 0xFFFFFFFFFFFFFFFF for m in rows]
+   return masks
+
+
+def pad_words(masks: np.ndarray, words: int) -> np.ndarray:
+   """Widen a bitmask matrix encoded before the vocabulary grew."""
+   if masks.shape[1] == words:
+       return masks
+   padded = np.zeros((masks.shape[0], words), dtype=np.uint64)
+   padded[:, : masks.shape[1]] = masks
+   return padded
+
+
+def radii(values: Iterable, default: float) -> np.ndarray:
+   return np.array([default if r is None else r for r in values], dtype=np.float64)
+
+
+def range_pairs(
+   ax: np.ndarray,
+   ay: np.ndarray,
+   ar: np.ndarray,
+   bx: np.ndarray,
+   by: np.ndarray,
+   br: np.ndarray,
+   pair_filter=None,
+) -> Tuple[np.ndarray, np.ndarray]:
+   """
+   Return index arrays (a_idx, b_idx) of every pair whose discs touch.
+
+   Both sides are sorted by x so each block of `a` only broadcasts against the
+   slice of `b` that can possibly be in range. `pair_filter(a_idx, b_idx)` is
+   called with aligned index arrays of the in-range candidates and returns a
+   boolean mask of the pairs to keep (protocol checks etc.).
+   """
+   if len(ax) == 0 or len(bx) == 0:
+       empty = np.empty(0, dtype=np.int64)
+       return empty, empty
+
+   a_order = np.argsort(ax, kind="stable")
+   b_order = np.argsort(bx, kind="stable")
+   b_sorted_x = bx[b_order]
+   max_br = float(br.max())
+
+   a_hits: List[np.ndarray] = []
+   b_hits: List[np.ndarray] = []
+   for start in range(0, len(a_order), BLOCK_SIZE):
+       a_idx = a_order[start : start + BLOCK_SIZE]
+       reach = float(ar[a_idx].max()) + max_br
+       lo = np.searchsorted(b_sorted_x, ax[a_idx[0]] - reach, side="left")
+       hi = np.searchsorted(b_sorted_x, ax[a_idx[-1]] + reach, side="right")
+       if lo >= hi:
+           continue
+       b_idx = b_order[lo:hi]
+
+       dx = ax[a_idx, None] - bx[None, b_idx]
+       dy = ay[a_idx, None] - by[None, b_idx]
+       limit = ar[a_idx, None] + br[None, b_idx]
+       rows, cols = np.nonzero(dx * dx + dy * dy <= limit * limit)
+       a_pair = a_idx[rows]
+       b_pair = b_idx[cols]
+       if pair_filter is not None:
+           keep = pair_filter(a_pair, b_pair)
+           a_pair = a_pair[keep]
+           b_pair = b_pair[keep]
+       a_hits.append(a_pair)
+       b_hits.append(b_pair)
+
+   if not a_hits:
+       empty = np.empty(0, dtype=np.int64)
+       return empty, empty
+   return np.concatenate(a_hits), np.concatenate(b_hits)
+
+
+def shares_any(a_masks: np.ndarray, b_masks: np.ndarray) -> np.ndarray:
+   """Row-wise 'any bit shared' test for two aligned (n, words) bitmask matrices."""
+   return ((a_masks & b_masks) != 0).any(axis=1)
+
+
+def has_bit(masks: np.ndarray, bits: np.ndarray) -> np.ndarray:
+   """Row-wise test of whether bit `bits[i]` is set in `masks[i]`."""
+   words = masks[np.arange(len(bits)), bits // 64]
+   return ((words >> (bits % 64).astype(np.uint64)) & np.uint64(1)) == 1
+
+
+def connected_pairs(
+   sx: np.ndarray,
+   sy: np.ndarray,
+   sr: np.ndarray,
+   s_proto: np.ndarray,
+   s_type: np.ndarray,
+   dx: np.ndarray,
+   dy: np.ndarray,
+   dr: np.ndarray,
+   d_proto: np.ndarray,
+   d_compat: np.ndarray,
+   propagation=None,
+   protocols: Optional[Dict[str, int]] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+   """
+   (sensor_idx, device_idx) of every connected pair, from already encoded arrays.
+
+   With a `propagation` model (propagation.PropagationModel) pairs must also
+   stay in range once walls are crossed; `protocols` maps names to bits.
+   """
+
+   def protocol_and_type(s_idx: np.ndarray, d_idx: np.ndarray) -> np.ndarray:
+       keep = shares_any(s_proto[s_idx], d_proto[d_idx]) & has_bit(d_compat[d_idx], s_type[s_idx])
+       if propagation is None or not keep.any():
+           return keep
+       s_idx, d_idx = s_idx[keep], d_idx[keep]
+       keep[keep] = propagation.in_range(
+           sx[s_idx], sy[s_idx], dx[d_idx], dy[d_idx], sr[s_idx] + dr[d_idx],
+           s_proto[s_idx] & d_proto[d_idx], protocols or {},
+       )
+       return keep
+
+   return range_pairs(sx, sy, sr, dx, dy, dr, pair_filter=protocol_and_type)
+
+
+def compute_connectivity(
+   sensors: Sequence, devices: Sequence, propagation=None
+) -> Tuple[Dict[str, List[str]], Dict[str, List[str]]]:
+   """
+   Compute connectedDeviceIds for every sensor and connectedSensorIds for every device.
+
+   `sensors` need id, x, y, type, sensor_rad and connectivity attributes;
+   `devices` need id, x, y, device_rad, connectivity and compatibleSensors.
+   Both are assumed to be on the same floor. Pass a propagation.PropagationModel
+   to account for walls instead of the plain radius check.
+   """
+   sensor_ids = [s.id for s in sensors]
+   device_ids = [d.id for d in devices]
+
+   protocols = Vocabulary()
+   types = Vocabulary()
+   s_proto = encode_sets([s.connectivity for s in sensors], protocols)
+   d_proto = encode_sets([d.connectivity for d in devices], protocols)
+   d_compat = encode_sets([d.compatibleSensors for d in devices], types)
+   s_proto = pad_words(s_proto, protocols.words)
+   d_proto = pad_words(d_proto, protocols.words)
+   s_type = np.array([types.add(s.type) for s in sensors], dtype=np.int64)
+   d_compat = pad_words(d_compat, types.words)
+
+   s_hit, d_hit = connected_pairs(
+       np.array([s.x for s in sensors], dtype=np.float64),
+       np.array([s.y for s in sensors], dtype=np.float64),
+       radii((s.sensor_rad for s in sensors), DEFAULT_SENSOR_RADIUS),
+       s_proto,
+       s_type,
+       np.array([d.x for d in devices], dtype=np.float64),
+       np.array([d.y for d in devices], dtype=np.float64),
+       radii((d.device_rad for d in devices), DEFAULT_DEVICE_RADIUS),
+       d_proto,
+       d_compat,
+       propagation,
+       protocols.index,
+   )
+
+   sensor_links: Dict[str, List[str]] = {sid: [] for sid in sensor_ids}
+   device_links: Dict[str, List[str]] = {did: [] for did in device_ids}
+
+   # Keep the client's ordering: each list follows the other side's input order.
+   order = np.lexsort((d_hit, s_hit))
+   for s, d in zip(s_hit[order].tolist(), d_hit[order].tolist()):
+       sensor_links[sensor_ids[s]].append(device_ids[d])
+   order = np.lexsort((s_hit, d_hit))
+   for s, d in zip(s_hit[order].tolist(), d_hit[order].tolist()):
+       device_links[device_ids[d]].append(sensor_ids[s])
+
+   return sensor_links, device_links
+
+
+def connection_changes(previous: Iterable[str], current: Iterable[str]) -> Tuple[List[str], List[str]]:
+   """Return (added, removed) ids between two adjacency lists."""
+   prev = list(previous or [])
+   prev_set = set(prev)
+   curr = list(current or [])
+   curr_set = set(curr)
+   added = [i for i in curr if i not in prev_set]
+   removed = [i for i in prev if i not in curr_set]
+   return added, removed
@@ -0,0 +1,224 @@
+"""
+Rasterised sensor coverage per room.
+
+Rooms and sensor discs are rasterised onto one grid spanning the floor's
+rooms; each cell holds the number of discs covering its centre. A floor's
+grid is cached together with the discs it was painted from, so at a new
+layout version only sensors that were added, removed, moved or resized are
+re-rasterised, each within its own bounding box. Changed rooms or another
+resolution rebuild the grid. Responses are cached per layout version.
+"""
+
+import base64
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from connectivity import DEFAULT_SENSOR_RADIUS
+from encoding import json_bytes
+
+
+COVERAGE_CACHE_SIZE = 32
+DEFAULT_COVERAGE_RESOLUTION = 10.0  # grid cell size in canvas pixels
+MAX_COVERAGE_CELLS = 4_000_000
+HEATMAP_ENCODINGS = ("png", "rle")
+
+# sensor id -> (x, y, radius)
+Discs = Dict[str, Tuple[float, float, float]]
+
+
+class CoverageGrid:
+   """Per-cell sensor counts over the bounding box of a floor's rooms."""
+
+   def __init__(self, rooms: Sequence, resolution: float) -> None:
+       self.rooms = [(r.id, r.name, float(r.x), float(r.y), float(r.width), float(r.height)) for r in rooms]
+       self.resolution = resolution
+       rects = np.array([r[2:] for r in self.rooms], dtype=np.float64).reshape(-1, 4)
+       if len(rects):
+           self.x0, self.y0 = float(rects[:, 0].min()), float(rects[:, 1].min())
+           x1, y1 = (rects[:, 0] + rects[:, 2]).max(), (rects[:, 1] + rects[:, 3]).max()
+       else:
+           self.x0 = self.y0 = x1 = y1 = 0.0
+       nx = int(np.ceil((x1 - self.x0) / resolution))
+       ny = int(np.ceil((y1 - self.y0) / resolution))
+       if nx * ny > MAX_COVERAGE_CELLS:
+           raise ValueError(f"resolution too fine: {nx * ny} cells exceeds {MAX_COVERAGE_CELLS}")
+       self.xs = self.x0 + (np.arange(nx) + 0.5) * resolution
+       self.ys = self.y0 + (np.arange(ny) + 0.5) * resolution
+       self.counts = np.zeros((ny, nx), dtype=np.int32)
+       # Cell slices (rows, cols) of every room, and the union of all rooms.
+       self.slices = []
+       self.inside = np.zeros((ny, nx), dtype=bool)
+       for _, _, rx, ry, rw, rh in self.rooms:
+           cols = np.flatnonzero((self.xs >= rx) & (self.xs <= rx + rw))
+           rows = np.flatnonzero((self.ys >= ry) & (self.ys <= ry + rh))
+           span = (
+               slice(rows[0], rows[-1] + 1) if len(rows) else slice(0, 0),
+               slice(cols[0], cols[-1] + 1) if len(cols) else slice(0, 0),
+           )
+           self.slices.append(span)
+           self.inside[span] = True
+       self.discs: Discs = {}
+
+   def paint(self, x: float, y: float, r: float, delta: int) -> None:
+       """Add `delta` to every cell whose centre lies in the disc, touching only its bounding box."""
+       res = self.resolution
+       i0 = max(0, int(np.floor((x - r - self.x0) / res)))
+       i1 = min(len(self.xs), int(np.ceil((x + r - self.x0) / res)) + 1)
+       j0 = max(0, int(np.floor((y - r - self.y0) / res)))
+       j1 = min(len(self.ys), int(np.ceil((y + r - self.y0) / res)) + 1)
+       if i0 >= i1 or j0 >= j1:
+           return
+       dx = self.xs[i0:i1] - x
+       dy = self.ys[j0:j1] - y
+       self.counts[j0:j1, i0:i1] += delta * (dy[:, None] ** 2 + dx[None, :] ** 2 <= r * r)
+
+   def sync(self, discs: Discs) -> int:
+       """Repaint the sensors whose disc differs from the last sync; returns how many changed."""
+       changed = 0
+       for sid, old in self.discs.items():
+           if discs.get(sid) != old:
+               self.paint(*old, -1)
+               changed += 1
+       for sid, new in discs.items():
+           old = self.discs.get(sid)
+           if old != new:
+               self.paint(*new, 1)
+               if old is None:
+                   changed += 1
+       self.discs = dict(discs)
+       return changed
+
+   def room_stats(self) -> dict:
+       rooms = []
+       for (room_id, name, *_), span in zip(self.rooms, self.slices):
+           cells = self.counts[span]
+           rooms.append(stats(room_id, name, cells.size, np.count_nonzero(cells), np.count_nonzero(cells > 1)))
+       inside = self.counts[self.inside]
+       total = stats(None, None, inside.size, np.count_nonzero(inside), np.count_nonzero(inside > 1))
+       return {"rooms": rooms, "total": total}
+
+   def heatmap(self, encoding: str) -> dict:
+       """Per-cell counts (capped at 255), row-major from the top-left cell."""
+       values = np.minimum(self.counts, 255).astype(np.uint8)
+       ny, nx = values.shape
+       result = {
+           "encoding": encoding,
+           "width": nx,
+           "height": ny,
+           "origin": [self.x0, self.y0],
+           "resolution": self.resolution,
+       }
+       if encoding == "png":
+           result["data"] = base64.b64encode(png_gray8(values)).decode()
+       else:
+           flat = values.ravel()
+           starts = np.flatnonzero(np.concatenate(([True], flat[1:] != flat[:-1]))) if flat.size else flat
+           runs = np.diff(np.concatenate((starts, [flat.size]))).astype("<u4")
+           result["values"] = base64.b64encode(flat[starts].tobytes()).decode()
+           result["runs"] = base64.b64encode(runs.tobytes()).decode()
+       return result
+
+
+def stats(room_id: Optional[str], name: Optional[str], cells: int, covered: int, multi: int) -> dict:
+   cells, covered, multi = int(cells), int(covered), int(multi)
+   row = {} if room_id is None else {"id": room_id, "name": name}
+   row.update({
+       "cells": cells,
+       "coverage": round(100.0 * covered / cells, 2) if cells else 0.0,
+       "coverage_2": round(100.0 * multi / cells, 2) if cells else 0.0,
+   })
+   return row
+
+
+def png_gray8(values: np.ndarray) -> bytes:
+   """Minimal 8-bit greyscale PNG (no filtering) for a 2-D uint8 array."""
+   height, width = values.shape
+
+   def chunk(tag: bytes, data: bytes) -> bytes:
+       return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+   raw = np.hstack((np.zeros((height, 1), dtype=np.uint8), values)).tobytes()
+   return (
+       b"\x89PNG\r\n\x1a\n"
+       + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0))
+       + chunk(b"IDAT", zlib.compress(raw, 6))
+       + chunk(b"IEND", b"")
+   )
+
+
+def sensor_discs(sensors: Sequence) -> Discs:
+   return {
+       s.id: (float(s.x), float(s.y), float(DEFAULT_SENSOR_RADIUS if s.sensor_rad is None else s.sensor_rad))
+       for s in sensors
+   }
+
+
+class CoverageCache:
+   """
+   LRU of coverage grids keyed by (layout id, resolution).
+
+   Each entry keeps the grid, the layout version it reflects and the
+   serialised responses for that version (one per heatmap encoding).
+   """
+
+   def __init__(self, max_entries: int = COVERAGE_CACHE_SIZE) -> None:
+       self.max_entries = max_entries
+       self.entries: "OrderedDict[Tuple[str, float], list]" = OrderedDict()
+       self.lock = threading.Lock()
+
+   def cached(self, layout_id: str, resolution: float, version: int, heatmap: Optional[str]) -> Optional[bytes]:
+       with self.lock:
+           entry = self.entries.get((layout_id, resolution))
+           if entry is None or entry[0] != version:
+               return None
+           self.entries.move_to_end((layout_id, resolution))
+           return entry[2].get(heatmap)
+
+   def render(
+       self, layout_id: str, resolution: float, version: int, heatmap: Optional[str], rooms: Sequence, sensors: Sequence
+   ) -> bytes:
+       """Bring the floor's grid up to `version` (incrementally when rooms are unchanged) and serialise it."""
+       key = (layout_id, resolution)
+       with self.lock:
+           entry = self.entries.get(key)
+           room_key = [(r.id, r.name, float(r.x), float(r.y), float(r.width), float(r.height)) for r in rooms]
+           if entry is None or entry[1].rooms != room_key:
+               entry = [None, CoverageGrid(rooms, resolution), {}]
+           grid = entry[1]
+           if entry[0] != version:
+               changed = grid.sync(sensor_discs(sensors))
+               entry[0], entry[2] = version, {}
+           else:
+               changed = 0
+           body = entry[2].get(heatmap)
+           if body is None:
+               payload = {
+                   "layout_id": layout_id,
+                   "version": version,
+                   "resolution": resolution,
+                   "sensors": len(grid.discs),
+                   "repainted": changed,
+               }
+               payload.update(grid.room_stats())
+               if heatmap:
+                   payload["heatmap"] = grid.heatmap(heatmap)
+               body = json_bytes(payload)
+               entry[2][heatmap] = body
+           self.entries[key] = entry
+           self.entries.move_to_end(key)
+           while len(self.entries) > self.max_entries:
+               self.entries.popitem(last=False)
+           return body
+
+   def drop(self, layout_id: str) -> None:
+       with self.lock:
+           for key in [k for k in self.entries if k[0] == layout_id]:
+               del self.entries[key]
+
+
+coverage_cache = CoverageCache()
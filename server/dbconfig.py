@@ -0,0 +1,167 @@
+"""
+Environment-driven database configuration.
+
+    DATABASE_URL            primary database (default sqlite:///smart.db, in the instance folder)
+    DATABASE_READ_URL       optional read replica; GET/HEAD requests read from it
+    DB_POOL_SIZE            PostgreSQL pool size (default 10)
+    DB_MAX_OVERFLOW         connections allowed beyond the pool (default 20)
+    DB_POOL_RECYCLE         seconds before a pooled connection is replaced (default 1800)
+    DB_STATEMENT_TIMEOUT_MS PostgreSQL statement_timeout (default 30000, 0 = off)
+    SQLITE_BUSY_TIMEOUT_MS  how long SQLite waits on a locked database (default 5000)
+    SQLITE_SYNCHRONOUS      SQLite synchronous pragma (default NORMAL, safe with WAL)
+    SQLITE_MMAP_SIZE        bytes of the SQLite file to memory-map (default 256 MiB)
+
+SQLite connections are switched to WAL on connect, so readers no longer block
+the writer and concurrent writes wait for the busy timeout instead of failing
+with "database is locked". PostgreSQL gets a sized, pre-pinged pool and a
+server-side statement timeout. health_report() summarises what is actually in
+effect and is logged at startup.
+"""
+
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+import flask_sqlalchemy.session
+from flask import has_request_context, request
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+
+from encoding import json_dumps, json_loads
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DATABASE_URL = "sqlite:///smart.db"
+REPLICA_BIND = "replica"
+READ_METHODS = ("GET", "HEAD")
+
+
+def env_int(name: str, default: int) -> int:
+   value = os.environ.get(name)
+   return default if value in (None, "") else int(value)
+
+
+def database_url(value: Optional[str]) -> Optional[str]:
+   """Normalise the postgres:// scheme some hosts hand out to what SQLAlchemy expects."""
+   if value and value.startswith("postgres://"):
+       return "postgresql://" + value[len("postgres://"):]
+   return value or None
+
+
+def engine_options(url: str) -> dict:
+   """create_engine() options for `url`'s backend."""
+   options = {"json_serializer": json_dumps, "json_deserializer": json_loads}
+   backend = make_url(url).get_backend_name()
+   if backend == "postgresql":
+       options.update(
+           pool_size=env_int("DB_POOL_SIZE", 10),
+           max_overflow=env_int("DB_MAX_OVERFLOW", 20),
+           pool_recycle=env_int("DB_POOL_RECYCLE", 1800),
+           pool_pre_ping=True,
+       )
+       timeout = env_int("DB_STATEMENT_TIMEOUT_MS", 30000)
+       if timeout > 0:
+           options["connect_args"] = {"options": f"-c statement_timeout={timeout}"}
+   elif backend == "sqlite":
+       # pysqlite's own busy handler, in seconds; the pragma below sets the same for raw connections.
+       options["connect_args"] = {"timeout": env_int("SQLITE_BUSY_TIMEOUT_MS", 5000) / 1000.0}
+   return options
+
+
+def sqlite_pragmas() -> Dict[str, str]:
+   return {
+       "journal_mode": "WAL",
+       "synchronous": os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL"),
+       "busy_timeout": str(env_int("SQLITE_BUSY_TIMEOUT_MS", 5000)),
+       "mmap_size": str(env_int("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)),
+   }
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+   cursor = dbapi_connection.cursor()
+   try:
+       for name, value in sqlite_pragmas().items():
+           cursor.execute(f"PRAGMA {name}={value}")
+   finally:
+       cursor.close()
+
+
+def configure(app) -> None:
+   """Set the app's database URL, binds and engine options from the environment; call before db.init_app()."""
+   url = database_url(os.environ.get("DATABASE_URL")) or DEFAULT_DATABASE_URL
+   app.config["SQLALCHEMY_DATABASE_URI"] = url
+   app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(url)
+   read_url = database_url(os.environ.get("DATABASE_READ_URL"))
+   if read_url:
+       app.config["SQLALCHEMY_BINDS"] = {REPLICA_BIND: {"url": read_url, **engine_options(read_url)}}
+
+
+def install(db, app) -> None:
+   """Hook connection setup into the app's engines; call after db.init_app()."""
+   with app.app_context():
+       for engine in db.engines.values():
+           if engine.dialect.name == "sqlite":
+               event.listen(engine, "connect", set_sqlite_pragmas)
+
+
+class RoutingSession(flask_sqlalchemy.session.Session):
+   """
+   Sends the reads of GET/HEAD requests to the read replica when one is
+   configured; everything else (and anything flushed) uses the primary.
+   """
+
+   def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+       if bind is None and not self._flushing and has_request_context() and request.method in READ_METHODS:
+           replica = self._db.engines.get(REPLICA_BIND)
+           if replica is not None:
+               return replica
+       return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def engine_health(engine) -> dict:
+   report = {"url": engine.url.render_as_string(hide_password=True), "dialect": engine.dialect.name}
+   try:
+       start = time.perf_counter()
+       with engine.connect() as conn:
+           conn.execute(text("SELECT 1"))
+           report["latency_ms"] = round((time.perf_counter() - start) * 1000, 2)
+           if engine.dialect.name == "sqlite":
+               report["sqlite_version"] = conn.exec_driver_sql("SELECT sqlite_version()").scalar()
+               for name in sqlite_pragmas():
+                   report[name] = conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+           elif engine.dialect.name == "postgresql":
+               report["server_version"] = conn.exec_driver_sql("SHOW server_version").scalar()
+               report["statement_timeout"] = conn.exec_driver_sql("SHOW statement_timeout").scalar()
+               report["in_recovery"] = conn.exec_driver_sql("SELECT pg_is_in_recovery()").scalar()
+       report["pool"] = engine.pool.status()
+       report["ok"] = True
+   except Exception as e:
+       report["ok"] = False
+       report["error"] = str(e)
+   return report
+
+
+def health_report(db, app) -> dict:
+   """Connectivity and effective settings of the primary and (if configured) the replica."""
+   with app.app_context():
+       report = {"primary": engine_health(db.engines[None])}
+       if REPLICA_BIND in db.engines:
+           report["replica"] = engine_health(db.engines[REPLICA_BIND])
+   report["ok"] = all(part["ok"] for part in report.values())
+   return report
+
+
+def log_health_report(db, app) -> dict:
+   report = health_report(db, app)
+   for name in ("primary", "replica"):
+       part = report.get(name)
+       if part is None:
+           continue
+       if part["ok"]:
+           settings = {k: v for k, v in part.items() if k not in ("url", "ok")}
+           logger.info("Database %s %s: %s", name, part["url"], settings)
+       else:
+           logger.error("Database %s %s unreachable: %s", name, part["url"], part["error"])
+   return report
@@ -0,0 +1,35 @@
+"""
+JSON encoding helpers; use orjson when installed, stdlib json otherwise.
+
+Both backends write naive datetimes as isoformat() strings, matching the
+models' to_dict().
+"""
+
+import json
+from datetime import datetime
+
+try:
+   import orjson
+except ImportError:  # optional speed-up
+   orjson = None
+
+
+def _default(value):
+   if isinstance(value, datetime):
+       return value.isoformat()
+   raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def json_dumps(value) -> str:
+   if orjson is not None:
+       return orjson.dumps(value).decode()
+   return json.dumps(value, default=_default)
+
+
+def json_bytes(value) -> bytes:
+   if orjson is not None:
+       return orjson.dumps(value)
+   return json.dumps(value, separators=(",", ":"), default=_default).encode()
+
+
+json_loads = orjson.loads if orjson is not None else json.loads
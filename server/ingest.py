@@ -0,0 +1,182 @@
+"""
+Write-behind buffer for high-rate log and simulation event ingestion.
+
+Batch routes validate rows synchronously and hand them to a bounded in-memory
+queue; a background thread drains it and writes with executemany, flushing
+every `batch_size` rows or `flush_interval` seconds, whichever comes first.
+When the queue is full the routes answer 429 instead of blocking. Pending rows
+are flushed on interpreter shutdown.
+"""
+
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Sequence, Tuple
+
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+
+from changes import log_deltas, publish_deltas, row_deltas
+from models import db, Layout, SimulationEvent
+
+
+logger = logging.getLogger(__name__)
+
+INGEST_MAX_ROWS = 50000
+INGEST_BATCH_SIZE = 1000
+INGEST_FLUSH_INTERVAL = 0.05  # seconds
+
+
+class WriteBehindBuffer:
+   """Bounded queue of (table, row) pairs drained by one writer thread."""
+
+   def __init__(
+       self,
+       app,
+       max_rows: int = INGEST_MAX_ROWS,
+       batch_size: int = INGEST_BATCH_SIZE,
+       flush_interval: float = INGEST_FLUSH_INTERVAL,
+   ) -> None:
+       self.app = app
+       self.max_rows = max_rows
+       self.batch_size = batch_size
+       self.flush_interval = flush_interval
+       self.queue: Deque[Tuple[object, dict]] = deque()
+       self.cond = threading.Condition()
+       self.worker = None
+       self.closed = False
+       self.written = 0
+       self.dropped = 0
+
+   def put_many(self, table, rows: Sequence[dict]) -> bool:
+       """Queue all rows or none; False means the buffer is full (backpressure)."""
+       with self.cond:
+           if self.closed or len(self.queue) + len(rows) > self.max_rows:
+               return False
+           self.queue.extend((table, row) for row in rows)
+           if self.worker is None:
+               self.start()
+           if len(self.queue) >= self.batch_size:
+               self.cond.notify()
+           return True
+
+   def start(self) -> None:
+       self.worker = threading.Thread(target=self.run, name="ingest-writer", daemon=True)
+       self.worker.start()
+       atexit.register(self.close)
+
+   def pending(self) -> int:
+       with self.cond:
+           return len(self.queue)
+
+   def take(self) -> List[Tuple[object, dict]]:
+       with self.cond:
+           deadline = time.monotonic() + self.flush_interval
+           while len(self.queue) < self.batch_size and not self.closed:
+               remaining = deadline - time.monotonic()
+               if remaining <= 0:
+                   break
+               self.cond.wait(remaining)
+           count = min(len(self.queue), self.batch_size)
+           return [self.queue.popleft() for _ in range(count)]
+
+   def run(self) -> None:
+       while True:
+           batch = self.take()
+           if batch:
+               accounted = self.written + self.dropped
+               try:
+                   self.flush(batch)
+               except Exception:
+                   # Never let one bad flush end the only writer; rows already written or dropped stay counted once.
+                   lost = len(batch) - (self.written + self.dropped - accounted)
+                   logger.exception("Dropping %d rows of a batch after write failure", lost)
+                   self.dropped += lost
+           elif self.closed:
+               return
+
+   def flush(self, batch: List[Tuple[object, dict]]) -> None:
+       groups: Dict[object, List[dict]] = {}
+       for table, row in batch:
+           groups.setdefault(table, []).append(row)
+       with self.app.app_context():
+           for table, rows in groups.items():
+               self.write(table, rows)
+
+   def write(self, table, rows: List[dict]) -> None:
+       floors = {row["floor"] for row in rows if row.get("floor")}
+       try:
+           with db.engine.begin() as conn:
+               conn.execute(insert(table), rows)
+               versions = self.bump_versions(conn, floors)
+               deltas = self.log_changes(conn, table, rows, versions)
+           self.written += len(rows)
+           publish_deltas(deltas, versions)
+           return
+       except IntegrityError:
+           pass
+       except Exception:
+           logger.exception("Dropping %d %s rows after write failure", len(rows), table.name)
+           self.dropped += len(rows)
+           return
+
+       # A duplicate id (e.g. a retried batch) fails the executemany; keep the rest.
+       # Row-at-a-time transactions rather than SAVEPOINTs, which pysqlite mishandles.
+       written, failed = [], 0
+       for row in rows:
+           try:
+               with db.engine.begin() as conn:
+                   conn.execute(insert(table), row)
+               self.written += 1
+               written.append(row)
+           except IntegrityError:
+               self.dropped += 1
+           except Exception:
+               failed += 1
+               self.dropped += 1
+       if failed:
+           logger.error("Dropped %d %s rows after write failure", failed, table.name)
+       try:
+           with db.engine.begin() as conn:
+               versions = self.bump_versions(conn, floors)
+               deltas = self.log_changes(conn, table, written, versions)
+       except Exception:
+           logger.exception("%d %s rows written but not recorded in the change log", len(written), table.name)
+           return
+       publish_deltas(deltas, versions)
+
+   @staticmethod
+   def bump_versions(conn, floors) -> Dict[str, int]:
+       """Bump each floor's version; returns the new versions."""
+       if not floors:
+           return {}
+       layouts = Layout.__table__
+       return dict(
+           conn.execute(
+               layouts.update()
+               .where(layouts.c.id.in_(floors))
+               .values(version=layouts.c.version + 1)
+               .returning(layouts.c.id, layouts.c.version)
+           ).all()
+       )
+
+   @staticmethod
+   def log_changes(conn, table, rows: List[dict], versions: Dict[str, int]) -> dict:
+       """Record written simulation events in the layouts' change log; returns their deltas."""
+       if table is not SimulationEvent.__table__ or not rows:
+           return {}
+       deltas = row_deltas("events", rows)
+       log_deltas(conn, deltas, versions)
+       return deltas
+
+   def close(self) -> None:
+       """Stop accepting rows, write everything pending and stop the worker."""
+       with self.cond:
+           if self.closed:
+               return
+           self.closed = True
+           self.cond.notify_all()
+       if self.worker is not None:
+           self.worker.join()
@@ -0,0 +1,231 @@
+"""
+Sensor/device interference.
+
+Server-side port of client/src/components/utils/computations/DetectInterferenceNodes.ts.
+A device interferes with a sensor when they are within range of each other,
+one of the sensor's protocols is in the device's interferenceProtocols (and in
+the device's connectivity, if it declares any), and the two are not already
+connected.
+
+`compute_interference` evaluates a whole floor with NumPy. `update_node_interference`
+is the incremental path used by the upsert routes: it only re-evaluates the pairs
+touching the node that changed, using the floor's spatial index to find them.
+
+compute_interference takes an optional propagation.PropagationModel, as
+compute_connectivity does: with it a pair must also stay in range once the
+walls between them are crossed, for one of the protocols it interferes on.
+update_node_interference uses the model stored on the node's floor.
+"""
+
+import uuid
+from datetime import datetime
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from connectivity import (
+   DEFAULT_DEVICE_RADIUS,
+   DEFAULT_SENSOR_RADIUS,
+   Vocabulary,
+   connection_changes,
+   encode_sets,
+   pad_words,
+   radii,
+   range_pairs,
+)
+from models import db, Device, Sensor, SimulationEvent
+from propagation import floor_model, floor_propagation
+from spatial_index import floor_indexes
+
+
+SENSOR_FIELDS = ("x", "y", "sensor_rad", "connectivity", "connectedDeviceIds")
+DEVICE_FIELDS = ("x", "y", "device_rad", "connectivity", "interferenceProtocols", "connectedSensorIds")
+
+
+def interferes(sensor, device, propagation=None) -> bool:
+   """Exact single-pair check, same rule as DetectInterferenceNodes (plus walls with `propagation`)."""
+   if sensor.floor != device.floor:
+       return False
+   sensor_rad = DEFAULT_SENSOR_RADIUS if sensor.sensor_rad is None else sensor.sensor_rad
+   device_rad = DEFAULT_DEVICE_RADIUS if device.device_rad is None else device.device_rad
+   dx = sensor.x - device.x
+   dy = sensor.y - device.y
+   limit = sensor_rad + device_rad
+   if dx * dx + dy * dy > limit * limit:
+       return False
+
+   device_connectivity = {c for c in (device.connectivity or []) if c and c.strip()}
+   interference_protocols = set(device.interferenceProtocols or [])
+   shared = [
+       p for p in (sensor.connectivity or [])
+       if p in interference_protocols and (not device_connectivity or p in device_connectivity)
+   ]
+   if not shared:
+       return False
+
+   already_connected = device.id in (sensor.connectedDeviceIds or []) or sensor.id in (device.connectedSensorIds or [])
+   if already_connected:
+       return False
+   return propagation is None or propagation.pair_in_range(sensor.x, sensor.y, device.x, device.y, limit, shared)
+
+
+def compute_interference(
+   sensors: Sequence, devices: Sequence, propagation=None
+) -> Tuple[Dict[str, List[str]], Dict[str, List[str]]]:
+   """Compute interferenceIds for every sensor and device on a floor, through walls with `propagation`."""
+   sensor_ids = [s.id for s in sensors]
+   device_ids = [d.id for d in devices]
+
+   protocols = Vocabulary()
+   s_proto = encode_sets([s.connectivity for s in sensors], protocols)
+   d_interfere = encode_sets([d.interferenceProtocols for d in devices], protocols)
+   d_proto = encode_sets([d.connectivity for d in devices], protocols)
+   words = protocols.words
+   s_proto = pad_words(s_proto, words)
+   d_interfere = pad_words(d_interfere, words)
+   d_proto = pad_words(d_proto, words)
+   # A device without declared connectivity accepts interference on any protocol.
+   d_proto[~d_proto.any(axis=1)] = np.uint64(0xFFFFFFFFFFFFFFFF)
+   d_effective = d_interfere & d_proto
+
+   # Pairs that are already connected never interfere; encode them as s * n_devices + d.
+   sensor_pos = {sid: i for i, sid in enumerate(sensor_ids)}
+   device_pos = {did: i for i, did in enumerate(device_ids)}
+   n_devices = max(1, len(device_ids))
+   connected = set()
+   for i, s in enumerate(sensors):
+       for did in s.connectedDeviceIds or []:
+           if did in device_pos:
+               connected.add(i * n_devices + device_pos[did])
+   for j, d in enumerate(devices):
+       for sid in d.connectedSensorIds or []:
+           if sid in sensor_pos:
+               connected.add(sensor_pos[sid] * n_devices + j)
+   connected_keys = np.fromiter(connected, dtype=np.int64, count=len(connected))
+
+   sx = np.array([s.x for s in sensors], dtype=np.float64)
+   sy = np.array([s.y for s in sensors], dtype=np.float64)
+   sr = radii((s.sensor_rad for s in sensors), DEFAULT_SENSOR_RADIUS)
+   dx = np.array([d.x for d in devices], dtype=np.float64)
+   dy = np.array([d.y for d in devices], dtype=np.float64)
+   dr = radii((d.device_rad for d in devices), DEFAULT_DEVICE_RADIUS)
+
+   def shared_and_unconnected(s_idx: np.ndarray, d_idx: np.ndarray) -> np.ndarray:
+       keep = ((s_proto[s_idx] & d_effective[d_idx]) != 0).any(axis=1)
+       if len(connected_keys):
+           keep &= ~np.isin(s_idx * n_devices + d_idx, connected_keys)
+       if propagation is None or not keep.any():
+           return keep
+       s_idx, d_idx = s_idx[keep], d_idx[keep]
+       keep[keep] = propagation.in_range(
+           sx[s_idx], sy[s_idx], dx[d_idx], dy[d_idx], sr[s_idx] + dr[d_idx],
+           s_proto[s_idx] & d_effective[d_idx], protocols.index,
+       )
+       return keep
+
+   s_hit, d_hit = range_pairs(sx, sy, sr, dx, dy, dr, pair_filter=shared_and_unconnected)
+
+   sensor_links: Dict[str, List[str]] = {sid: [] for sid in sensor_ids}
+   device_links: Dict[str, List[str]] = {did: [] for did in device_ids}
+   order = np.lexsort((d_hit, s_hit))
+   for s, d in zip(s_hit[order].tolist(), d_hit[order].tolist()):
+       sensor_links[sensor_ids[s]].append(device_ids[d])
+   order = np.lexsort((s_hit, d_hit))
+   for s, d in zip(s_hit[order].tolist(), d_hit[order].tolist()):
+       device_links[device_ids[d]].append(sensor_ids[s])
+   return sensor_links, device_links
+
+
+def interference_event(sensor, device_id: str, detected: bool, now: datetime) -> dict:
+   verb = "detected interference from" if detected else "no longer detects interference from"
+   return {
+       "id": str(uuid.uuid4()),
+       "floor": sensor.floor,
+       "node_id": sensor.id,
+       "node_type": "sensor",
+       "event_type": "interference",
+       "timestamp": now,
+       "message": f'Sensor "{sensor.name}" {verb} Device ID "{device_id}"',
+       "date_created": now,
+       "date_modified": now,
+   }
+
+
+def needs_recompute(node, data: dict, fields: Sequence[str]) -> bool:
+   """True when the posted payload changes a field the interference rule depends on."""
+   return any(field in data and data[field] != getattr(node, field) for field in fields)
+
+
+def update_node_interference(kind: str, node, previous: Sequence[str]) -> List[SimulationEvent]:
+   """
+   Re-evaluate every pair touching one sensor or device and patch interferenceIds on both sides.
+
+   `node` is a pending ORM object already carrying its new position, radius and
+   protocols; `previous` is its interferenceIds as last stored. Candidates come
+   from the floor's spatial index plus the previous partners, so the cost is
+   proportional to the node's neighbourhood. Pairs are judged with the
+   floor's stored propagation model, like the last whole-floor recompute.
+   Returns the SimulationEvent rows added to the session; the caller commits.
+   """
+   if kind == "sensor":
+       partner_model, partner_kind = Device, "device"
+       own_rad = DEFAULT_SENSOR_RADIUS if node.sensor_rad is None else node.sensor_rad
+       partner_default = DEFAULT_DEVICE_RADIUS
+   else:
+       partner_model, partner_kind = Sensor, "sensor"
+       own_rad = DEFAULT_DEVICE_RADIUS if node.device_rad is None else node.device_rad
+       partner_default = DEFAULT_SENSOR_RADIUS
+
+   reach = own_rad + max(floor_indexes.max_radius(node.floor, partner_kind), partner_default)
+   candidate_ids = {pid for _, pid, _, _ in floor_indexes.query(node.floor, node.x, node.y, reach, partner_kind)}
+   previous = list(previous or [])
+   candidate_ids.update(previous)
+   if not candidate_ids:
+       node.interferenceIds = []
+       return []
+
+   partners = partner_model.query.filter(partner_model.id.in_(candidate_ids)).all()
+   propagation = floor_propagation(node.floor, floor_model(node.floor))
+   current = []
+   for partner in partners:
+       sensor, device = (node, partner) if kind == "sensor" else (partner, node)
+       if interferes(sensor, device, propagation):
+           current.append(partner.id)
+
+   added, removed = connection_changes(previous, current)
+   # Keep existing order for survivors, append new partners at the end.
+   removed_set = set(removed)
+   node.interferenceIds = [pid for pid in previous if pid not in removed_set] + added
+
+   now = datetime.utcnow()
+   by_id = {p.id: p for p in partners}
+   events = []
+   for pid, detected in [(pid, True) for pid in added] + [(pid, False) for pid in removed]:
+       partner = by_id.get(pid)
+       if partner is None:
+           continue
+       ids = list(partner.interferenceIds or [])
+       if detected and node.id not in ids:
+           ids.append(node.id)
+       elif not detected:
+           ids = [i for i in ids if i != node.id]
+       partner.interferenceIds = ids
+       partner.date_modified = now
+
+       sensor, device_id = (node, pid) if kind == "sensor" else (partner, node.id)
+       event = SimulationEvent(**interference_event(sensor, device_id, detected, now))
+       db.session.add(event)
+       events.append(event)
+   return events
+
+
+def remove_node_interference(kind: str, node) -> None:
+   """Drop a deleted node's id from its partners' interferenceIds."""
+   partner_model = Device if kind == "sensor" else Sensor
+   partner_ids = list(node.interferenceIds or [])
+   if not partner_ids:
+       return
+   now = datetime.utcnow()
+   for partner in partner_model.query.filter(partner_model.id.in_(partner_ids)).all():
+       partner.interferenceIds = [i for i in (partner.interferenceIds or []) if i != node.id]
+       partner.date_modified = now
@@ -0,0 +1,288 @@
+"""
+Database-backed background jobs for long-running computations.
+
+Routes enqueue a row in the `job` table and answer immediately; worker threads
+claim queued jobs with a conditional UPDATE (so several processes can share
+the table safely), run the registered handler inside an app context and
+store its JSON result. At most `per_session` jobs of one session run at once;
+the limit is part of the claiming UPDATE, and claims for one session are
+serialised (a lock in-process, an advisory lock on PostgreSQL) so two workers
+cannot both see a free slot. Handlers report progress through a callback,
+which is also where a requested cancellation takes effect.
+
+Running jobs hold a lease renewed every JOB_HEARTBEAT_INTERVAL seconds. A
+job whose lease is older than JOB_LEASE_SECONDS (its worker crashed or the
+process was restarted) is marked failed, freeing its session's slot.
+
+In-process workers start with the first enqueue. Set JOB_WORKERS=0 to leave
+the work to a separate process instead:
+    python jobs.py
+"""
+
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional, Tuple
+
+from sqlalchemy import func, select, update
+
+from models import db, Job
+
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+JOB_MAX_PER_SESSION = int(os.environ.get("JOB_MAX_PER_SESSION", "1"))
+JOB_POLL_INTERVAL = 1.0  # seconds between queue checks when idle
+JOB_PROGRESS_INTERVAL = 0.5  # seconds between progress writes / cancel checks
+JOB_HEARTBEAT_INTERVAL = float(os.environ.get("JOB_HEARTBEAT_INTERVAL", "10"))
+JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", "60"))
+
+FINISHED = ("done", "failed", "cancelled")
+
+# parse(layout_id, data) -> params, run(layout_id, params, progress) -> result
+Handler = Tuple[Callable[[Optional[str], dict], dict], Callable[..., dict]]
+
+
+class JobCancelled(Exception):
+   """Raised from the progress callback once a cancel has been requested."""
+
+
+class JobRunner:
+   """Claims queued jobs from the database and runs them on worker threads."""
+
+   def __init__(
+       self,
+       app,
+       workers: int = JOB_WORKERS,
+       per_session: int = JOB_MAX_PER_SESSION,
+       poll_interval: float = JOB_POLL_INTERVAL,
+   ) -> None:
+       self.app = app
+       self.workers = workers
+       self.per_session = per_session
+       self.poll_interval = poll_interval
+       self.handlers: Dict[str, Handler] = {}
+       self.threads = []
+       self.cond = threading.Condition()
+       self.closed = False
+       self.claim_lock = threading.Lock()
+       self.active = set()  # ids of the jobs this process is running, kept leased
+
+   def handler(self, kind: str, parse: Callable[[Optional[str], dict], dict]):
+       """Register `run(layout_id, params, progress)` for jobs of `kind`."""
+
+       def register(run: Callable[..., dict]) -> Callable[..., dict]:
+           self.handlers[kind] = (parse, run)
+           return run
+
+       return register
+
+   def enqueue(self, kind: str, layout_id: Optional[str], session_id: Optional[str], data: dict) -> Job:
+       """Validate `data` with the kind's parser and queue a job; ValueError on bad input."""
+       if kind not in self.handlers:
+           raise ValueError(f"Unknown job kind {kind!r}")
+       parse, _ = self.handlers[kind]
+       params = parse(layout_id, data)
+       job = Job(kind=kind, layout_id=layout_id, owner_session_id=session_id, params=params)
+       db.session.add(job)
+       db.session.commit()
+       if self.workers > 0:
+           self.start()
+           with self.cond:
+               self.cond.notify()
+       return job
+
+   def cancel(self, job_id: str) -> Optional[Job]:
+       """Cancel a queued job at once; a running one stops at its next progress report."""
+       now = datetime.utcnow()
+       db.session.execute(
+           update(Job)
+           .where(Job.id == job_id, Job.status == "queued")
+           .values(status="cancelled", cancel_requested=True, finished_at=now)
+       )
+       db.session.execute(update(Job).where(Job.id == job_id, Job.status == "running").values(cancel_requested=True))
+       db.session.commit()
+       return db.session.get(Job, job_id, populate_existing=True)
+
+   def start(self) -> None:
+       with self.cond:
+           if self.threads or self.closed:
+               return
+           for i in range(max(1, self.workers)):
+               thread = threading.Thread(target=self.run, name=f"job-worker-{i}", daemon=True)
+               thread.start()
+               self.threads.append(thread)
+           thread = threading.Thread(target=self.heartbeat, name="job-heartbeat", daemon=True)
+           thread.start()
+           self.threads.append(thread)
+
+   def heartbeat(self) -> None:
+       """Renew the lease of every job this process is running."""
+       while True:
+           with self.cond:
+               self.cond.wait(JOB_HEARTBEAT_INTERVAL)
+               if self.closed:
+                   return
+               active = list(self.active)
+           if not active:
+               continue
+           try:
+               with self.app.app_context():
+                   db.session.execute(
+                       update(Job)
+                       .where(Job.id.in_(active), Job.status == "running")
+                       .values(heartbeat_at=datetime.utcnow())
+                   )
+                   db.session.commit()
+           except Exception:
+               logger.exception("Job heartbeat failed")
+
+   def expire_stale(self) -> int:
+       """Fail running jobs whose lease ran out; returns how many."""
+       now = datetime.utcnow()
+       cutoff = now - timedelta(seconds=JOB_LEASE_SECONDS)
+       with self.cond:
+           active = list(self.active)
+       statement = (
+           update(Job)
+           .where(
+               Job.status == "running",
+               func.coalesce(Job.heartbeat_at, Job.started_at) < cutoff,
+           )
+           .values(status="failed", error="Worker stopped before the job finished", finished_at=now)
+       )
+       if active:
+           statement = statement.where(Job.id.not_in(active))
+       expired = db.session.execute(statement).rowcount
+       db.session.commit()
+       if expired:
+           logger.warning("Failed %d job(s) whose worker stopped", expired)
+       return expired
+
+   def run(self) -> None:
+       while not self.closed:
+           try:
+               with self.app.app_context():
+                   job_id = self.claim()
+                   if job_id is not None:
+                       try:
+                           self.execute(job_id)
+                       finally:
+                           with self.cond:
+                               self.active.discard(job_id)
+                       continue
+           except Exception:
+               logger.exception("Job worker iteration failed")
+           with self.cond:
+               self.cond.wait(self.poll_interval)
+
+   def claim(self) -> Optional[str]:
+       """Atomically move one eligible queued job to running; returns its id."""
+       self.expire_stale()
+       running = dict(
+           db.session.execute(
+               select(Job.owner_session_id, func.count())
+               .where(Job.status == "running")
+               .group_by(Job.owner_session_id)
+           ).all()
+       )
+       candidates = db.session.execute(
+           select(Job.id, Job.owner_session_id)
+           .where(Job.status == "queued", Job.kind.in_(list(self.handlers)))
+           .order_by(Job.created_at)
+           .limit(50)
+       ).all()
+       db.session.rollback()
+       for job_id, session_id in candidates:
+           # The counts above only skip sessions that are plainly full; the UPDATE decides.
+           if session_id is not None and running.get(session_id, 0) >= self.per_session:
+               continue
+           if self.claim_job(job_id, session_id):
+               return job_id
+       return None
+
+   def claim_job(self, job_id: str, session_id: Optional[str]) -> bool:
+       """UPDATE one queued job to running if its session still has a free slot."""
+       now = datetime.utcnow()
+       statement = update(Job).where(Job.id == job_id, Job.status == "queued")
+       if session_id is not None:
+           others = Job.__table__.alias("other")
+           running = (
+               select(func.count())
+               .select_from(others)
+               .where(others.c.owner_session_id == session_id, others.c.status == "running")
+               .scalar_subquery()
+           )
+           statement = statement.where(running < self.per_session)
+       with self.claim_lock:
+           if session_id is not None and db.session.get_bind().dialect.name == "postgresql":
+               # Other processes' claims for this session wait here until we commit.
+               db.session.execute(select(func.pg_advisory_xact_lock(func.hashtext(session_id))))
+           claimed = db.session.execute(
+               statement.values(status="running", started_at=now, heartbeat_at=now)
+           ).rowcount
+           db.session.commit()
+       if claimed:
+           with self.cond:
+               self.active.add(job_id)
+       return bool(claimed)
+
+   def execute(self, job_id: str) -> None:
+       job = db.session.get(Job, job_id)
+       _, run = self.handlers[job.kind]
+       layout_id, params = job.layout_id, dict(job.params or {})
+       db.session.rollback()  # no transaction held open while the handler runs
+
+       last = [0.0]
+
+       def progress(value: float) -> None:
+           now = time.monotonic()
+           if now - last[0] < JOB_PROGRESS_INTERVAL and value < 1:
+               return
+           last[0] = now
+           db.session.execute(
+               update(Job).where(Job.id == job_id).values(progress=round(min(max(value, 0.0), 1.0), 4))
+           )
+           db.session.commit()
+           if db.session.execute(select(Job.cancel_requested).where(Job.id == job_id)).scalar():
+               raise JobCancelled()
+
+       values = {"finished_at": None}
+       try:
+           result = run(layout_id, params, progress)
+           values.update(status="done", progress=1.0, result=result)
+       except JobCancelled:
+           values.update(status="cancelled")
+       except Exception as e:
+           logger.exception("Job %s failed", job_id)
+           values.update(status="failed", error=str(e))
+       db.session.rollback()
+       values["finished_at"] = datetime.utcnow()
+       db.session.execute(update(Job).where(Job.id == job_id).values(**values))
+       db.session.commit()
+
+   def serve_forever(self) -> None:
+       """Run workers in this process until interrupted (the separate worker process mode)."""
+       self.workers = max(1, self.workers)
+       self.start()
+       try:
+           while True:
+               time.sleep(self.poll_interval)
+       except KeyboardInterrupt:
+           self.close()
+
+   def close(self) -> None:
+       with self.cond:
+           self.closed = True
+           self.cond.notify_all()
+
+
+if __name__ == "__main__":
+   from app import app as flask_app, create_tables, job_runner
+
+   with flask_app.app_context():
+       create_tables()
+   job_runner.serve_forever()
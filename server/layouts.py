@@ -0,0 +1,121 @@
+"""
+Set-based deletion and cloning of whole floors.
+
+Both run a fixed handful of statements in the caller's transaction, whatever
+the floor's size: DELETE ... WHERE floor = ? per child table, and
+INSERT ... SELECT per child table for a clone. No child row is loaded into
+the session, so the ORM cascades declared on Layout never fire.
+
+Cloned rows get ids derived in SQL from the originals: `<tag>-<old id>`, where
+the tag is the hex part of the new layout id. References between cloned rows
+(connected*/interferenceIds lists, event and rollup node ids) are rewritten with the same
+prefix, so the clone's graph is self-contained.
+"""
+
+import uuid
+from datetime import datetime
+from typing import Dict, Optional
+
+from sqlalchemy import JSON, String, cast, delete, insert, literal, select, type_coerce, update
+
+from models import db, Device, EventRollup, Job, Layout, LayoutChange, Log, Person, Room, Sensor, SimulationEvent
+
+
+# JSON columns holding ids of other nodes on the same floor.
+ID_LIST_COLUMNS = {
+   "device": ("connectedSensorIds", "interferenceIds"),
+   "sensor": ("connectedDeviceIds", "interferenceIds"),
+}
+
+
+def delete_layout_rows(layout_id: str) -> Dict[str, int]:
+   """Delete a floor and everything on it; returns rows deleted per table. The caller commits."""
+   session = db.session
+   devices = select(Device.id).where(Device.floor == layout_id).scalar_subquery()
+   sensors = select(Sensor.id).where(Sensor.floor == layout_id).scalar_subquery()
+   # Logs outlive the floor (ondelete SET NULL); done explicitly for SQLite, which does not enforce FKs here.
+   session.execute(update(Log).where(Log.device_id.in_(devices)).values(device_id=None))
+   session.execute(update(Log).where(Log.sensor_id.in_(sensors)).values(sensor_id=None))
+   session.execute(update(Log).where(Log.floor_id == layout_id).values(floor_id=None))
+
+   counts = {}
+   for name, statement in (
+       ("events", delete(SimulationEvent).where(SimulationEvent.floor == layout_id)),
+       ("event_rollups", delete(EventRollup).where(EventRollup.floor == layout_id)),
+       ("persons", delete(Person).where(Person.floor == layout_id)),
+       ("sensors", delete(Sensor).where(Sensor.floor == layout_id)),
+       ("devices", delete(Device).where(Device.floor == layout_id)),
+       ("rooms", delete(Room).where(Room.layout_id == layout_id)),
+       ("changes", delete(LayoutChange).where(LayoutChange.layout_id == layout_id)),
+       ("jobs", delete(Job).where(Job.layout_id == layout_id)),
+       ("layouts", delete(Layout).where(Layout.id == layout_id)),
+   ):
+       counts[name] = session.execute(statement.execution_options(synchronize_session=False)).rowcount
+   return counts
+
+
+def prefixed_ids(column, prefix: str):
+   """A JSON list of ids with every id prefixed, by rewriting the stored text."""
+   sqlite = db.session.get_bind().dialect.name == "sqlite"
+   text = type_coerce(column, String) if sqlite else cast(column, String)
+   # An id starts after "[" or a separator; both compact and spaced separators are handled.
+   for opening in ('["', '","', '", "'):
+       text = db.func.replace(text, opening, opening + prefix)
+   # SQLite keeps JSON as text; CAST(... AS JSON) there would apply numeric affinity.
+   return type_coerce(text, JSON) if sqlite else cast(text, JSON)
+
+
+def copy_rows(model, floor_column: str, source_id: str, target_id: str, prefix: str, now: datetime) -> int:
+   """INSERT INTO <table> SELECT ... FROM <table> WHERE <floor> = source, with new ids and floor."""
+   table = model.__table__
+   overrides = {floor_column: literal(target_id)}
+   if table.c.id.autoincrement is not True:
+       overrides["id"] = literal(prefix) + table.c.id
+   for name in ("date_created", "date_modified"):
+       if name in table.c:
+           overrides[name] = literal(now, table.c[name].type)
+   for name in ID_LIST_COLUMNS.get(table.name, ()):
+       overrides[name] = prefixed_ids(table.c[name], prefix)
+   if "node_id" in table.c:
+       overrides["node_id"] = literal(prefix) + table.c.node_id
+   # Integer ids are left to the database.
+   copied = [c for c in table.c if c.name in overrides or c.name != "id"]
+   columns = [overrides[c.name].label(c.name) if c.name in overrides else c for c in copied]
+   query = select(*columns).where(table.c[floor_column] == source_id)
+   return db.session.execute(insert(table).from_select([c.name for c in copied], query)).rowcount
+
+
+def clone_layout_rows(
+   source_id: str,
+   name: str,
+   owner_session_id: Optional[str],
+   events: bool = True,
+   event_retention_seconds: Optional[int] = None,
+) -> Dict[str, object]:
+   """Copy a floor with INSERT ... SELECT per table; returns the new id and rows copied. The caller commits."""
+   tag = uuid.uuid4().hex[:8]
+   target_id = f"layout-{tag}"
+   prefix = f"{tag}-"
+   now = datetime.utcnow()
+   source = db.session.execute(
+       select(Layout.motion_active, Layout.propagation_model).where(Layout.id == source_id)
+   ).first()
+   active = source.motion_active if source else None
+   # The clone starts at version 1 with an empty change log, so ?since=0 asks for a snapshot (410).
+   db.session.execute(
+       insert(Layout).values(
+           id=target_id, name=name, owner_session_id=owner_session_id, version=1, change_log_start=1,
+           event_retention_seconds=event_retention_seconds,
+           motion_active=[[prefix + person, prefix + sensor] for person, sensor in active] if active else None,
+           propagation_model=source.propagation_model if source else None,
+       )
+   )
+   copied = {
+       "rooms": copy_rows(Room, "layout_id", source_id, target_id, prefix, now),
+       "devices": copy_rows(Device, "floor", source_id, target_id, prefix, now),
+       "sensors": copy_rows(Sensor, "floor", source_id, target_id, prefix, now),
+       "persons": copy_rows(Person, "floor", source_id, target_id, prefix, now),
+       "events": copy_rows(SimulationEvent, "floor", source_id, target_id, prefix, now) if events else 0,
+       "event_rollups": copy_rows(EventRollup, "floor", source_id, target_id, prefix, now) if events else 0,
+   }
+   return {"layout_id": target_id, "version": 1, "copied": copied}
@@ -0,0 +1,266 @@
+"""
+Request and database instrumentation, exposed in the Prometheus text format.
+
+install(app) hooks every request: latency, request and response sizes and
+the number and duration of SQL statements it ran (counted with engine
+events), labelled by route template. Streamed responses are measured when
+they close, so their latency covers the whole body. Statements run outside a
+request (ingest writer, jobs, retention) are counted under route="-".
+Errors the routes turn into {"error": ...} responses are counted with
+record_error(). GET /metrics renders everything with render().
+
+With METRICS_PROFILE=1 in the environment, `?profile=1` on any request
+answers with a text profile of that request instead of its body:
+pyinstrument's call tree when installed, the top of cProfile's cumulative
+listing otherwise. It is off by default, as it lets any client run a request
+under the profiler; turn it on while debugging, never in production.
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+try:
+   import pyinstrument
+except ImportError:  # optional, nicer profiles
+   pyinstrument = None
+
+
+METRICS_PROFILE = os.environ.get("METRICS_PROFILE", "0") == "1"
+PROFILE_TOP = 40  # cProfile rows in a profile report
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500, 1000)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def label_text(labels: Labels, extra: str = "") -> str:
+   parts = [f'{name}="{escape(value)}"' for name, value in labels]
+   if extra:
+       parts.append(extra)
+   return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def escape(value: str) -> str:
+   return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def number(value: float) -> str:
+   if value == float("inf"):
+       return "+Inf"
+   return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+   def __init__(self, name: str, help: str) -> None:
+       self.name, self.help = name, help
+       self.values: Dict[Labels, float] = {}
+
+   def inc(self, labels: Labels, amount: float = 1) -> None:
+       self.values[labels] = self.values.get(labels, 0) + amount
+
+   def render(self) -> List[str]:
+       lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+       lines += [f"{self.name}{label_text(labels)} {number(v)}" for labels, v in sorted(self.values.items())]
+       return lines
+
+
+class Histogram:
+   """Cumulative-bucket histogram per label set."""
+
+   def __init__(self, name: str, help: str, buckets: Sequence[float]) -> None:
+       self.name, self.help = name, help
+       self.buckets = tuple(buckets) + (float("inf"),)
+       self.values: Dict[Labels, list] = {}  # labels -> [bucket counts..., sum, count]
+
+   def observe(self, labels: Labels, value: float) -> None:
+       entry = self.values.get(labels)
+       if entry is None:
+           entry = self.values[labels] = [0] * len(self.buckets) + [0.0, 0]
+       for i, bound in enumerate(self.buckets):
+           if value <= bound:
+               entry[i] += 1
+       entry[-2] += value
+       entry[-1] += 1
+
+   def render(self) -> List[str]:
+       lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+       for labels, entry in sorted(self.values.items()):
+           for bound, count in zip(self.buckets, entry):
+               le = 'le="%s"' % number(bound)
+               lines.append(f"{self.name}_bucket{label_text(labels, le)} {count}")
+           lines.append(f"{self.name}_sum{label_text(labels)} {number(entry[-2])}")
+           lines.append(f"{self.name}_count{label_text(labels)} {entry[-1]}")
+       return lines
+
+
+class Registry:
+   def __init__(self) -> None:
+       self.lock = threading.Lock()
+       self.metrics: list = []
+       self.gauges: List[Tuple[str, str, Callable[[], float]]] = []
+
+   def add(self, metric):
+       self.metrics.append(metric)
+       return metric
+
+   def gauge(self, name: str, help: str, read: Callable[[], float]) -> None:
+       """A value read when rendering (queue depths and the like)."""
+       self.gauges.append((name, help, read))
+
+   def render(self) -> str:
+       with self.lock:
+           lines = [line for metric in self.metrics for line in metric.render()]
+       for name, help, read in self.gauges:
+           lines += [f"# HELP {name} {help}", f"# TYPE {name} gauge", f"{name} {number(read())}"]
+       return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+REQUEST_SECONDS = registry.add(Histogram(
+   "http_request_duration_seconds", "Request latency, until the body is fully sent.", LATENCY_BUCKETS,
+))
+REQUEST_BYTES = registry.add(Histogram("http_request_size_bytes", "Request body size.", SIZE_BUCKETS))
+RESPONSE_BYTES = registry.add(Histogram("http_response_size_bytes", "Response body size.", SIZE_BUCKETS))
+REQUEST_STATEMENTS = registry.add(Histogram(
+   "http_request_db_statements", "SQL statements executed per request.", STATEMENT_BUCKETS,
+))
+REQUEST_DB_SECONDS = registry.add(Histogram(
+   "http_request_db_duration_seconds", "Time spent in SQL statements per request.", LATENCY_BUCKETS,
+))
+STATEMENTS = registry.add(Counter("db_statements_total", "SQL statements executed, by route (\"-\" outside requests)."))
+STATEMENT_SECONDS = registry.add(Counter("db_statement_seconds_total", "Time spent in SQL statements, by route."))
+ERRORS = registry.add(Counter("http_handled_errors_total", "Exceptions turned into error responses, by route and type."))
+
+
+def route_label() -> str:
+   rule = request.url_rule
+   return rule.rule if rule is not None else "unmatched"
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def start_statement(conn, cursor, statement, parameters, context, executemany) -> None:
+   conn.info.setdefault("statement_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def end_statement(conn, cursor, statement, parameters, context, executemany) -> None:
+   started = conn.info.get("statement_started")
+   if not started:
+       return
+   elapsed = time.perf_counter() - started.pop()
+   if has_request_context() and "metrics_statements" in g:
+       g.metrics_statements += 1
+       g.metrics_db_seconds += elapsed
+       route = g.metrics_route
+   else:
+       route = "-"
+   with registry.lock:
+       STATEMENTS.inc((("route", route),))
+       STATEMENT_SECONDS.inc((("route", route),), elapsed)
+
+
+def record_error(error: Exception) -> None:
+   route = route_label() if has_request_context() else "-"
+   with registry.lock:
+       ERRORS.inc((("route", route), ("exception", type(error).__name__)))
+
+
+def start_request() -> None:
+   g.metrics_started = time.perf_counter()
+   g.metrics_route = route_label()
+   g.metrics_statements = 0
+   g.metrics_db_seconds = 0.0
+   if METRICS_PROFILE and request.args.get("profile") == "1":
+       if pyinstrument is not None:
+           g.metrics_profiler = pyinstrument.Profiler()
+           g.metrics_profiler.start()
+       else:
+           g.metrics_profiler = cProfile.Profile()
+           g.metrics_profiler.enable()
+
+
+def observe(
+   route: str, method: str, status: int, seconds: float,
+   request_size: int, response_size: int, statements: int, db_seconds: float,
+) -> None:
+   with registry.lock:
+       REQUEST_SECONDS.observe((("method", method), ("route", route), ("status", str(status))), seconds)
+       REQUEST_BYTES.observe((("route", route),), request_size)
+       RESPONSE_BYTES.observe((("route", route),), response_size)
+       REQUEST_STATEMENTS.observe((("route", route),), statements)
+       REQUEST_DB_SECONDS.observe((("route", route),), db_seconds)
+
+
+def profile_report(profiler, response) -> str:
+   body = b"" if response.mimetype == "text/event-stream" else response.get_data()  # runs a streamed body
+   if pyinstrument is not None:
+       profiler.stop()
+       tree = profiler.output_text(unicode=True, color=False)
+   else:
+       profiler.disable()
+       out = io.StringIO()
+       pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(PROFILE_TOP)
+       tree = out.getvalue()
+   elapsed = time.perf_counter() - g.metrics_started
+   return (
+       f"{request.method} {request.full_path.rstrip('?')}\n"
+       f"route: {g.metrics_route}\n"
+       f"status: {response.status_code}\n"
+       f"duration_ms: {elapsed * 1000:.2f}\n"
+       f"db_statements: {g.metrics_statements}\n"
+       f"db_ms: {g.metrics_db_seconds * 1000:.2f}\n"
+       f"response_bytes: {len(body)}\n\n"
+       f"{tree}"
+   )
+
+
+def finish_request(response):
+   if "metrics_started" not in g:
+       return response
+   profiler = g.pop("metrics_profiler", None)
+   if profiler is not None:
+       status = response.status_code
+       response = response.__class__(profile_report(profiler, response), mimetype="text/plain")
+       response.headers["X-Profiled-Status"] = str(status)
+       return response
+
+   route, method, status = g.metrics_route, request.method, response.status_code
+   request_size = request.content_length or 0
+   if not response.is_streamed:
+       observe(route, method, status, time.perf_counter() - g.metrics_started, request_size,
+               response.calculate_content_length() or 0, g.metrics_statements, g.metrics_db_seconds)
+       return response
+
+   # Streamed bodies are generated after this hook; count them as they go out.
+   started, sent = g.metrics_started, [0]
+   state = g._get_current_object()
+   chunks = response.response
+
+   def counted():
+       for chunk in chunks:
+           sent[0] += len(chunk)
+           yield chunk
+
+   def closed() -> None:
+       observe(route, method, status, time.perf_counter() - started, request_size, sent[0],
+               state.metrics_statements, state.metrics_db_seconds)
+
+   response.response = counted()
+   response.call_on_close(closed)
+   return response
+
+
+def install(app) -> None:
+   app.before_request(start_request)
+   app.after_request(finish_request)
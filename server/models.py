@@ -3,9 +3,12 @@ from datetime import datetime
 import uuid
 from flask_sqlalchemy import SQLAlchemy
 
+from dbconfig import RoutingSession
+
 
  
-db = SQLAlchemy()
+# RoutingSession sends GET reads to the read replica when DATABASE_READ_URL is set.
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 
 
@@ -44,6 +47,10 @@ class Layout(db.Model):
     
 
    __tablename__ = "layout"
+   __table_args__ = (
+       # Keyset pagination of a session's layouts: WHERE owner_session_id = ? AND id > ? ORDER BY id
+       db.Index("ix_layout_owner_session_id_id", "owner_session_id", "id"),
+   )
 
 
    id = db.Column(db.String, primary_key=True, default=lambda: f"layout-{uuid.uuid4().hex[:8]}")
@@ -56,6 +63,16 @@ class Layout(db.Model):
        db.ForeignKey("session.id", ondelete="CASCADE"),
        nullable=False,
    )
+   # Bumped on every write to the floor's devices, sensors, persons or events.
+   version = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+   # Every change after this version is recorded in layout_change (see changes.py).
+   change_log_start = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+   # Seconds raw simulation events are kept before being rolled up; NULL = EVENT_RETENTION_SECONDS.
+   event_retention_seconds = db.Column(db.Integer, nullable=True)
+   # [person_id, sensor_id] pairs in range when POST /simulate last stopped (their START has no END yet).
+   motion_active = db.Column(db.JSON, nullable=True)
+   # "walls" once a recompute chose the wall model (propagation.py); NULL = plain radius check.
+   propagation_model = db.Column(db.String, nullable=True)
 
  
    rooms = db.relationship(
@@ -130,6 +147,18 @@ class Room(db.Model):
    date_modified = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 
+   def to_dict(self) -> dict:
+       
+       return {
+           "id": self.id,
+           "name": self.name,
+           "x": self.x,
+           "y": self.y,
+           "width": self.width,
+           "height": self.height,
+       }
+
+
 
 
 class Device(db.Model):
@@ -164,6 +193,27 @@ class Device(db.Model):
    logs = db.relationship("Log", backref="device", lazy=True)
 
 
+   def to_dict(self) -> dict:
+       
+       return {
+           "id": self.id,
+           "x": self.x,
+           "y": self.y,
+           "type": self.type,
+           "label": self.label,
+           "name": self.name,
+           "device_rad": self.device_rad,
+           "connectivity": self.connectivity,
+           "compatibleSensors": self.compatibleSensors,
+           "interferenceProtocols": self.interferenceProtocols,
+           "connectedSensorIds": self.connectedSensorIds,
+           "interferenceIds": self.interferenceIds,
+           "floor": self.floor,
+           "date_created": self.date_created.isoformat() if self.date_created else None,
+           "date_modified": self.date_modified.isoformat() if self.date_modified else None,
+       }
+
+
 
 
 class Sensor(db.Model):
@@ -194,6 +244,24 @@ class Sensor(db.Model):
    date_modified = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 
+   def to_dict(self) -> dict:
+       
+       return {
+           "id": self.id,
+           "type": self.type,
+           "name": self.name,
+           "x": self.x,
+           "y": self.y,
+           "sensor_rad": self.sensor_rad,
+           "connectivity": self.connectivity,
+           "connectedDeviceIds": self.connectedDeviceIds,
+           "interferenceIds": self.interferenceIds,
+           "floor": self.floor,
+           "date_created": self.date_created.isoformat() if self.date_created else None,
+           "date_modified": self.date_modified.isoformat() if self.date_modified else None,
+       }
+
+
    def __repr__(self) -> str:
        return f"<Sensor {self.id} on floor {self.floor}>"
 
@@ -256,6 +324,12 @@ class Person(db.Model):
 class SimulationEvent(db.Model):
    
    __tablename__ = "simulation_event"
+   __table_args__ = (
+       # Time-ordered keyset scans per floor, optionally narrowed by type or node.
+       db.Index("ix_simulation_event_floor_timestamp_id", "floor", "timestamp", "id"),
+       db.Index("ix_simulation_event_floor_event_type_timestamp", "floor", "event_type", "timestamp"),
+       db.Index("ix_simulation_event_floor_node_id_timestamp", "floor", "node_id", "timestamp"),
+   )
 
 
    id = db.Column(db.String, primary_key=True, default=lambda: str(uuid.uuid4()))
@@ -301,10 +375,133 @@ class SimulationEvent(db.Model):
 
 
 
+class Job(db.Model):
+   
+
+   __tablename__ = "job"
+   __table_args__ = (
+       # The runner claims the oldest queued job: WHERE status = 'queued' ORDER BY created_at
+       db.Index("ix_job_status_created_at", "status", "created_at"),
+       db.Index("ix_job_owner_session_id_status", "owner_session_id", "status"),
+   )
+
+
+   id = db.Column(db.String, primary_key=True, default=lambda: f"job-{uuid.uuid4().hex}")
+   # Handler name registered with the JobRunner, e.g. "optimize".
+   kind = db.Column(db.String, nullable=False)
+   layout_id = db.Column(db.String, db.ForeignKey("layout.id", ondelete="CASCADE"), nullable=True)
+   owner_session_id = db.Column(db.String, db.ForeignKey("session.id", ondelete="CASCADE"), nullable=True)
+   # queued -> running -> done | failed | cancelled
+   status = db.Column(db.String, nullable=False, default="queued")
+   progress = db.Column(db.Float, nullable=False, default=0.0)
+   params = db.Column(db.JSON, nullable=False, default=dict)
+   result = db.Column(db.JSON, nullable=True)
+   error = db.Column(db.String, nullable=True)
+   cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+   created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+   started_at = db.Column(db.DateTime, nullable=True)
+   # Renewed while a worker runs the job; a stale lease means the worker died.
+   heartbeat_at = db.Column(db.DateTime, nullable=True)
+   finished_at = db.Column(db.DateTime, nullable=True)
+
+
+   def to_dict(self) -> dict:
+       
+       return {
+           "id": self.id,
+           "kind": self.kind,
+           "layoutId": self.layout_id,
+           "sessionId": self.owner_session_id,
+           "status": self.status,
+           "progress": self.progress,
+           "params": self.params,
+           "result": self.result,
+           "error": self.error,
+           "cancelRequested": self.cancel_requested,
+           "created_at": self.created_at.isoformat() if self.created_at else None,
+           "started_at": self.started_at.isoformat() if self.started_at else None,
+           "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+       }
+
+
+   def __repr__(self) -> str:
+       return f"<Job {self.id} kind={self.kind} status={self.status}>"
+
+
+
+
+class LayoutChange(db.Model):
+   """One node written (or deleted) at one layout version; the row itself is read from its table."""
+
+   __tablename__ = "layout_change"
+   __table_args__ = (
+       # Delta sync: WHERE layout_id = ? AND version > ? ORDER BY version
+       db.Index("ix_layout_change_layout_id_version", "layout_id", "version"),
+   )
+
+
+   id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+   layout_id = db.Column(db.String, db.ForeignKey("layout.id", ondelete="CASCADE"), nullable=False)
+   version = db.Column(db.Integer, nullable=False)
+   # devices | sensors | persons | events
+   collection = db.Column(db.String, nullable=False)
+   node_id = db.Column(db.String, nullable=False)
+   # Tombstone: the node was deleted from (or moved off) the floor at this version.
+   deleted = db.Column(db.Boolean, nullable=False, default=False)
+
+
+   def __repr__(self) -> str:
+       op = "delete" if self.deleted else "upsert"
+       return f"<LayoutChange {self.layout_id}@{self.version} {op} {self.collection}/{self.node_id}>"
+
+
+
+
+class EventRollup(db.Model):
+   """Count of compacted simulation events of one node and type within one minute or hour (see retention.py)."""
+
+   __tablename__ = "event_rollup"
+   __table_args__ = (
+       # Range reads: WHERE floor = ? AND resolution = ? AND bucket >= ? AND bucket < ?
+       db.Index(
+           "ix_event_rollup_floor_resolution_bucket",
+           "floor", "resolution", "bucket", "node_id", "event_type",
+           unique=True,
+       ),
+   )
+
+
+   id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+   floor = db.Column(db.String, db.ForeignKey("layout.id", ondelete="CASCADE"), nullable=False)
+   # Bucket width in seconds: 60 or 3600.
+   resolution = db.Column(db.Integer, nullable=False)
+   bucket = db.Column(db.DateTime, nullable=False)
+   node_id = db.Column(db.String, nullable=False)
+   node_type = db.Column(db.String, nullable=False)
+   event_type = db.Column(db.String, nullable=False)
+   count = db.Column(db.Integer, nullable=False, default=0)
+   # Motion STARTs among them, so trigger statistics survive compaction (stats.py).
+   triggers = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+   first_timestamp = db.Column(db.DateTime, nullable=False)
+   last_timestamp = db.Column(db.DateTime, nullable=False)
+
+
+   def __repr__(self) -> str:
+       return f"<EventRollup {self.floor} {self.node_id} {self.event_type} {self.bucket}/{self.resolution}s x{self.count}>"
+
+
+
+
 class Log(db.Model):
    
 
    __tablename__ = "log"
+   __table_args__ = (
+       # Retention pruning: WHERE timestamp < ? ORDER BY timestamp
+       db.Index("ix_log_timestamp", "timestamp"),
+       # Per-floor stats: WHERE floor_id = ? GROUP BY room / effect, MAX(id)
+       db.Index("ix_log_floor_id_id", "floor_id", "id"),
+   )
 
 
    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
@@ -0,0 +1,240 @@
+"""
+Sensor placement optimisation (coverage vs. overlap vs. cost).
+
+Rooms are rasterised once into the centres of the grid cells that fall inside
+any room. A placement is scored by counting, per cell, how many sensor discs
+cover it (spatial_index.disc_hits), giving the covered and multiply-covered
+share of room area. A genetic algorithm searches fixed-size placements: every
+gene is one sensor slot (x, y, catalogue entry, on/off), repaired after each
+generation so the total cost stays within the budget. Populations are scored
+in a spawn-based process pool attached to the shared cell arrays.
+"""
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from scenarios import SharedArrays, attach_views
+from spatial_index import disc_hits
+
+
+DEFAULT_CATALOGUE = [{"type": "motion", "radius": 150.0, "cost": 1.0}]
+DEFAULT_RESOLUTION = 10.0  # grid cell size in canvas pixels
+MAX_CELLS = 2_000_000
+MAX_SLOTS = 512
+
+OVERLAP_WEIGHT = 0.5
+COST_WEIGHT = 0.1
+
+# Columns of a placement matrix (one row per sensor slot).
+X, Y, KIND, ON = range(4)
+
+
+def room_cells(rects: np.ndarray, resolution: float) -> Dict[str, np.ndarray]:
+   """Centres of the grid cells inside at least one room rectangle."""
+   if not len(rects):
+       raise ValueError("Layout has no rooms")
+   x0, y0 = rects[:, 0].min(), rects[:, 1].min()
+   x1, y1 = (rects[:, 0] + rects[:, 2]).max(), (rects[:, 1] + rects[:, 3]).max()
+   nx, ny = int(np.ceil((x1 - x0) / resolution)), int(np.ceil((y1 - y0) / resolution))
+   if nx * ny > MAX_CELLS:
+       raise ValueError(f"resolution too fine: {nx * ny} cells exceeds {MAX_CELLS}")
+   xs = x0 + (np.arange(nx) + 0.5) * resolution
+   ys = y0 + (np.arange(ny) + 0.5) * resolution
+   inside = np.zeros((ny, nx), dtype=bool)
+   for rx, ry, rw, rh in rects:
+       cols = (xs >= rx) & (xs <= rx + rw)
+       rows = (ys >= ry) & (ys <= ry + rh)
+       inside |= rows[:, None] & cols[None, :]
+   gy, gx = np.nonzero(inside)
+   return {
+       "cell_x": xs[gx],
+       "cell_y": ys[gy],
+       "bounds": np.array([x0, y0, x1, y1], dtype=np.float64),
+   }
+
+
+def coverage_counts(cells: Dict[str, np.ndarray], x: np.ndarray, y: np.ndarray, r: np.ndarray) -> np.ndarray:
+   """Number of discs covering each cell."""
+   cell, _ = disc_hits(cells["cell_x"], cells["cell_y"], x, y, r)
+   return np.bincount(cell, minlength=len(cells["cell_x"]))
+
+
+def score(cells: Dict[str, np.ndarray], catalogue: np.ndarray, placement: np.ndarray, budget: float) -> np.ndarray:
+   """(fitness, coverage, overlap, cost) of one placement."""
+   on = placement[:, ON] > 0
+   kind = placement[on, KIND].astype(np.int64)
+   cost = float(catalogue[kind, 1].sum())
+   counts = coverage_counts(cells, placement[on, X], placement[on, Y], catalogue[kind, 0])
+   n = max(1, len(counts))
+   coverage = np.count_nonzero(counts) / n
+   overlap = np.count_nonzero(counts > 1) / n
+   fitness = coverage - OVERLAP_WEIGHT * overlap - COST_WEIGHT * cost / budget
+   return np.array([fitness, coverage, overlap, cost])
+
+
+# Per-worker view of the shared cell arrays, set by attach().
+_cells: Dict[str, np.ndarray] = {}
+_shm = None
+
+
+def attach(name: str, layout: dict) -> None:
+   global _cells, _shm
+   _shm = shared_memory.SharedMemory(name=name)
+   _cells = attach_views(_shm, layout)
+
+
+def score_chunk(args) -> np.ndarray:
+   catalogue, placements, budget = args
+   return np.array([score(_cells, catalogue, p, budget) for p in placements])
+
+
+class GeneticOptimizer:
+   """Fixed-slot genetic search over sensor placements."""
+
+   def __init__(
+       self,
+       cells: Dict[str, np.ndarray],
+       catalogue: Sequence[dict],
+       budget: float,
+       population: int = 40,
+       generations: int = 60,
+       seed: Optional[int] = None,
+   ) -> None:
+       self.cells = cells
+       self.types = [str(c["type"]) for c in catalogue]
+       # (radius, cost) per catalogue entry
+       self.catalogue = np.array([(float(c["radius"]), float(c["cost"])) for c in catalogue], dtype=np.float64)
+       self.budget = budget
+       self.population = population
+       self.generations = generations
+       self.rng = np.random.default_rng(seed)
+       self.slots = min(MAX_SLOTS, max(1, int(budget // self.catalogue[:, 1].min())))
+
+   def random_placement(self) -> np.ndarray:
+       placement = np.empty((self.slots, 4))
+       pick = self.rng.integers(0, len(self.cells["cell_x"]), self.slots)
+       placement[:, X] = self.cells["cell_x"][pick]
+       placement[:, Y] = self.cells["cell_y"][pick]
+       placement[:, KIND] = self.rng.integers(0, len(self.catalogue), self.slots)
+       placement[:, ON] = self.rng.random(self.slots) < 0.5
+       return self.repair(placement)
+
+   def repair(self, placement: np.ndarray) -> np.ndarray:
+       """Switch random sensors off until the placement fits the budget."""
+       bounds = self.cells["bounds"]
+       placement[:, X] = np.clip(placement[:, X], bounds[0], bounds[2])
+       placement[:, Y] = np.clip(placement[:, Y], bounds[1], bounds[3])
+       costs = self.catalogue[placement[:, KIND].astype(np.int64), 1]
+       on = np.flatnonzero(placement[:, ON] > 0)
+       self.rng.shuffle(on)
+       total = costs[on].sum()
+       for slot in on:
+           if total <= self.budget:
+               break
+           placement[slot, ON] = 0
+           total -= costs[slot]
+       return placement
+
+   def offspring(self, parents: List[np.ndarray], fitness: np.ndarray) -> List[np.ndarray]:
+       order = np.argsort(-fitness)
+       children = [parents[i].copy() for i in order[:2]]  # elitism
+       step = float(self.catalogue[:, 0].mean()) / 2
+       while len(children) < self.population:
+           a, b = (max(self.rng.integers(0, len(parents), 3), key=lambda i: fitness[i]) for _ in range(2))
+           mask = self.rng.random(self.slots) < 0.5
+           child = np.where(mask[:, None], parents[a], parents[b])
+           moved = self.rng.random(self.slots) < 0.2
+           child[moved, X] += self.rng.normal(0, step, moved.sum())
+           child[moved, Y] += self.rng.normal(0, step, moved.sum())
+           retype = self.rng.random(self.slots) < 0.05
+           child[retype, KIND] = self.rng.integers(0, len(self.catalogue), retype.sum())
+           toggle = self.rng.random(self.slots) < 0.05
+           child[toggle, ON] = 1 - child[toggle, ON]
+           children.append(self.repair(child))
+       return children
+
+   def run(
+       self,
+       evaluate: Callable[[List[np.ndarray]], np.ndarray],
+       progress: Optional[Callable[[float], None]] = None,
+   ) -> dict:
+       placements = [self.random_placement() for _ in range(self.population)]
+       best, best_score = None, None
+       for generation in range(self.generations):
+           scores = evaluate(placements)
+           i = int(np.argmax(scores[:, 0]))
+           if best_score is None or scores[i, 0] > best_score[0]:
+               best, best_score = placements[i].copy(), scores[i]
+           if progress:
+               progress((generation + 1) / self.generations)
+           if generation + 1 < self.generations:
+               placements = self.offspring(placements, scores[:, 0])
+
+       on = best[:, ON] > 0
+       return {
+           "sensors": [
+               {
+                   "type": self.types[int(k)],
+                   "x": round(float(x), 2),
+                   "y": round(float(y), 2),
+                   "sensor_rad": float(self.catalogue[int(k), 0]),
+               }
+               for x, y, k in best[on][:, [X, Y, KIND]]
+           ],
+           "fitness": round(float(best_score[0]), 4),
+           "coverage": round(float(best_score[1]), 4),
+           "overlap": round(float(best_score[2]), 4),
+           "cost": round(float(best_score[3]), 4),
+           "budget": self.budget,
+           "generations": self.generations,
+       }
+
+
+def optimize(
+   rects: np.ndarray,
+   catalogue: Sequence[dict],
+   budget: float,
+   resolution: float = DEFAULT_RESOLUTION,
+   population: int = 40,
+   generations: int = 60,
+   seed: Optional[int] = None,
+   workers: Optional[int] = None,
+   progress: Optional[Callable[[float], None]] = None,
+) -> dict:
+   """Best placement found for the rooms in `rects`; ValueError on bad parameters."""
+   if budget <= 0 or resolution <= 0 or population < 2 or generations < 1:
+       raise ValueError("budget and resolution must be > 0, population >= 2 and generations >= 1")
+   if not catalogue or any(float(c["radius"]) <= 0 or float(c["cost"]) <= 0 for c in catalogue):
+       raise ValueError("catalogue entries need a type, radius > 0 and cost > 0")
+   cells = room_cells(rects, resolution)
+   search = GeneticOptimizer(cells, catalogue, budget, population, generations, seed)
+   workers = min(workers or os.cpu_count() or 1, population)
+
+   if workers <= 1:
+       return search.run(
+           lambda placements: np.array([score(cells, search.catalogue, p, budget) for p in placements]),
+           progress,
+       )
+
+   shared = SharedArrays(cells)
+   try:
+       with ProcessPoolExecutor(
+           max_workers=workers,
+           mp_context=multiprocessing.get_context("spawn"),
+           initializer=attach,
+           initargs=(shared.shm.name, shared.layout),
+       ) as pool:
+
+           def evaluate(placements: List[np.ndarray]) -> np.ndarray:
+               chunks = np.array_split(np.arange(len(placements)), workers)
+               tasks = [(search.catalogue, [placements[i] for i in chunk], budget) for chunk in chunks if len(chunk)]
+               return np.concatenate(list(pool.map(score_chunk, tasks)))
+
+           return search.run(evaluate, progress)
+   finally:
+       shared.close()
@@ -0,0 +1,216 @@
+"""
+Wall-aware signal propagation.
+
+Room rectangles (as drawn by DrawRoomWithWalls.tsx) are turned into axis-
+aligned wall segments; collinear overlapping edges of neighbouring rooms are
+merged so a shared wall counts once. Walls are kept sorted by their fixed
+coordinate, so the walls a link can cross are found with a binary search on
+the link's y (or x) extent before the exact intersection test.
+
+Each crossed wall costs a per-protocol loss in dB. With a log-distance path
+loss model the usable range shrinks by 10 ** (-loss / (10 * n)) per wall, so a
+link is kept when distance <= (sensor_rad + device_rad) * factor for its best
+shared protocol. Range factors are tabulated per protocol and wall count, and
+a floor's walls are cached until its rooms change.
+
+A floor uses the model the last connectivity/interference recompute chose
+(Layout.propagation_model), so the incremental updates of the upsert routes
+follow the same rule as the whole-floor pass.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import select
+
+from models import db, Layout, Room
+
+
+# Loss per wall in dB; higher frequencies lose more through interior walls.
+WALL_LOSS_DB = {
+   "Wi-Fi 2.4GHz": 5.0,
+   "Wi-Fi 5GHz": 8.0,
+   "Wi-Fi 6": 8.0,
+   "BLE 5.0": 5.0,
+   "Zigbee 3.0": 5.0,
+   "Thread": 5.0,
+   "Matter": 5.0,
+   "Z-Wave": 3.0,
+   "UWB": 10.0,
+   "LoRaWAN": 2.0,
+   "NB-IoT": 2.0,
+}
+DEFAULT_WALL_LOSS_DB = 6.0
+PATH_LOSS_EXPONENT = 2.0
+MAX_WALLS = 16  # crossings beyond this use the last table entry
+PROPAGATION_CACHE_SIZE = 64
+
+# Links per chunk of the crossing test, keeps the candidate expansion bounded.
+CHUNK_SIZE = 65536
+
+
+def range_factors(loss_db: float) -> np.ndarray:
+   """Range multiplier for 0..MAX_WALLS crossed walls."""
+   walls = np.arange(MAX_WALLS + 1, dtype=np.float64)
+   return 10.0 ** (-walls * loss_db / (10.0 * PATH_LOSS_EXPONENT))
+
+
+def merge_walls(walls: List[Tuple[float, float, float]]) -> np.ndarray:
+   """Merge overlapping collinear segments (fixed, start, end) into an (n, 3) array sorted by `fixed`."""
+   merged: List[List[float]] = []
+   for fixed, start, end in sorted(walls):
+       last = merged[-1] if merged else None
+       if last is not None and last[0] == fixed and start <= last[2]:
+           last[2] = max(last[2], end)
+       else:
+           merged.append([fixed, start, end])
+   return np.array(merged, dtype=np.float64).reshape(-1, 3)
+
+
+class WallIndex:
+   """Horizontal and vertical walls of a floor, sorted for range lookups."""
+
+   def __init__(self, rooms: Sequence) -> None:
+       horizontal, vertical = [], []
+       for r in rooms:
+           x0, y0 = float(r.x), float(r.y)
+           x1, y1 = x0 + float(r.width), y0 + float(r.height)
+           horizontal += [(y0, x0, x1), (y1, x0, x1)]
+           vertical += [(x0, y0, y1), (x1, y0, y1)]
+       self.horizontal = merge_walls(horizontal)
+       self.vertical = merge_walls(vertical)
+
+   def __len__(self) -> int:
+       return len(self.horizontal) + len(self.vertical)
+
+   def crossings(self, ax: np.ndarray, ay: np.ndarray, bx: np.ndarray, by: np.ndarray) -> np.ndarray:
+       """Number of walls each segment a->b crosses (touching a wall at an endpoint does not count)."""
+       counts = np.zeros(len(ax), dtype=np.int64)
+       for start in range(0, len(ax), CHUNK_SIZE):
+           part = slice(start, start + CHUNK_SIZE)
+           counts[part] += count_axis(self.horizontal, ax[part], ay[part], bx[part], by[part])
+           counts[part] += count_axis(self.vertical, ay[part], ax[part], by[part], bx[part])
+       return counts
+
+
+def count_axis(walls: np.ndarray, ax: np.ndarray, ay: np.ndarray, bx: np.ndarray, by: np.ndarray) -> np.ndarray:
+   """
+   Crossings with walls of constant y (fixed) spanning [start, end] in x.
+
+   Vertical walls use the same test with x and y swapped by the caller.
+   """
+   counts = np.zeros(len(ax), dtype=np.int64)
+   if not len(walls) or not len(ax):
+       return counts
+   lo = np.searchsorted(walls[:, 0], np.minimum(ay, by), side="right")
+   hi = np.searchsorted(walls[:, 0], np.maximum(ay, by), side="left")
+   n = np.maximum(hi - lo, 0)
+   total = int(n.sum())
+   if total == 0:
+       return counts
+   seg = np.repeat(np.arange(len(ax)), n)
+   wall = np.repeat(lo, n) + np.arange(total) - np.repeat(np.cumsum(n) - n, n)
+   fixed = walls[wall, 0]
+   t = (fixed - ay[seg]) / (by[seg] - ay[seg])  # strictly between the endpoints, so by != ay
+   x = ax[seg] + t * (bx[seg] - ax[seg])
+   hit = (x >= walls[wall, 1]) & (x <= walls[wall, 2])
+   return np.bincount(seg[hit], minlength=len(ax))
+
+
+class PropagationModel:
+   """Wall-aware link test for one floor."""
+
+   def __init__(self, rooms: Sequence) -> None:
+       self.walls = WallIndex(rooms)
+       self.factors: Dict[str, np.ndarray] = {}
+
+   def factor_table(self, protocol: str) -> np.ndarray:
+       table = self.factors.get(protocol)
+       if table is None:
+           table = range_factors(WALL_LOSS_DB.get(protocol, DEFAULT_WALL_LOSS_DB))
+           self.factors[protocol] = table
+       return table
+
+   def in_range(
+       self,
+       ax: np.ndarray,
+       ay: np.ndarray,
+       bx: np.ndarray,
+       by: np.ndarray,
+       reach: np.ndarray,
+       shared: np.ndarray,
+       protocols: Dict[str, int],
+   ) -> np.ndarray:
+       """
+       Mask of links still in range once walls are accounted for.
+
+       `shared` is the (n, words) bitmask of protocols both ends support and
+       `protocols` maps protocol names to their bit (connectivity.Vocabulary).
+       """
+       walls = np.minimum(self.walls.crossings(ax, ay, bx, by), MAX_WALLS)
+       best = np.zeros(len(ax))
+       for name, bit in protocols.items():
+           has = ((shared[:, bit // 64] >> np.uint64(bit % 64)) & np.uint64(1)) == 1
+           if has.any():
+               best = np.where(has, np.maximum(best, self.factor_table(name)[walls]), best)
+       distance = np.hypot(bx - ax, by - ay)
+       return distance <= reach * best
+
+   def pair_in_range(self, ax: float, ay: float, bx: float, by: float, reach: float, protocols: Sequence[str]) -> bool:
+       """in_range for a single link that shares the named protocols."""
+       walls = self.walls.crossings(np.array([ax]), np.array([ay]), np.array([bx]), np.array([by]))
+       walls = min(int(walls[0]), MAX_WALLS)
+       best = max((self.factor_table(name)[walls] for name in protocols), default=0.0)
+       return float(np.hypot(bx - ax, by - ay)) <= reach * best
+
+
+def rooms_key(rooms: Sequence) -> Tuple:
+   return tuple((r.x, r.y, r.width, r.height) for r in rooms)
+
+
+class PropagationCache:
+   """LRU of per-floor models, rebuilt whenever the floor's rooms differ."""
+
+   def __init__(self, max_entries: int = PROPAGATION_CACHE_SIZE) -> None:
+       self.max_entries = max_entries
+       self.entries: "OrderedDict[str, Tuple[Tuple, PropagationModel]]" = OrderedDict()
+       self.lock = threading.Lock()
+
+   def get(self, layout_id: str, rooms: Sequence) -> PropagationModel:
+       key = rooms_key(rooms)
+       with self.lock:
+           entry = self.entries.get(layout_id)
+           if entry is None or entry[0] != key:
+               entry = (key, PropagationModel(rooms))
+           self.entries[layout_id] = entry
+           self.entries.move_to_end(layout_id)
+           while len(self.entries) > self.max_entries:
+               self.entries.popitem(last=False)
+           return entry[1]
+
+   def drop(self, layout_id: str) -> None:
+       with self.lock:
+           self.entries.pop(layout_id, None)
+
+
+propagation_cache = PropagationCache()
+
+
+def floor_model(layout_id: str) -> str:
+   """The floor's stored propagation model: "walls" or "radius"."""
+   model = db.session.execute(select(Layout.propagation_model).where(Layout.id == layout_id)).scalar()
+   return model or "radius"
+
+
+def floor_propagation(layout_id: str, model: str):
+   """The floor's cached PropagationModel for model == "walls", else None (plain radius check)."""
+   if model != "walls":
+       return None
+   rooms = db.session.execute(
+       select(Room.x, Room.y, Room.width, Room.height)
+       .where(Room.layout_id == layout_id)
+       .order_by(Room.id)
+   ).all()
+   return propagation_cache.get(layout_id, rooms)
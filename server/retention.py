@@ -0,0 +1,367 @@
+"""
+Retention of simulation events and logs.
+
+Raw simulation events older than a floor's retention window (its
+`event_retention_seconds`, else EVENT_RETENTION_SECONDS) are compacted: in
+batches of RETENTION_BATCH_SIZE rows, taken oldest first, the rows are counted
+per node, event type and minute and per hour into `event_rollup` (count,
+motion STARTs, first and last timestamp), then deleted, all in one transaction
+per batch that also logs the deletions under a new version (changes.py).
+Rolled-up counts are added to existing buckets, so batch boundaries need not
+line up with buckets. Minute rollups are kept for EVENT_MINUTE_ROLLUP_SECONDS,
+hour rollups indefinitely. Logs older than LOG_RETENTION_SECONDS are deleted in
+batches; they are audit records with nothing to aggregate.
+
+event_counts() answers counts for any range by merging rollups with the raw
+events that have not been compacted yet, so callers see the same totals
+before and after a compaction.
+
+A daemon thread runs a pass every RETENTION_INTERVAL seconds. Set
+RETENTION_INTERVAL=0 to leave compaction to a separate process instead, e.g.
+a cron entry running one pass:
+    python retention.py
+"""
+
+import atexit
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import DateTime, Integer, and_, bindparam, case, cast, delete, func, or_, select, type_coerce
+
+from changes import record_deletes
+from models import db, EventRollup, Layout, Log, SimulationEvent
+from snapshot import touch_layout
+
+
+logger = logging.getLogger(__name__)
+
+EVENT_RETENTION_SECONDS = int(os.environ.get("EVENT_RETENTION_SECONDS", str(7 * 86400)))
+EVENT_MINUTE_ROLLUP_SECONDS = int(os.environ.get("EVENT_MINUTE_ROLLUP_SECONDS", str(30 * 86400)))
+LOG_RETENTION_SECONDS = int(os.environ.get("LOG_RETENTION_SECONDS", str(30 * 86400)))
+RETENTION_INTERVAL = float(os.environ.get("RETENTION_INTERVAL", "300"))
+RETENTION_BATCH_SIZE = 5000  # raw rows per compaction transaction
+RETENTION_MAX_BATCHES = 100  # per floor per pass, so one busy floor cannot stall the others
+
+RESOLUTIONS = {"minute": 60, "hour": 3600}
+START = "Motion START%"  # DetectMotion's trigger messages (LIKE pattern)
+EPOCH = datetime(1970, 1, 1)
+
+# Serialises compactions in this process (background pass and on-demand route).
+compaction_lock = threading.Lock()
+
+
+def floor_bucket(value: datetime, seconds: int) -> datetime:
+   return value - timedelta(seconds=(value - EPOCH).total_seconds() % seconds)
+
+
+def ceil_bucket(value: datetime, seconds: int) -> datetime:
+   start = floor_bucket(value, seconds)
+   return start if start == value else start + timedelta(seconds=seconds)
+
+
+def bucket_start(column, seconds: int):
+   """SQL for the start of the `seconds`-wide bucket holding a timestamp column."""
+   if db.session.get_bind().dialect.name == "sqlite":
+       return type_coerce(func.datetime(bucket_epoch(column, seconds), "unixepoch"), DateTime)
+   return type_coerce(func.timezone("UTC", func.to_timestamp(bucket_epoch(column, seconds))), DateTime)
+
+
+def bucket_epoch(column, seconds: int):
+   """bucket_start as whole seconds since the epoch, cheaper to read back than a datetime."""
+   if db.session.get_bind().dialect.name == "sqlite":
+       epoch = cast(func.strftime("%s", column), Integer)
+       return epoch - epoch % seconds
+   return cast(func.floor(func.extract("epoch", column) / seconds) * seconds, Integer)
+
+
+def retention_seconds(configured: Optional[int]) -> int:
+   return EVENT_RETENTION_SECONDS if configured is None else configured
+
+
+def minute_horizon(now: datetime) -> datetime:
+   """Minute rollups before this (hour-aligned) time have been pruned; hour rollups cover them."""
+   return floor_bucket(now - timedelta(seconds=EVENT_MINUTE_ROLLUP_SECONDS), 3600)
+
+
+def raw_counts(seconds: int, *conditions) -> List[Tuple]:
+   """(bucket, node_id, node_type, event_type, count, first, last, triggers) of raw events matching `conditions`."""
+   bucket = bucket_start(SimulationEvent.timestamp, seconds).label("bucket")
+   query = (
+       select(
+           bucket, SimulationEvent.node_id, SimulationEvent.node_type, SimulationEvent.event_type,
+           func.count(), func.min(SimulationEvent.timestamp), func.max(SimulationEvent.timestamp),
+           func.sum(case((SimulationEvent.message.like(START), 1), else_=0)),
+       )
+       .where(*conditions)
+       .group_by(bucket, SimulationEvent.node_id, SimulationEvent.node_type, SimulationEvent.event_type)
+   )
+   return db.session.execute(query).all()
+
+
+def merge_rollups(layout_id: str, seconds: int, counts: List[Tuple]) -> None:
+   """Add counted buckets to event_rollup: existing buckets are prefetched and updated, new ones inserted."""
+   if not counts:
+       return
+   existing = {
+       (row.bucket, row.node_id, row.event_type): row
+       for row in db.session.execute(
+           select(
+               EventRollup.id, EventRollup.bucket, EventRollup.node_id, EventRollup.event_type,
+               EventRollup.count, EventRollup.triggers, EventRollup.first_timestamp, EventRollup.last_timestamp,
+           ).where(
+               EventRollup.floor == layout_id,
+               EventRollup.resolution == seconds,
+               EventRollup.bucket >= min(c[0] for c in counts),
+               EventRollup.bucket <= max(c[0] for c in counts),
+           )
+       )
+   }
+   inserts, updates = [], []
+   for bucket, node_id, node_type, event_type, count, first, last, triggers in counts:
+       row = existing.get((bucket, node_id, event_type))
+       if row is None:
+           inserts.append({
+               "floor": layout_id, "resolution": seconds, "bucket": bucket, "node_id": node_id,
+               "node_type": node_type, "event_type": event_type, "count": count, "triggers": triggers,
+               "first_timestamp": first, "last_timestamp": last,
+           })
+       else:
+           updates.append({
+               "_id": row.id, "count": row.count + count, "triggers": row.triggers + triggers,
+               "first_timestamp": min(row.first_timestamp, first), "last_timestamp": max(row.last_timestamp, last),
+           })
+   table = EventRollup.__table__
+   if inserts:
+       # Core executemany: no RETURNING of the new ids, which the ORM bulk path would fetch.
+       db.session.connection().execute(table.insert(), inserts)
+   if updates:
+       db.session.connection().execute(
+           table.update().where(table.c.id == bindparam("_id")).values(
+               count=bindparam("count"),
+               triggers=bindparam("triggers"),
+               first_timestamp=bindparam("first_timestamp"),
+               last_timestamp=bindparam("last_timestamp"),
+           ),
+           updates,
+       )
+
+
+def compact_batch(layout_id: str, cutoff: datetime, batch_size: int = RETENTION_BATCH_SIZE) -> int:
+   """Roll up and delete the oldest `batch_size` raw events before `cutoff`, in one transaction."""
+   older = [SimulationEvent.floor == layout_id, SimulationEvent.timestamp < cutoff]
+   # The batch ends at the batch_size-th oldest row, by the (timestamp, id) order of the index.
+   last = db.session.execute(
+       select(SimulationEvent.timestamp, SimulationEvent.id)
+       .where(*older)
+       .order_by(SimulationEvent.timestamp, SimulationEvent.id)
+       .offset(batch_size - 1)
+       .limit(1)
+   ).first()
+   batch = list(older)
+   if last is not None:
+       batch.append(or_(
+           SimulationEvent.timestamp < last.timestamp,
+           and_(SimulationEvent.timestamp == last.timestamp, SimulationEvent.id <= last.id),
+       ))
+   try:
+       for seconds in RESOLUTIONS.values():
+           merge_rollups(layout_id, seconds, raw_counts(seconds, *batch))
+       deleted = db.session.execute(
+           delete(SimulationEvent).where(*batch).returning(SimulationEvent.id).execution_options(synchronize_session=False)
+       ).scalars().all()
+       if deleted:
+           # Logged like any other delete, so /changes and the stream drop the events too.
+           record_deletes(layout_id, "events", deleted)
+           touch_layout(layout_id)
+       db.session.commit()
+       return len(deleted)
+   except Exception:
+       db.session.rollback()
+       raise
+
+
+def prune_minute_rollups(layout_id: str, horizon: datetime, batch_size: int = RETENTION_BATCH_SIZE) -> int:
+   pruned = 0
+   while True:
+       ids = select(EventRollup.id).where(
+           EventRollup.floor == layout_id, EventRollup.resolution == RESOLUTIONS["minute"], EventRollup.bucket < horizon,
+       ).limit(batch_size)
+       count = db.session.execute(delete(EventRollup).where(EventRollup.id.in_(ids))).rowcount
+       db.session.commit()
+       pruned += count
+       if count < batch_size:
+           return pruned
+
+
+def prune_logs(cutoff: datetime, batch_size: int = RETENTION_BATCH_SIZE) -> int:
+   pruned = 0
+   while True:
+       ids = select(Log.id).where(Log.timestamp < cutoff).order_by(Log.timestamp).limit(batch_size)
+       count = db.session.execute(delete(Log).where(Log.id.in_(ids))).rowcount
+       db.session.commit()
+       pruned += count
+       if count < batch_size:
+           return pruned
+
+
+def compact_layout(
+   layout_id: str,
+   configured: Optional[int] = None,
+   now: Optional[datetime] = None,
+   batch_size: int = RETENTION_BATCH_SIZE,
+   max_batches: int = RETENTION_MAX_BATCHES,
+) -> dict:
+   """One compaction pass over a floor; `configured` is its event_retention_seconds."""
+   now = now or datetime.utcnow()
+   cutoff = now - timedelta(seconds=retention_seconds(configured))
+   compacted = 0
+   with compaction_lock:
+       for _ in range(max_batches):
+           count = compact_batch(layout_id, cutoff, batch_size)
+           compacted += count
+           if count < batch_size:
+               break
+       pruned = prune_minute_rollups(layout_id, minute_horizon(now), batch_size)
+   return {
+       "cutoff": int((cutoff - EPOCH).total_seconds() * 1000),
+       "compacted_events": compacted,
+       "pruned_minute_rollups": pruned,
+   }
+
+
+def compact_all(now: Optional[datetime] = None) -> dict:
+   """Compact every floor and prune old logs; returns per-floor results."""
+   now = now or datetime.utcnow()
+   layouts = db.session.execute(select(Layout.id, Layout.event_retention_seconds)).all()
+   db.session.rollback()  # end the read transaction; each batch commits its own
+   results = {}
+   for layout_id, configured in layouts:
+       result = compact_layout(layout_id, configured, now)
+       if result["compacted_events"] or result["pruned_minute_rollups"]:
+           results[layout_id] = result
+   with compaction_lock:
+       logs = prune_logs(now - timedelta(seconds=LOG_RETENTION_SECONDS))
+   return {"layouts": results, "pruned_logs": logs}
+
+
+def event_counts(
+   layout_id: str,
+   resolution: str,
+   since: Optional[datetime] = None,
+   until: Optional[datetime] = None,
+   node_id: Optional[str] = None,
+   event_type: Optional[str] = None,
+   now: Optional[datetime] = None,
+) -> List[dict]:
+   """
+   Event counts per bucket, node and type for the buckets overlapping [since, until),
+   from rollups and not-yet-compacted raw events alike. Minute counts older than the
+   minute-rollup horizon are answered with hour buckets (each bucket carries its width).
+   """
+   seconds = RESOLUTIONS[resolution]
+   segments = [(since, until, seconds)]
+   if seconds == RESOLUTIONS["minute"]:
+       horizon = minute_horizon(now or datetime.utcnow())
+       segments = []
+       if since is None or since < horizon:
+           segments.append((since, horizon if until is None else min(until, horizon), RESOLUTIONS["hour"]))
+       if until is None or until > horizon:
+           segments.append((horizon if since is None else max(since, horizon), until, seconds))
+
+   merged: Dict[Tuple, list] = {}
+   for low, high, width in segments:
+       low = None if low is None else floor_bucket(low, width)
+       high = None if high is None else ceil_bucket(high, width)
+       rollup = [EventRollup.floor == layout_id, EventRollup.resolution == width]
+       raw = [SimulationEvent.floor == layout_id]
+       if low is not None:
+           rollup.append(EventRollup.bucket >= low)
+           raw.append(SimulationEvent.timestamp >= low)
+       if high is not None:
+           rollup.append(EventRollup.bucket < high)
+           raw.append(SimulationEvent.timestamp < high)
+       if node_id:
+           rollup.append(EventRollup.node_id == node_id)
+           raw.append(SimulationEvent.node_id == node_id)
+       if event_type:
+           rollup.append(EventRollup.event_type == event_type)
+           raw.append(SimulationEvent.event_type == event_type)
+       rolled = db.session.execute(
+           select(
+               EventRollup.bucket, EventRollup.node_id, EventRollup.node_type, EventRollup.event_type,
+               EventRollup.count, EventRollup.first_timestamp, EventRollup.last_timestamp, EventRollup.triggers,
+           ).where(*rollup)
+       ).all()
+       # Rolled-up and raw rows are disjoint (compaction deletes what it counts), so counts add up.
+       for bucket, node, node_type, kind, count, first, last, _ in rolled + raw_counts(width, *raw):
+           entry = merged.get((bucket, width, node, kind))
+           if entry is None:
+               merged[(bucket, width, node, kind)] = [node_type, count, first, last]
+           else:
+               entry[1] += count
+               entry[2] = min(entry[2], first)
+               entry[3] = max(entry[3], last)
+
+   def ms(value: datetime) -> int:
+       return int((value - EPOCH).total_seconds() * 1000)
+
+   return [
+       {
+           "bucket": ms(bucket), "resolution": width, "nodeId": node, "nodeType": node_type, "eventType": kind,
+           "count": count, "first": ms(first), "last": ms(last),
+       }
+       for (bucket, width, node, kind), (node_type, count, first, last) in sorted(merged.items())
+   ]
+
+
+class RetentionCompactor:
+   """Runs compact_all() every `interval` seconds on a daemon thread."""
+
+   def __init__(self, app, interval: float = RETENTION_INTERVAL) -> None:
+       self.app = app
+       self.interval = interval
+       self.cond = threading.Condition()
+       self.worker = None
+       self.closed = False
+       self.last_result: Optional[dict] = None
+
+   def start(self) -> None:
+       """Start the thread unless running or disabled (interval <= 0); safe to call repeatedly."""
+       if self.worker is not None or self.interval <= 0:
+           return
+       with self.cond:
+           if self.worker is not None:
+               return
+           self.worker = threading.Thread(target=self.run, name="retention", daemon=True)
+           self.worker.start()
+       atexit.register(self.close)
+
+   def run(self) -> None:
+       while True:
+           with self.app.app_context():
+               try:
+                   self.last_result = compact_all()
+               except Exception:
+                   logger.exception("Retention pass failed")
+                   db.session.rollback()
+           with self.cond:
+               self.cond.wait_for(lambda: self.closed, timeout=self.interval)
+               if self.closed:
+                   return
+
+   def close(self) -> None:
+       with self.cond:
+           self.closed = True
+           self.cond.notify_all()
+
+
+if __name__ == "__main__":
+   from app import app as flask_app, create_tables
+
+   logging.basicConfig(level=logging.INFO)
+   with flask_app.app_context():
+       create_tables()
+       logger.info("Retention pass: %s", compact_all())
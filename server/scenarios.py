@@ -0,0 +1,293 @@
+"""
+Parallel what-if scenarios over one layout.
+
+A scenario is the base floor (rooms, sensors, devices, people) with a few
+parameters changed: sensor radii, person speeds or protocol sets. The base
+floor is packed once into NumPy arrays held in a single shared-memory block;
+pool workers attach to it when they start, so each task only carries its own
+overrides. Every scenario is fast-forwarded (simulation.fast_forward) and its
+connectivity recomputed, and comparable totals are returned per scenario.
+
+A variation is a dict with any of:
+    name                 label echoed in the results
+    sensor_radius_scale  multiplies every sensor_rad
+    sensor_rad           {sensor_id: radius}, applied after the scale
+    speed_scale          multiplies every person's animationSpeed
+    animationSpeed       {person_id: speed}, applied after the scale
+    connectivity         {sensor_or_device_id: [protocols]}
+"""
+
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from connectivity import (
+   DEFAULT_DEVICE_RADIUS,
+   DEFAULT_SENSOR_RADIUS,
+   Vocabulary,
+   connected_pairs,
+   encode_sets,
+   pad_words,
+   radii,
+)
+from simulation import MOTION_SENSOR_TYPES, MotionSimulation, fast_forward, room_rects
+
+
+MAX_VARIATIONS = 256
+
+class SharedArrays:
+   """Named NumPy arrays packed into one shared-memory block."""
+
+   def __init__(self, arrays: Dict[str, np.ndarray]) -> None:
+       self.layout: Dict[str, Tuple[int, Tuple[int, ...], str]] = {}
+       offset = 0
+       for name, array in arrays.items():
+           self.layout[name] = (offset, array.shape, array.dtype.str)
+           offset += (array.nbytes + 7) // 8 * 8  # keep every array 8-byte aligned
+       self.shm = shared_memory.SharedMemory(create=True, size=max(offset, 8))
+       for name, view in attach_views(self.shm, self.layout).items():
+           view[...] = arrays[name]
+
+   def close(self) -> None:
+       self.shm.close()
+       self.shm.unlink()
+
+
+def check_variation(variation: dict) -> None:
+   """Raise ValueError unless every field of `variation` has the type the module docstring lists."""
+   def number(value, field: str) -> float:
+       if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value) or value < 0:
+           raise ValueError(f"{field} must be a number >= 0")
+       return value
+
+   if variation.get("name") is not None and not isinstance(variation["name"], str):
+       raise ValueError("name must be a string")
+   for field in ("sensor_radius_scale", "speed_scale"):
+       if field in variation:
+           number(variation[field], field)
+   for field in ("sensor_rad", "animationSpeed", "connectivity"):
+       if variation.get(field) is not None and not isinstance(variation[field], dict):
+           raise ValueError(f"{field} must be an object keyed by node id")
+   for field in ("sensor_rad", "animationSpeed"):
+       for node_id, value in (variation.get(field) or {}).items():
+           number(value, f"{field}[{node_id!r}]")
+   for node_id, values in (variation.get("connectivity") or {}).items():
+       if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+           raise ValueError(f"connectivity[{node_id!r}] must be a list of protocol names")
+
+
+def attach_views(shm: shared_memory.SharedMemory, layout: dict) -> Dict[str, np.ndarray]:
+   return {
+       name: np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf, offset=offset)
+       for name, (offset, shape, dtype) in layout.items()
+   }
+
+
+class ScenarioBase:
+   """A floor packed into arrays, plus the ids needed to resolve variations."""
+
+   def __init__(self, rooms: Sequence, people: Sequence, sensors: Sequence, devices: Sequence,
+                variations: Sequence[dict] = ()) -> None:
+       self.sensor_ids = [s.id for s in sensors]
+       self.device_ids = [d.id for d in devices]
+       self.person_ids = [p.id for p in people]
+       self.sensor_pos = {sid: i for i, sid in enumerate(self.sensor_ids)}
+       self.device_pos = {did: i for i, did in enumerate(self.device_ids)}
+       self.person_pos = {pid: i for i, pid in enumerate(self.person_ids)}
+
+       # Protocols introduced only by variations still need a bit in the shared masks.
+       self.protocols = Vocabulary()
+       self.types = Vocabulary()
+       for variation in variations:
+           for values in (variation.get("connectivity") or {}).values():
+               for v in values or []:
+                   if v and v.strip():
+                       self.protocols.add(v)
+       s_proto = encode_sets([s.connectivity for s in sensors], self.protocols)
+       d_proto = encode_sets([d.connectivity for d in devices], self.protocols)
+       d_compat = encode_sets([d.compatibleSensors for d in devices], self.types)
+       s_type = np.array([self.types.add(s.type) for s in sensors], dtype=np.int64)
+
+       motion = MotionSimulation(people, ())
+       self.arrays = {
+           "room": room_rects(rooms),
+           "path_x": motion.path_x,
+           "path_y": motion.path_y,
+           "length": motion.length,
+           "index": motion.index,
+           "direction": motion.direction,
+           "progress": motion.progress,
+           "speed": motion.speed,
+           "sensor_x": np.array([s.x for s in sensors], dtype=np.float64),
+           "sensor_y": np.array([s.y for s in sensors], dtype=np.float64),
+           "sensor_r": radii((s.sensor_rad for s in sensors), DEFAULT_SENSOR_RADIUS),
+           "motion": np.array([s.type in MOTION_SENSOR_TYPES for s in sensors], dtype=bool),
+           "s_proto": pad_words(s_proto, self.protocols.words),
+           "s_type": s_type,
+           "device_x": np.array([d.x for d in devices], dtype=np.float64),
+           "device_y": np.array([d.y for d in devices], dtype=np.float64),
+           "device_r": radii((d.device_rad for d in devices), DEFAULT_DEVICE_RADIUS),
+           "d_proto": pad_words(d_proto, self.protocols.words),
+           "d_compat": pad_words(d_compat, self.types.words),
+       }
+
+   def overrides(self, variation: dict) -> Dict[str, tuple]:
+       """Turn an id-keyed variation into (indices, values) pairs; ValueError on bad input."""
+       result: Dict[str, tuple] = {}
+       scale = float(variation.get("sensor_radius_scale", 1.0))
+       rad = variation.get("sensor_rad") or {}
+       if scale != 1.0 or rad:
+           if scale < 0:
+               raise ValueError("sensor_radius_scale must be >= 0")
+           idx, values = self.resolve(rad, self.sensor_pos, "sensor")
+           result["sensor_r"] = (scale, idx, values)
+       scale = float(variation.get("speed_scale", 1.0))
+       speed = variation.get("animationSpeed") or {}
+       if scale != 1.0 or speed:
+           if scale < 0:
+               raise ValueError("speed_scale must be >= 0")
+           idx, values = self.resolve(speed, self.person_pos, "person")
+           result["speed"] = (scale, idx, values)
+
+       sensor_sets: Dict[str, list] = {}
+       device_sets: Dict[str, list] = {}
+       for node_id, values in (variation.get("connectivity") or {}).items():
+           if node_id in self.sensor_pos:
+               sensor_sets[node_id] = values
+           elif node_id in self.device_pos:
+               device_sets[node_id] = values
+           else:
+               raise ValueError(f"Unknown node {node_id!r} in connectivity")
+       for key, sets, pos in (("s_proto", sensor_sets, self.sensor_pos), ("d_proto", device_sets, self.device_pos)):
+           if sets:
+               idx = np.array([pos[i] for i in sets], dtype=np.int64)
+               masks = pad_words(encode_sets(list(sets.values()), self.protocols), self.protocols.words)
+               result[key] = (None, idx, masks)
+       return result
+
+   @staticmethod
+   def resolve(values: dict, positions: dict, kind: str) -> Tuple[np.ndarray, np.ndarray]:
+       try:
+           idx = np.array([positions[k] for k in values], dtype=np.int64)
+       except KeyError as e:
+           raise ValueError(f"Unknown {kind} {e.args[0]!r}") from None
+       vals = np.array([float(v) for v in values.values()], dtype=np.float64)
+       if (vals < 0).any():
+           raise ValueError(f"{kind} values must be >= 0")
+       return idx, vals
+
+
+# Per-worker view of the shared base arrays, set by attach().
+_shm: Optional[shared_memory.SharedMemory] = None
+_base: Dict[str, np.ndarray] = {}
+
+
+def attach(name: str, layout: dict) -> None:
+   global _shm, _base
+   _shm = shared_memory.SharedMemory(name=name)
+   _base = attach_views(_shm, layout)
+
+
+def apply_overrides(base: Dict[str, np.ndarray], overrides: Dict[str, tuple]) -> Dict[str, np.ndarray]:
+   arrays = dict(base)
+   for key, (scale, idx, values) in overrides.items():
+       array = base[key] * scale if scale is not None else base[key].copy()
+       array[idx] = values
+       arrays[key] = array
+   return arrays
+
+
+def evaluate(arrays: Dict[str, np.ndarray], steps: int, dt: float) -> dict:
+   """Fast-forward one scenario and recompute its connectivity; returns comparable totals."""
+   started = time.perf_counter()
+   motion = arrays["motion"]
+   sim = MotionSimulation.from_arrays(
+       arrays["path_x"], arrays["path_y"], arrays["length"], arrays["index"], arrays["direction"],
+       arrays["progress"], arrays["speed"],
+       arrays["sensor_x"][motion], arrays["sensor_y"][motion], arrays["sensor_r"][motion],
+   )
+   result = fast_forward(sim, steps, dt, arrays["room"])
+   s_hit, _ = connected_pairs(
+       arrays["sensor_x"], arrays["sensor_y"], arrays["sensor_r"], arrays["s_proto"], arrays["s_type"],
+       arrays["device_x"], arrays["device_y"], arrays["device_r"], arrays["d_proto"], arrays["d_compat"],
+   )
+   occupied = int(result.room_steps.sum())
+   connected = len(np.unique(s_hit))
+   return {
+       "motion_starts": int(result.triggers.sum()),
+       "detected_seconds": round(float(result.detected_steps.sum()) * dt, 3),
+       "undetected_seconds": round(result.undetected_steps * dt, 3),
+       # Share of person-time inside rooms that no motion sensor saw.
+       "coverage_gap": round(int(result.room_undetected_steps.sum()) / occupied, 4) if occupied else 0.0,
+       "silent_sensors": int((result.triggers == 0).sum()),
+       "links": len(s_hit),
+       "connected_sensors": connected,
+       "unconnected_sensors": len(motion) - connected,
+       "wall_seconds": round(time.perf_counter() - started, 4),
+   }
+
+
+def run_task(task: Tuple[Dict[str, tuple], int, float]) -> dict:
+   overrides, steps, dt = task
+   return evaluate(apply_overrides(_base, overrides), steps, dt)
+
+
+def run_scenarios(
+   base: ScenarioBase,
+   variations: Sequence[dict],
+   steps: int,
+   dt: float,
+   workers: Optional[int] = None,
+   progress: Optional[Callable[[float], None]] = None,
+) -> List[dict]:
+   """
+   Evaluate the unchanged floor ("baseline") and every variation, in that order.
+
+   Variations are validated before any worker starts. With one worker (or one
+   scenario) everything runs in-process; otherwise scenarios fan out over a
+   spawn-based ProcessPoolExecutor attached to the shared base arrays.
+   `progress` is called with the finished fraction after each scenario.
+   """
+   if len(variations) > MAX_VARIATIONS:
+       raise ValueError(f"At most {MAX_VARIATIONS} variations per run")
+   names = ["baseline"] + [str(v.get("name") or f"variation-{i + 1}") for i, v in enumerate(variations)]
+   tasks = [({}, steps, dt)] + [(base.overrides(v), steps, dt) for v in variations]
+   workers = min(workers or os.cpu_count() or 1, len(tasks))
+
+   results: List[dict] = []
+
+   def collect(metrics: dict) -> None:
+       results.append(metrics)
+       if progress:
+           progress(len(results) / len(tasks))
+
+   if workers <= 1:
+       for overrides, s, d in tasks:
+           collect(evaluate(apply_overrides(base.arrays, overrides), s, d))
+   else:
+       shared = SharedArrays(base.arrays)
+       try:
+           # spawn, not fork: the server process has writer and request threads.
+           with ProcessPoolExecutor(
+               max_workers=workers,
+               mp_context=multiprocessing.get_context("spawn"),
+               initializer=attach,
+               initargs=(shared.shm.name, shared.layout),
+           ) as pool:
+               futures = [pool.submit(run_task, task) for task in tasks]
+               try:
+                   for future in futures:
+                       collect(future.result())
+               except BaseException:
+                   for future in futures:
+                       future.cancel()
+                   raise
+       finally:
+           shared.close()
+   return [dict(name=name, **metrics) for name, metrics in zip(names, results)]
@@ -0,0 +1,126 @@
+"""
+Column-level serialisation of floor collections for the read routes.
+
+A RowSpec lists the output keys of a model's to_dict() and the columns they
+come from. Queries select just those columns with Core select() executed on
+the session's connection (plain tuples, no ORM loading or identity map),
+rows are zipped with the keys and whole batches are encoded with one
+encoding.json_bytes call. JSON columns are read as text and decoded with
+encoding.json_loads (orjson when installed); psycopg decodes json itself, so
+on PostgreSQL the values arrive as lists/dicts and pass through unchanged.
+Datetimes are written by the encoder. Arrays are encoded SERIALIZE_CHUNK rows
+at a time, which lets large responses stream while they are read.
+"""
+
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import JSON, String, select, type_coerce
+
+from encoding import json_bytes, json_loads
+from models import db, Device, Person, Room, Sensor, SimulationEvent
+
+
+SERIALIZE_CHUNK = 2000  # rows per encoded batch / streamed chunk
+
+
+def ms_timestamp(value) -> Optional[int]:
+   """Naive datetime -> milliseconds since epoch, as SimulationEvent.to_dict()."""
+   return int(value.timestamp() * 1000) if value else None
+
+
+def decode_json(value):
+   """Stored JSON text -> value. Drivers that decode json themselves (psycopg) hand over the value as is."""
+   return json_loads(value) if isinstance(value, (str, bytes)) else value
+
+
+class RowSpec:
+   """Output keys of a collection and the columns they are read from."""
+
+   def __init__(self, fields: Sequence[Tuple[str, object]], convert: Optional[Dict[str, Callable]] = None) -> None:
+       self.keys = tuple(key for key, _ in fields)
+       self.columns = []
+       self.convert = [(self.keys.index(key), fn) for key, fn in (convert or {}).items()]
+       for index, (_, column) in enumerate(fields):
+           if isinstance(column.type, JSON):
+               # Read the stored text and decode it here, skipping the JSON type's result processing.
+               column = type_coerce(column, String).label(column.key)
+               self.convert.append((index, decode_json))
+           self.columns.append(column)
+
+   def select(self, *extra):
+       """select() of the spec's columns; `extra` columns are appended after them (e.g. for cursors)."""
+       return select(*self.columns, *extra)
+
+   def row(self, values: Sequence) -> dict:
+       if self.convert:
+           values = list(values[:len(self.keys)])
+           for index, fn in self.convert:
+               values[index] = fn(values[index])
+       return dict(zip(self.keys, values))
+
+   def rows(self, values: Sequence[Sequence]) -> List[dict]:
+       return [self.row(v) for v in values]
+
+
+ROOM_ROWS = RowSpec([
+   ("id", Room.id), ("name", Room.name), ("x", Room.x), ("y", Room.y),
+   ("width", Room.width), ("height", Room.height),
+])
+
+DEVICE_ROWS = RowSpec([
+   ("id", Device.id), ("x", Device.x), ("y", Device.y), ("type", Device.type), ("label", Device.label),
+   ("name", Device.name), ("device_rad", Device.device_rad), ("connectivity", Device.connectivity),
+   ("compatibleSensors", Device.compatibleSensors), ("interferenceProtocols", Device.interferenceProtocols),
+   ("connectedSensorIds", Device.connectedSensorIds), ("interferenceIds", Device.interferenceIds),
+   ("floor", Device.floor), ("date_created", Device.date_created), ("date_modified", Device.date_modified),
+])
+
+SENSOR_ROWS = RowSpec([
+   ("id", Sensor.id), ("type", Sensor.type), ("name", Sensor.name), ("x", Sensor.x), ("y", Sensor.y),
+   ("sensor_rad", Sensor.sensor_rad), ("connectivity", Sensor.connectivity),
+   ("connectedDeviceIds", Sensor.connectedDeviceIds), ("interferenceIds", Sensor.interferenceIds),
+   ("floor", Sensor.floor), ("date_created", Sensor.date_created), ("date_modified", Sensor.date_modified),
+])
+
+PERSON_ROWS = RowSpec([
+   ("id", Person.id), ("name", Person.name), ("floor", Person.floor), ("path", Person.path),
+   ("currentIndex", Person.currentIndex), ("direction", Person.direction), ("color", Person.color),
+   ("animationSpeed", Person.animationSpeed), ("progress", Person.progress),
+   ("date_created", Person.date_created), ("date_modified", Person.date_modified),
+])
+
+EVENT_ROWS = RowSpec(
+   [
+       ("id", SimulationEvent.id), ("floor", SimulationEvent.floor), ("nodeId", SimulationEvent.node_id),
+       ("nodeType", SimulationEvent.node_type), ("eventType", SimulationEvent.event_type),
+       ("timestamp", SimulationEvent.timestamp), ("message", SimulationEvent.message),
+       ("date_created", SimulationEvent.date_created), ("date_modified", SimulationEvent.date_modified),
+   ],
+   convert={"timestamp": ms_timestamp},
+)
+
+
+def encode_chunks(spec: RowSpec, result, chunk_size: int = SERIALIZE_CHUNK) -> Iterator[bytes]:
+   """A JSON array of the result's rows, `chunk_size` rows per yielded piece."""
+   yield b"["
+   first = True
+   for batch in result.partitions(chunk_size):
+       body = json_bytes(spec.rows(batch))[1:-1]
+       if body:
+           yield body if first else b"," + body
+           first = False
+   yield b"]"
+
+
+def array_bytes(spec: RowSpec, query, chunk_size: int = SERIALIZE_CHUNK) -> bytes:
+   """Whole JSON array for `query` (a spec.select() with filters)."""
+   return b"".join(encode_chunks(spec, db.session.connection().execute(query), chunk_size))
+
+
+def stream_array(spec: RowSpec, query, chunk_size: int = SERIALIZE_CHUNK):
+   """
+   Execute `query` now (so errors surface before the response starts) and
+   return a generator of the encoded array, fetching `chunk_size` rows at a time.
+   """
+   result = db.session.connection().execute(query.execution_options(yield_per=chunk_size))
+   return encode_chunks(spec, result, chunk_size)
@@ -0,0 +1,426 @@
+"""
+Fixed-step people movement and motion detection.
+
+Server-side port of the people animation in CanvasArea.tsx and of
+DetectMotion.ts. All people advance together as NumPy arrays (paths are packed
+into one flat coordinate array with per-person offsets), and motion is detected
+by finding the (person, sensor) pairs in range with the same x-sorted sweep the
+connectivity engine uses, then diffing them against the previous step's pairs.
+Unlike the browser loop, results depend only on `dt`, not on frame rate.
+"""
+
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from connectivity import DEFAULT_SENSOR_RADIUS, radii, range_pairs
+from spatial_index import disc_hits
+
+
+DEFAULT_ANIMATION_SPEED = 80.0  # pixels per second, as in CanvasArea.tsx
+MOTION_SENSOR_TYPES = ("motion", "presence")
+
+# (seconds since start, "START" | "END", person index, sensor index)
+MotionEvent = Tuple[float, str, int, int]
+
+
+class MotionSimulation:
+   """People (with paths) walking past motion/presence sensors on one floor."""
+
+   def __init__(self, people: Sequence, sensors: Sequence) -> None:
+       self.people = list(people)
+       self.sensors = [s for s in sensors if s.type in MOTION_SENSOR_TYPES]
+
+       lengths = np.array([len(p.path or []) for p in self.people], dtype=np.int64)
+       self.length = lengths
+       self.offset = np.concatenate(([0], np.cumsum(lengths)[:-1])).astype(np.int64) if len(lengths) else lengths
+       points = [pt for p in self.people for pt in (p.path or [])]
+       self.path_x = np.array([pt["x"] for pt in points], dtype=np.float64)
+       self.path_y = np.array([pt["y"] for pt in points], dtype=np.float64)
+
+       self.index = np.array([p.currentIndex or 0 for p in self.people], dtype=np.int64)
+       self.direction = np.array([-1 if p.direction == -1 else 1 for p in self.people], dtype=np.int64)
+       self.progress = np.array([p.progress or 0.0 for p in self.people], dtype=np.float64)
+       self.speed = np.array(
+           [DEFAULT_ANIMATION_SPEED if p.animationSpeed is None else p.animationSpeed for p in self.people],
+           dtype=np.float64,
+       )
+       # People need two waypoints to walk; the rest stand still and are never detected.
+       self.movable = self.length >= 2
+       self.index = np.clip(self.index, 0, np.maximum(self.length - 1, 0))
+
+       self.sensor_x = np.array([s.x for s in self.sensors], dtype=np.float64)
+       self.sensor_y = np.array([s.y for s in self.sensors], dtype=np.float64)
+       self.sensor_r = radii((s.sensor_rad for s in self.sensors), DEFAULT_SENSOR_RADIUS)
+
+       # Active (person, sensor) detections encoded as person * n_sensors + sensor, sorted.
+       self.active = np.empty(0, dtype=np.int64)
+       self.elapsed = 0.0
+
+   @classmethod
+   def from_arrays(
+       cls,
+       path_x: np.ndarray,
+       path_y: np.ndarray,
+       length: np.ndarray,
+       index: np.ndarray,
+       direction: np.ndarray,
+       progress: np.ndarray,
+       speed: np.ndarray,
+       sensor_x: np.ndarray,
+       sensor_y: np.ndarray,
+       sensor_r: np.ndarray,
+   ) -> "MotionSimulation":
+       """
+       Build a simulation straight from packed arrays (as laid out by __init__).
+
+       No rows are kept, so person_states() and event_rows() are unavailable;
+       used by the scenario runner, whose workers only see shared arrays.
+       """
+       sim = cls((), ())
+       sim.length = length
+       sim.offset = np.concatenate(([0], np.cumsum(length)[:-1])).astype(np.int64) if len(length) else length
+       sim.path_x, sim.path_y = path_x, path_y
+       sim.movable = length >= 2
+       sim.index = np.clip(index, 0, np.maximum(length - 1, 0))
+       sim.direction, sim.progress, sim.speed = direction, progress, speed
+       sim.sensor_x, sim.sensor_y, sim.sensor_r = sensor_x, sensor_y, sensor_r
+       return sim
+
+   def segment(self) -> Tuple[np.ndarray, np.ndarray]:
+       """Index of the waypoint each person is walking towards, and whether the path end was overshot."""
+       nxt = self.index + self.direction
+       reached_end = (nxt < 0) | (nxt >= self.length)
+       target = np.where(reached_end, self.index - self.direction, nxt)
+       return np.clip(target, 0, np.maximum(self.length - 1, 0)), reached_end
+
+   def positions(self) -> Tuple[np.ndarray, np.ndarray]:
+       target, _ = self.segment()
+       start = self.offset + self.index
+       end = self.offset + target
+       if not len(self.path_x):
+           empty = np.zeros(len(self.length))
+           return empty, empty
+       start = np.minimum(start, len(self.path_x) - 1)
+       end = np.minimum(end, len(self.path_x) - 1)
+       sx, sy = self.path_x[start], self.path_y[start]
+       ex, ey = self.path_x[end], self.path_y[end]
+       return sx + (ex - sx) * self.progress, sy + (ey - sy) * self.progress
+
+   def advance(self, dt: float) -> None:
+       """Move everyone by `dt` seconds, same rules as the CanvasArea animation loop."""
+       if not self.movable.any():
+           self.elapsed += dt
+           return
+       target, _ = self.segment()
+       start = np.minimum(self.offset + self.index, len(self.path_x) - 1)
+       end = np.minimum(self.offset + target, len(self.path_x) - 1)
+       distance = np.hypot(self.path_x[end] - self.path_x[start], self.path_y[end] - self.path_y[start])
+
+       zero = distance == 0
+       new_progress = self.progress + self.speed * dt / np.where(zero, 1.0, distance)
+       # Zero-length segments are skipped immediately; otherwise stop at the waypoint.
+       arrived = self.movable & (zero | (new_progress >= 1))
+       flip = arrived & ((target == self.length - 1) | (target == 0))
+
+       self.index = np.where(arrived, target, self.index)
+       self.direction = np.where(flip, -self.direction, self.direction)
+       self.progress = np.where(arrived, 0.0, np.where(self.movable, new_progress, self.progress))
+       self.elapsed += dt
+
+   def detect(self) -> Tuple[np.ndarray, np.ndarray]:
+       """Return (started, ended) pair keys since the previous call and update the active set."""
+       n_sensors = max(1, len(self.sensor_x))
+       if len(self.sensor_x) and self.movable.any():
+           x, y = self.positions()
+           people = np.flatnonzero(self.movable)
+           p_hit, s_hit = range_pairs(
+               x[people], y[people], np.zeros(len(people)),
+               self.sensor_x, self.sensor_y, self.sensor_r,
+           )
+           inside = np.unique(people[p_hit] * n_sensors + s_hit)
+       else:
+           inside = np.empty(0, dtype=np.int64)
+
+       started = np.setdiff1d(inside, self.active, assume_unique=True)
+       ended = np.setdiff1d(self.active, inside, assume_unique=True)
+       self.active = inside
+       return started, ended
+
+   def step(self, dt: float) -> List[MotionEvent]:
+       self.advance(dt)
+       started, ended = self.detect()
+       if not len(started) and not len(ended):
+           return []
+       n_sensors = max(1, len(self.sensor_x))
+       events = [(self.elapsed, "START", int(k // n_sensors), int(k % n_sensors)) for k in started]
+       events += [(self.elapsed, "END", int(k // n_sensors), int(k % n_sensors)) for k in ended]
+       # DetectMotion walks sensors in the outer loop and people in the inner one.
+       events.sort(key=lambda e: (e[3], e[2]))
+       return events
+
+   def run(self, duration: float, dt: float) -> List[MotionEvent]:
+       events: List[MotionEvent] = []
+       for _ in range(int(round(duration / dt))):
+           events.extend(self.step(dt))
+       return events
+
+   def restore_active(self, pairs: Optional[Sequence[Sequence[str]]]) -> None:
+       """
+       Resume detections from active_pairs() of an earlier run, so a person still
+       in range gets no second START. Pairs whose person or sensor is gone are
+       dropped; their START stays unmatched, as when a node is deleted in the client.
+       """
+       people = {p.id: i for i, p in enumerate(self.people)}
+       sensors = {s.id: i for i, s in enumerate(self.sensors)}
+       n_sensors = max(1, len(self.sensors))
+       keys = [
+           people[person_id] * n_sensors + sensors[sensor_id]
+           for person_id, sensor_id in pairs or ()
+           if person_id in people and sensor_id in sensors
+       ]
+       self.active = np.unique(np.array(keys, dtype=np.int64))
+
+   def active_pairs(self) -> List[List[str]]:
+       """The detections open at the end of the run, as [person_id, sensor_id]."""
+       n_sensors = max(1, len(self.sensors))
+       return [[self.people[k // n_sensors].id, self.sensors[k % n_sensors].id] for k in self.active.tolist()]
+
+   def person_states(self) -> List[dict]:
+       """Current index/direction/progress per person, keyed like the Person columns."""
+       return [
+           {
+               "id": person.id,
+               "currentIndex": int(self.index[i]),
+               "direction": int(self.direction[i]),
+               "progress": float(self.progress[i]),
+           }
+           for i, person in enumerate(self.people)
+       ]
+
+   def event_rows(self, events: Sequence[MotionEvent], floor: str, started_at: datetime) -> List[dict]:
+       """SimulationEvent rows with DetectMotion's messages, timestamped on the simulated clock."""
+       rows = []
+       now = datetime.utcnow()
+       for elapsed, kind, p, s in events:
+           sensor = self.sensors[s]
+           person = self.people[p]
+           if kind == "START":
+               message = f'Motion START near "{sensor.name}" by "{person.name}"'
+           else:
+               message = f'Motion END near "{sensor.name}" from "{person.name}"'
+           rows.append({
+               "id": str(uuid.uuid4()),
+               "floor": floor,
+               "node_id": sensor.id,
+               "node_type": "sensor",
+               "event_type": "motion",
+               "timestamp": started_at + timedelta(seconds=elapsed),
+               "message": message,
+               "date_created": now,
+               "date_modified": now,
+           })
+       return rows
+
+
+class FastForwardResult:
+   """Per-sensor and per-room totals of a fast-forwarded run, in steps."""
+
+   def __init__(self, steps: int, dt: float, n_sensors: int, n_rooms: int) -> None:
+       self.steps = steps
+       self.dt = dt
+       self.triggers = np.zeros(n_sensors, dtype=np.int64)
+       # Person-steps spent inside each sensor's range (summed over people).
+       self.detected_steps = np.zeros(n_sensors, dtype=np.int64)
+       # Person-steps spent in each room, and how many of them no sensor saw.
+       self.room_steps = np.zeros(n_rooms, dtype=np.int64)
+       self.room_undetected_steps = np.zeros(n_rooms, dtype=np.int64)
+       self.undetected_steps = 0
+
+
+def walk_segment(
+   px: np.ndarray, py: np.ndarray, index: int, direction: int, progress: float, speed: float, dt: float,
+   max_steps: Optional[int] = None,
+) -> Tuple[np.ndarray, np.ndarray, int, int, float]:
+   """
+   Positions after each step until the next waypoint is reached, plus the new (index, direction, progress).
+
+   Repeats MotionSimulation.advance for one person, including its float
+   accumulation of progress, so the two stay step-for-step identical. A person
+   who can never reach the waypoint (speed 0) takes one step and stays put.
+   With `max_steps`, a walk that would take longer stops after that many steps,
+   part way along the segment.
+   """
+   length = len(px)
+   nxt = index + direction
+   reached_end = nxt < 0 or nxt >= length
+   target = min(max(index - direction if reached_end else nxt, 0), length - 1)
+   distance = float(np.hypot(px[target] - px[index], py[target] - py[index]))
+   if distance == 0:
+       xs = np.array([px[target]])
+       ys = np.array([py[target]])
+   elif speed <= 0:
+       xs = np.array([px[index] + (px[target] - px[index]) * progress])
+       ys = np.array([py[index] + (py[target] - py[index]) * progress])
+       return xs, ys, index, direction, progress
+   else:
+       increment = speed * dt / distance
+       estimate = int(min(np.ceil((1.0 - progress) / increment) + 2, 2 ** 62))
+       if max_steps is not None and estimate > max_steps:
+           acc = np.cumsum(np.concatenate(([progress], np.full(max(max_steps, 1), increment))))[1:]
+           if not (acc >= 1).any():
+               xs = px[index] + (px[target] - px[index]) * acc
+               ys = py[index] + (py[target] - py[index]) * acc
+               return xs, ys, index, direction, float(acc[-1])
+       else:
+           acc = np.cumsum(np.concatenate(([progress], np.full(estimate, increment))))[1:]
+       arrive = int(np.argmax(acc >= 1)) + 1
+       ratio = acc[:arrive].copy()
+       ratio[-1] = 1.0  # arrival snaps to the waypoint
+       xs = px[index] + (px[target] - px[index]) * ratio
+       ys = py[index] + (py[target] - py[index]) * ratio
+   if target == length - 1 or target == 0:
+       direction = -direction
+   return xs, ys, target, direction, 0.0
+
+
+def person_schedule(
+   sim: MotionSimulation, i: int, dt: float, limit: Optional[int] = None,
+) -> Tuple[np.ndarray, np.ndarray, int, int]:
+   """
+   Positions of person `i` after each step as (xs, ys, prefix, cycle).
+
+   Walking along a fixed path at a fixed `dt` is periodic: the state at every
+   waypoint is (index, direction), so after `prefix` steps the person repeats
+   the same `cycle` steps forever. The arrays hold the prefix followed by two
+   cycles, enough to tell run starts inside a cycle from ones carried over a wrap.
+
+   When no cycle completes within `limit` steps (a slow walker on a long path)
+   the schedule is just those steps, as prefix = limit and cycle = 0, so its
+   size never exceeds what the run needs.
+   """
+   start, length = int(sim.offset[i]), int(sim.length[i])
+   px = sim.path_x[start : start + length]
+   py = sim.path_y[start : start + length]
+   state = (int(sim.index[i]), int(sim.direction[i]), float(sim.progress[i]))
+   speed = float(sim.speed[i])
+
+   xs: List[np.ndarray] = []
+   ys: List[np.ndarray] = []
+   seen = {}
+   steps = 0
+   while state not in seen:
+       if limit is not None and steps >= limit:
+           x = np.concatenate(xs)[:limit]
+           y = np.concatenate(ys)[:limit]
+           return x, y, len(x), 0
+       seen[state] = (len(xs), steps)
+       remaining = None if limit is None else limit - steps
+       sx, sy, *next_state = walk_segment(px, py, *state, speed, dt, remaining)
+       state = tuple(next_state)
+       xs.append(sx)
+       ys.append(sy)
+       steps += len(sx)
+   segment, prefix = seen[state]
+   cycle_x = np.concatenate(xs[segment:])
+   cycle_y = np.concatenate(ys[segment:])
+   return (
+       np.concatenate(xs[:segment] + [cycle_x, cycle_x]),
+       np.concatenate(ys[:segment] + [cycle_y, cycle_y]),
+       prefix,
+       len(cycle_x),
+   )
+
+
+def step_weights(t: np.ndarray, prefix: int, cycle: int, steps: int) -> np.ndarray:
+   """How many of the first `steps` steps each schedule entry (prefix + 2 cycles) stands for."""
+   head = prefix + cycle
+   weights = (t < min(steps, head)).astype(np.int64)
+   if steps > head:
+       full, rem = divmod(steps - head, cycle)
+       second = t >= head
+       weights += second * (full + ((t - head) < rem))
+   return weights
+
+
+def room_rects(rooms: Sequence) -> np.ndarray:
+   """(n, 4) array of x, y, width, height per room."""
+   return np.array([(r.x, r.y, r.width, r.height) for r in rooms], dtype=np.float64).reshape(-1, 4)
+
+
+def room_of(x: np.ndarray, y: np.ndarray, rects: np.ndarray, chunk_size: int = 8192) -> np.ndarray:
+   """Index of the first room rectangle containing each point, -1 outside every room."""
+   result = np.full(len(x), -1, dtype=np.int64)
+   if not len(rects) or not len(x):
+       return result
+   rx, ry, rw, rh = rects.T
+   for start in range(0, len(x), chunk_size):
+       cx = x[start : start + chunk_size, None]
+       cy = y[start : start + chunk_size, None]
+       inside = (cx >= rx) & (cx <= rx + rw) & (cy >= ry) & (cy <= ry + rh)
+       found = inside.any(axis=1)
+       result[start : start + chunk_size] = np.where(found, inside.argmax(axis=1), -1)
+   return result
+
+
+def fast_forward(sim: MotionSimulation, steps: int, dt: float, rects: Optional[np.ndarray] = None) -> FastForwardResult:
+   """
+   Aggregate `steps` steps of the simulation without stepping through them.
+
+   Each person's movement is periodic (see person_schedule), so detections are
+   evaluated once over the prefix and two cycles and weighted by how often each
+   entry repeats in the run. Cost depends on path lengths, not on `steps`;
+   totals match running sim.step(dt) `steps` times from the current state.
+   `rects` are room rectangles as returned by room_rects().
+   """
+   n_sensors = len(sim.sensor_x)
+   if rects is None:
+       rects = np.empty((0, 4))
+   result = FastForwardResult(steps, dt, n_sensors, len(rects))
+   people = np.flatnonzero(sim.movable)
+   if steps <= 0 or not len(people):
+       return result
+
+   xs, ys, weights, owners = [], [], [], []
+   for i in people:
+       sx, sy, prefix, cycle = person_schedule(sim, int(i), dt, steps)
+       t = np.arange(len(sx))
+       xs.append(sx)
+       ys.append(sy)
+       weights.append(step_weights(t, prefix, cycle, steps))
+       owners.append(np.where(t == 0, i, -1))
+   x = np.concatenate(xs)
+   y = np.concatenate(ys)
+   weight = np.concatenate(weights)
+   # Person index on each person's first entry, -1 elsewhere.
+   owner = np.concatenate(owners)
+
+   point, sensor = disc_hits(x, y, sim.sensor_x, sim.sensor_y, sim.sensor_r)
+   if len(point):
+       keys = point * n_sensors + sensor
+       # A detection starts when the same person was out of range one step earlier;
+       # on the first step "earlier" is the simulation's current active set.
+       known = np.sort(keys)
+       previous = keys - n_sensors
+       pos = np.minimum(np.searchsorted(known, previous), len(known) - 1)
+       started = known[pos] != previous
+       head = owner[point] >= 0
+       started[head] = ~np.isin(owner[point][head] * n_sensors + sensor[head], sim.active)
+       w = weight[point]
+       result.triggers = np.bincount(sensor, weights=w * started, minlength=n_sensors).astype(np.int64)
+       result.detected_steps = np.bincount(sensor, weights=w, minlength=n_sensors).astype(np.int64)
+
+   detected = np.zeros(len(x), dtype=bool)
+   detected[point] = True
+   result.undetected_steps = int(weight[~detected].sum())
+   if len(rects):
+       room = room_of(x, y, rects)
+       inside = room >= 0
+       result.room_steps = np.bincount(room[inside], weights=weight[inside], minlength=len(rects)).astype(np.int64)
+       blind = inside & ~detected
+       result.room_undetected_steps = np.bincount(
+           room[blind], weights=weight[blind], minlength=len(rects)
+       ).astype(np.int64)
+   return result
@@ -0,0 +1,132 @@
+"""
+Layout versions and the aggregated floor snapshot.
+
+Every write to a floor bumps `Layout.version` inside the writer's transaction.
+The snapshot (rooms, devices, sensors, persons, events) is serialised once per
+version and kept in an LRU cache bounded by the total size of the bodies it
+holds (SNAPSHOT_CACHE_BYTES), and the version doubles as the ETag so
+unchanged floors are answered with 304 without touching the child tables.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import update
+
+from changes import record_version
+from columnar import ColumnarWriter
+from encoding import json_bytes
+from models import db, Device, Layout, Person, Room, Sensor, SimulationEvent
+from serialize import array_bytes, DEVICE_ROWS, EVENT_ROWS, PERSON_ROWS, ROOM_ROWS, SENSOR_ROWS
+
+
+# Total size of the cached bodies; a single body larger than this is not cached.
+SNAPSHOT_CACHE_BYTES = int(os.environ.get("SNAPSHOT_CACHE_BYTES", str(256 * 1024 * 1024)))
+
+
+def touch_layout(layout_id: str) -> Optional[int]:
+   """Bump the floor's version; call before the writer's commit. Returns the new version."""
+   version = db.session.execute(
+       update(Layout).where(Layout.id == layout_id).values(version=Layout.version + 1).returning(Layout.version)
+   ).scalar()
+   if version is not None:
+       record_version(db.session, layout_id, version)
+   return version
+
+
+def layout_etag(layout_id: str, version: int) -> str:
+   """Unquoted entity tag for a layout version."""
+   return f"{layout_id}:{version}"
+
+
+class SnapshotCache:
+   """
+   LRU of serialised snapshots keyed by layout id, valid for one version each
+   (one body per format). Least recently used floors are evicted until the
+   bodies fit in max_bytes.
+   """
+
+   def __init__(self, max_bytes: int = SNAPSHOT_CACHE_BYTES) -> None:
+       self.max_bytes = max_bytes
+       self.size = 0
+       self.entries: "OrderedDict[str, Tuple[int, Dict[str, bytes]]]" = OrderedDict()
+       self.lock = threading.Lock()
+
+   def discard(self, layout_id: str) -> None:
+       """Remove one floor's bodies; call with the lock held."""
+       entry = self.entries.pop(layout_id, None)
+       if entry is not None:
+           self.size -= sum(len(body) for body in entry[1].values())
+
+   def get(self, layout_id: str, version: int, fmt: str = "json") -> Optional[bytes]:
+       with self.lock:
+           entry = self.entries.get(layout_id)
+           if entry is None or entry[0] != version:
+               return None
+           self.entries.move_to_end(layout_id)
+           return entry[1].get(fmt)
+
+   def put(self, layout_id: str, version: int, body: bytes, fmt: str = "json") -> None:
+       with self.lock:
+           current = self.entries.get(layout_id)
+           # A slower request may finish after a newer version was cached.
+           if current is not None and current[0] > version:
+               return
+           if len(body) > self.max_bytes:
+               return
+           if current is None or current[0] != version:
+               self.discard(layout_id)
+               current = (version, {})
+           old = current[1].get(fmt)
+           self.size += len(body) - (len(old) if old is not None else 0)
+           current[1][fmt] = body
+           self.entries[layout_id] = current
+           self.entries.move_to_end(layout_id)
+           while self.size > self.max_bytes:
+               self.discard(next(iter(self.entries)))
+
+   def drop(self, layout_id: str) -> None:
+       with self.lock:
+           self.discard(layout_id)
+
+
+snapshot_cache = SnapshotCache()
+
+
+def snapshot_queries(layout_id: str) -> list:
+   """(key, row spec, query) of each collection in the snapshot."""
+   return [
+       ("rooms", ROOM_ROWS, ROOM_ROWS.select().where(Room.layout_id == layout_id)),
+       ("devices", DEVICE_ROWS, DEVICE_ROWS.select().where(Device.floor == layout_id)),
+       ("sensors", SENSOR_ROWS, SENSOR_ROWS.select().where(Sensor.floor == layout_id)),
+       ("persons", PERSON_ROWS, PERSON_ROWS.select().where(Person.floor == layout_id)),
+       ("events", EVENT_ROWS, EVENT_ROWS.select().where(SimulationEvent.floor == layout_id)),
+   ]
+
+
+def snapshot_body(layout: Layout) -> bytes:
+   """Serialised snapshot; the collections are encoded straight from column tuples (serialize.py)."""
+   parts = [b'{"layout":', json_bytes({"id": layout.id, "name": layout.name, "version": layout.version})]
+   for key, spec, query in snapshot_queries(layout.id):
+       parts += [b',"', key.encode(), b'":', array_bytes(spec, query)]
+   parts.append(b"}")
+   return b"".join(parts)
+
+
+def snapshot_columnar(layout: Layout) -> bytes:
+   """The snapshot in the columnar binary format (columnar.py), layout info in the header's meta."""
+   writer = ColumnarWriter()
+   for name, spec, query in snapshot_queries(layout.id):
+       writer.add_rows(name, spec, db.session.connection().execute(query).all())
+   return writer.finish({"layout": {"id": layout.id, "name": layout.name, "version": layout.version}})
+
+
+def snapshot_bytes(layout: Layout, fmt: str = "json") -> bytes:
+   """Serialised snapshot ("json" or "columnar") for the layout's current version, from cache when possible."""
+   body = snapshot_cache.get(layout.id, layout.version, fmt)
+   if body is None:
+       body = snapshot_columnar(layout) if fmt == "columnar" else snapshot_body(layout)
+       snapshot_cache.put(layout.id, layout.version, body, fmt)
+   return body
@@ -0,0 +1,229 @@
+"""
+In-memory spatial index of sensors and devices, one uniform grid per floor.
+
+Nodes are bucketed into square cells so a range query only visits the cells
+overlapping the query circle; lookups scale with local density rather than
+the number of nodes on the floor. Grids are built lazily from the database
+the first time a floor is queried and kept current by the write routes.
+"""
+
+import math
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from sqlalchemy import select
+
+from models import db, Device, Sensor
+
+
+GRID_CELL_SIZE = 200.0
+
+Key = Tuple[str, str]  # (kind, id)
+
+
+class GridIndex:
+   """Uniform grid over one floor."""
+
+   def __init__(self, cell_size: float = GRID_CELL_SIZE) -> None:
+       self.cell_size = cell_size
+       self.cells: Dict[Tuple[int, int], Set[Key]] = {}
+       self.nodes: Dict[Key, Tuple[float, float, float]] = {}
+       # Upper bound on node radius per kind; never shrinks, so it stays safe after removals.
+       self.max_radius: Dict[str, float] = {}
+
+   def cell(self, x: float, y: float) -> Tuple[int, int]:
+       return int(math.floor(x / self.cell_size)), int(math.floor(y / self.cell_size))
+
+   def upsert(self, kind: str, node_id: str, x: float, y: float, radius: float) -> None:
+       key = (kind, node_id)
+       self.remove(kind, node_id)
+       self.nodes[key] = (x, y, radius)
+       self.max_radius[kind] = max(self.max_radius.get(kind, 0.0), radius or 0.0)
+       self.cells.setdefault(self.cell(x, y), set()).add(key)
+
+   def remove(self, kind: str, node_id: str) -> None:
+       key = (kind, node_id)
+       old = self.nodes.pop(key, None)
+       if old is None:
+           return
+       cell = self.cell(old[0], old[1])
+       bucket = self.cells.get(cell)
+       if bucket is not None:
+           bucket.discard(key)
+           if not bucket:
+               del self.cells[cell]
+
+   def query(self, x: float, y: float, r: float, kind: Optional[str] = None) -> List[Tuple[str, str, float]]:
+       """Return (kind, id, distance) of nodes whose centre is within `r` of (x, y), nearest first."""
+       min_cx, min_cy = self.cell(x - r, y - r)
+       max_cx, max_cy = self.cell(x + r, y + r)
+       r2 = r * r
+       hits = []
+       # Walk whichever is smaller: the covered cells or the occupied cells.
+       if (max_cx - min_cx + 1) * (max_cy - min_cy + 1) <= len(self.cells):
+           buckets = (
+               self.cells.get((cx, cy), ())
+               for cx in range(min_cx, max_cx + 1)
+               for cy in range(min_cy, max_cy + 1)
+           )
+       else:
+           buckets = (
+               bucket
+               for (cx, cy), bucket in self.cells.items()
+               if min_cx <= cx <= max_cx and min_cy <= cy <= max_cy
+           )
+       for bucket in buckets:
+           for key in bucket:
+               if kind is not None and key[0] != kind:
+                   continue
+               nx, ny, _ = self.nodes[key]
+               d2 = (nx - x) ** 2 + (ny - y) ** 2
+               if d2 <= r2:
+                   hits.append((key[0], key[1], math.sqrt(d2)))
+       hits.sort(key=lambda hit: hit[2])
+       return hits
+
+   def __len__(self) -> int:
+       return len(self.nodes)
+
+
+class FloorIndexes:
+   """
+   Thread-safe registry of GridIndex objects keyed by floor (layout id).
+   Read grids through query()/max_radius(), which hold the lock.
+   """
+
+   def __init__(self, cell_size: float = GRID_CELL_SIZE) -> None:
+       self.cell_size = cell_size
+       self.floors: Dict[str, GridIndex] = {}
+       self.lock = threading.RLock()
+
+   def build(self, floor: str) -> GridIndex:
+       grid = GridIndex(self.cell_size)
+       for row in db.session.execute(
+           select(Sensor.id, Sensor.x, Sensor.y, Sensor.sensor_rad).where(Sensor.floor == floor)
+       ):
+           grid.upsert("sensor", row.id, row.x, row.y, row.sensor_rad)
+       for row in db.session.execute(
+           select(Device.id, Device.x, Device.y, Device.device_rad).where(Device.floor == floor)
+       ):
+           grid.upsert("device", row.id, row.x, row.y, row.device_rad)
+       return grid
+
+   def get(self, floor: str) -> GridIndex:
+       """Return the floor's grid, building it from the database on first use."""
+       with self.lock:
+           grid = self.floors.get(floor)
+           if grid is None:
+               grid = self.build(floor)
+               self.floors[floor] = grid
+           return grid
+
+   def query(
+       self, floor: str, x: float, y: float, r: float, kind: Optional[str] = None
+   ) -> List[Tuple[str, str, float, Tuple[float, float, float]]]:
+       """
+       GridIndex.query on the floor's grid, with each hit's (x, y, radius).
+
+       Runs under the registry lock: the write routes mutate the grid's cells
+       in place, so walking them unlocked could fail mid-iteration.
+       """
+       with self.lock:
+           grid = self.get(floor)
+           return [(k, node_id, d, grid.nodes[(k, node_id)]) for k, node_id, d in grid.query(x, y, r, kind)]
+
+   def max_radius(self, floor: str, kind: str) -> float:
+       with self.lock:
+           return self.get(floor).max_radius.get(kind, 0.0)
+
+   def upsert(
+       self,
+       floor: str,
+       kind: str,
+       node_id: str,
+       x: float,
+       y: float,
+       radius: float,
+       previous_floor: Optional[str] = None,
+   ) -> None:
+       with self.lock:
+           if previous_floor is not None and previous_floor != floor:
+               self.remove(previous_floor, kind, node_id)
+           # Floors that were never queried are built from the DB later anyway.
+           grid = self.floors.get(floor)
+           if grid is not None:
+               grid.upsert(kind, node_id, x, y, radius)
+
+   def remove(self, floor: str, kind: str, node_id: str) -> None:
+       with self.lock:
+           grid = self.floors.get(floor)
+           if grid is not None:
+               grid.remove(kind, node_id)
+
+   def drop(self, floor: str) -> None:
+       with self.lock:
+           self.floors.pop(floor, None)
+
+
+floor_indexes = FloorIndexes()
+
+
+def disc_hits(
+   px: np.ndarray,
+   py: np.ndarray,
+   cx: np.ndarray,
+   cy: np.ndarray,
+   cr: np.ndarray,
+   chunk_size: int = 1 << 20,
+) -> Tuple[np.ndarray, np.ndarray]:
+   """
+   (point_idx, disc_idx) of every point lying inside a disc, as two int64 arrays.
+
+   Vectorised uniform-grid join for many points against many discs: discs are
+   bucketed by cell (cell size = largest radius) and each point is matched
+   against the discs in its own and the 8 neighbouring cells.
+   """
+   empty = np.empty(0, dtype=np.int64)
+   if len(px) == 0 or len(cx) == 0:
+       return empty, empty
+
+   cell = max(float(cr.max()), 1e-9)
+   dgx = np.floor(cx / cell).astype(np.int64)
+   dgy = np.floor(cy / cell).astype(np.int64)
+   min_gy = int(dgy.min())
+   width = int(dgy.max()) - min_gy + 3  # one spare row on each side so y +/- 1 never wraps
+   disc_keys = dgx * width + (dgy - min_gy + 1)
+   order = np.argsort(disc_keys, kind="stable")
+   sorted_keys = disc_keys[order]
+
+   point_hits = []
+   disc_hits_ = []
+   for start in range(0, len(px), chunk_size):
+       x = px[start : start + chunk_size]
+       y = py[start : start + chunk_size]
+       pgx = np.floor(x / cell).astype(np.int64)
+       pgy = np.floor(y / cell).astype(np.int64) - min_gy + 1
+       # Points more than one row outside the discs' rows cannot hit anything.
+       valid = (pgy >= 0) & (pgy < width)
+       for ox in (-1, 0, 1):
+           for oy in (-1, 0, 1):
+               keys = (pgx + ox) * width + (pgy + oy)
+               lo = np.searchsorted(sorted_keys, keys, side="left")
+               hi = np.searchsorted(sorted_keys, keys, side="right")
+               counts = np.where(valid & (pgy + oy >= 0) & (pgy + oy < width), hi - lo, 0)
+               total = int(counts.sum())
+               if total == 0:
+                   continue
+               points = np.repeat(np.arange(len(x)), counts)
+               ramp = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+               discs = order[np.repeat(lo, counts) + ramp]
+               dx = x[points] - cx[discs]
+               dy = y[points] - cy[discs]
+               inside = dx * dx + dy * dy <= cr[discs] * cr[discs]
+               point_hits.append(points[inside] + start)
+               disc_hits_.append(discs[inside])
+
+   if not point_hits:
+       return empty, empty
+   return np.concatenate(point_hits), np.concatenate(disc_hits_)
@@ -0,0 +1,424 @@
+"""
+Floor activity statistics computed in the database.
+
+Motion events carry DetectMotion's messages ('Motion START near "<sensor>" by
+"<person>"' / 'Motion END near "<sensor>" from "<person>"'), so START/END and
+the person are read from the message. Per sensor: events, triggers (STARTs)
+and the mean/max dwell of START -> END pairs, paired with LEAD() over
+(sensor, person) in (timestamp, id) order. Per room (the room holding each
+sensor): triggers per time bucket, plus the floor's busiest buckets. Logs on
+the floor are counted per room and effect.
+
+Events compacted by retention.py still count towards events, triggers, the
+histograms (by the hour) and busiest, through the rollups' trigger counts.
+Dwell needs both ends of a pair, so it covers the raw events only; the
+response's `dwell_range` says which span that is.
+
+The raw-event aggregates are kept per floor as running totals (per sensor, per
+sensor and minute, per pair) with the layout version they reflect. A newer
+version folds in only the events the change log (changes.py) recorded since;
+a pair spanning the two sets is found from the last row of its (sensor,
+person) partition. The totals are rebuilt from all events when the log cannot
+vouch for the difference: a version with nothing logged, a deleted event (a
+retention compaction, say), or a new event ordered before what its partition
+already holds (an update or an out-of-order insert). Serialised responses are
+cached per version and last log id.
+"""
+
+import math
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from sqlalchemy import and_, case, false, func, literal, null, or_, select, union_all
+
+from encoding import json_bytes
+from models import db, EventRollup, LayoutChange, Log, Room, Sensor, SimulationEvent
+from retention import EPOCH, RESOLUTIONS, START, bucket_epoch
+
+
+STATS_CACHE_SIZE = 16
+STATS_DEFAULT_INTERVAL = 60  # seconds per histogram bucket; any multiple of 60
+STATS_MAX_BUCKETS = 1000  # per room; the interval is widened to stay under it
+STATS_BUSIEST = 10
+
+END = "Motion END%"
+
+
+def ms(value: Optional[datetime]) -> Optional[int]:
+   return None if value is None else int((value - EPOCH).total_seconds() * 1000)
+
+
+def seconds_between(start, end):
+   if db.session.get_bind().dialect.name == "sqlite":
+       return (func.julianday(end) - func.julianday(start)) * 86400.0
+   return func.extract("epoch", end - start)
+
+
+def pair_key(message):
+   """A START message rewritten to its END form, so both share a (sensor, person) key."""
+   return func.replace(func.replace(message, "Motion START near ", "Motion END near "), '" by "', '" from "')
+
+
+def node_rows(conditions) -> List[Tuple]:
+   """(node_id, events, triggers, first, last) of the matching events."""
+   return db.session.execute(
+       select(
+           SimulationEvent.node_id,
+           func.count(),
+           func.sum(case((SimulationEvent.message.like(START), 1), else_=0)),
+           func.min(SimulationEvent.timestamp),
+           func.max(SimulationEvent.timestamp),
+       )
+       .where(*conditions)
+       .group_by(SimulationEvent.node_id)
+   ).all()
+
+
+def trigger_rows(conditions) -> List[Tuple]:
+   """(node_id, minute start in epoch seconds, triggers) of the matching STARTs."""
+   minute = bucket_epoch(SimulationEvent.timestamp, 60).label("minute")
+   return db.session.execute(
+       select(SimulationEvent.node_id, minute, func.count())
+       .where(*conditions, SimulationEvent.message.like(START))
+       .group_by(SimulationEvent.node_id, minute)
+   ).all()
+
+
+def pair_rows(conditions, heads: bool) -> Tuple[List[Tuple], List[Tuple]]:
+   """
+   START -> END pairs of the matching motion events: per sensor (node_id, pairs,
+   dwell sum, dwell max), and the partition edges (node_id, key, is_start,
+   timestamp, id, is_first, is_last): the last row of every (sensor, person)
+   partition, and with `heads` its first row too.
+   """
+   kind = case((SimulationEvent.message.like(START), 1), else_=0)
+   key = pair_key(SimulationEvent.message)
+   window = {"partition_by": (SimulationEvent.node_id, key), "order_by": (SimulationEvent.timestamp, SimulationEvent.id)}
+   columns = [
+       SimulationEvent.node_id,
+       key.label("key"),
+       kind.label("kind"),
+       SimulationEvent.timestamp,
+       SimulationEvent.id,
+       func.lead(kind).over(**window).label("next_kind"),
+       func.lead(SimulationEvent.timestamp).over(**window).label("next_timestamp"),
+   ]
+   if heads:
+       columns.append(func.lag(SimulationEvent.timestamp).over(**window).label("previous_timestamp"))
+   ordered = (
+       select(*columns)
+       .where(
+           *conditions,
+           SimulationEvent.event_type == "motion",
+           or_(SimulationEvent.message.like(START), SimulationEvent.message.like(END)),
+       )
+       .cte("ordered")
+   )
+   # One statement, so the window is evaluated once (a CTE used twice is materialised).
+   is_last = ordered.c.next_timestamp.is_(None)
+   is_first = ordered.c.previous_timestamp.is_(None) if heads else false()
+   dwell = seconds_between(ordered.c.timestamp, ordered.c.next_timestamp)
+   edges = select(
+       literal(0).label("part"), ordered.c.node_id, ordered.c.key, ordered.c.kind, ordered.c.timestamp, ordered.c.id,
+       is_first.label("is_first"), is_last.label("is_last"), null().label("dwell_sum"), null().label("dwell_max"),
+   ).where(or_(is_first, is_last))
+   pairs = select(
+       literal(1), ordered.c.node_id, null(), func.count(), null(), null(), false(), false(),
+       func.sum(dwell), func.max(dwell),
+   ).where(ordered.c.kind == 1, ordered.c.next_kind == 0).group_by(ordered.c.node_id)
+   rows = db.session.execute(union_all(edges, pairs)).all()
+   return [(r[1], r[3], r[8], r[9]) for r in rows if r[0] == 1], [r[1:8] for r in rows if r[0] == 0]
+
+
+class ActivityTotals:
+   """Running aggregates of one floor's raw events at `version`."""
+
+   def __init__(self) -> None:
+       self.version: Optional[int] = None
+       self.nodes: Dict[str, list] = {}  # node -> [events, triggers, first, last]
+       self.minutes: Dict[str, Dict[int, int]] = {}  # node -> {minute start in ms: triggers}
+       self.pairs: Dict[str, list] = {}  # node -> [pairs, dwell sum, dwell max]
+       self.tails: Dict[Tuple[str, str], Tuple[int, datetime, str]] = {}  # (node, key) -> last (is_start, ts, id)
+
+   def fold(self, conditions) -> bool:
+       """
+       Add the matching events. Returns False, leaving the totals as they were,
+       if one sorts before the last row its partition already holds.
+       """
+       # Every query runs before anything is added, so a failing one leaves the totals intact.
+       pair_totals, edges = pair_rows(conditions, heads=bool(self.tails))
+       for node, key, kind, timestamp, event_id, is_first, _ in edges:
+           tail = self.tails.get((node, key)) if is_first else None
+           if tail is None:
+               continue
+           if (timestamp, event_id) <= tail[1:]:
+               return False
+           if tail[0] == 1 and kind == 0:
+               # The START ended the previous set, its END starts this one.
+               dwell = (timestamp - tail[1]).total_seconds()
+               pair_totals.append((node, 1, dwell, dwell))
+       nodes = node_rows(conditions)
+       triggers = trigger_rows(conditions)
+
+       for node, events, starts, first, last in nodes:
+           totals = self.nodes.get(node)
+           if totals is None:
+               self.nodes[node] = [events, starts, first, last]
+           else:
+               totals[0] += events
+               totals[1] += starts
+               totals[2] = min(totals[2], first)
+               totals[3] = max(totals[3], last)
+       for node, minute, count in triggers:
+           per_minute = self.minutes.setdefault(node, {})
+           per_minute[minute * 1000] = per_minute.get(minute * 1000, 0) + count
+       for node, count, total, longest in pair_totals:
+           totals = self.pairs.get(node)
+           if totals is None:
+               self.pairs[node] = [count, float(total), float(longest)]
+           else:
+               totals[0] += count
+               totals[1] += float(total)
+               totals[2] = max(totals[2], float(longest))
+       for node, key, kind, timestamp, event_id, _, is_last in edges:
+           if is_last:
+               self.tails[(node, key)] = (kind, timestamp, event_id)
+       return True
+
+
+def logged_since(layout_id: str, since: int, until: int) -> bool:
+   """True if every version in (since, until] logged its changes and none deleted an event."""
+   versions, deletes = db.session.execute(
+       select(
+           func.count(func.distinct(LayoutChange.version)),
+           func.sum(case((and_(LayoutChange.collection == "events", LayoutChange.deleted), 1), else_=0)),
+       ).where(LayoutChange.layout_id == layout_id, LayoutChange.version > since, LayoutChange.version <= until)
+   ).one()
+   return versions == until - since and not deletes
+
+
+def activity_totals(layout_id: str, version: int, change_log_start: int, current: Optional[ActivityTotals]) -> ActivityTotals:
+   """Totals at `version`: `current` brought forward from the change log when possible, else rebuilt."""
+   if current is not None and current.version is not None and current.version >= change_log_start:
+       if current.version == version:
+           return current
+       if current.version < version and logged_since(layout_id, current.version, version):
+           added = select(LayoutChange.node_id).where(
+               LayoutChange.layout_id == layout_id,
+               LayoutChange.collection == "events",
+               LayoutChange.version > current.version,
+               LayoutChange.version <= version,
+           )
+           # By primary key alone: with the floor condition too, planners pick the floor index and scan it.
+           if current.fold([SimulationEvent.id.in_(added)]):
+               current.version = version
+               return current
+   totals = ActivityTotals()
+   totals.fold([SimulationEvent.floor == layout_id])
+   totals.version = version
+   return totals
+
+
+def sensor_rooms(layout_id: str) -> Dict[str, str]:
+   """Sensor id -> id of the room whose rectangle holds it (lowest id where rooms overlap)."""
+   return dict(db.session.execute(
+       select(Sensor.id, func.min(Room.id))
+       .join(Room, and_(
+           Room.layout_id == Sensor.floor,
+           Sensor.x >= Room.x, Sensor.x < Room.x + Room.width,
+           Sensor.y >= Room.y, Sensor.y < Room.y + Room.height,
+       ))
+       .where(Sensor.floor == layout_id)
+       .group_by(Sensor.id)
+   ).all())
+
+
+def compacted_activity(layout_id: str) -> Tuple[Dict[str, list], Dict[str, Dict[int, int]]]:
+   """
+   Compacted events from the hour rollups, shaped like ActivityTotals: per node
+   [events, triggers, first, last] and {hour start in ms: triggers}.
+   """
+   hour = [EventRollup.floor == layout_id, EventRollup.resolution == RESOLUTIONS["hour"]]
+   nodes = {
+       node: [int(events), int(triggers), first, last]
+       for node, events, triggers, first, last in db.session.execute(
+           select(
+               EventRollup.node_id, func.sum(EventRollup.count), func.sum(EventRollup.triggers),
+               func.min(EventRollup.first_timestamp), func.max(EventRollup.last_timestamp),
+           ).where(*hour).group_by(EventRollup.node_id)
+       ).all()
+   }
+   hours: Dict[str, Dict[int, int]] = {}
+   for node, bucket, triggers in db.session.execute(
+       select(EventRollup.node_id, bucket_epoch(EventRollup.bucket, 3600), func.sum(EventRollup.triggers))
+       .where(*hour, EventRollup.triggers > 0)
+       .group_by(EventRollup.node_id, EventRollup.bucket)
+   ).all():
+       hours.setdefault(node, {})[bucket * 1000] = int(triggers)
+   return nodes, hours
+
+
+def log_counts(layout_id: str, column) -> List[dict]:
+   count = func.count().label("count")
+   return [
+       {"key": key, "count": n}
+       for key, n in db.session.execute(
+           select(column, count).where(Log.floor_id == layout_id).group_by(column).order_by(count.desc(), column)
+       ).all()
+   ]
+
+
+def last_log_id(layout_id: str) -> Optional[int]:
+   return db.session.execute(select(func.max(Log.id)).where(Log.floor_id == layout_id)).scalar()
+
+
+def layout_stats(layout_id: str, version: int, totals: ActivityTotals, interval: int = STATS_DEFAULT_INTERVAL) -> dict:
+   compacted, compacted_hours = compacted_activity(layout_id)
+   nodes = {node: list(values) for node, values in totals.nodes.items()}
+   for node, (events, triggers, node_first, node_last) in compacted.items():
+       merged = nodes.get(node)
+       if merged is None:
+           nodes[node] = [events, triggers, node_first, node_last]
+       else:
+           merged[0] += events
+           merged[1] += triggers
+           merged[2] = min(merged[2], node_first)
+           merged[3] = max(merged[3], node_last)
+
+   first = min((n[2] for n in nodes.values()), default=None)
+   last = max((n[3] for n in nodes.values()), default=None)
+   if first is not None:
+       # Keep each room's histogram under STATS_MAX_BUCKETS buckets.
+       span = (last - first).total_seconds()
+       if span > interval * STATS_MAX_BUCKETS:
+           interval = math.ceil(span / STATS_MAX_BUCKETS / 60) * 60
+
+   names = dict(db.session.execute(select(Room.id, Room.name).where(Room.layout_id == layout_id)).all())
+   room_of = sensor_rooms(layout_id)
+   step = interval * 1000
+   by_room: Dict[Optional[str], list] = {}
+   for source in (totals.minutes, compacted_hours):
+       for node, per_bucket in source.items():
+           starts = np.fromiter(per_bucket.keys(), dtype=np.int64, count=len(per_bucket))
+           counts = np.fromiter(per_bucket.values(), dtype=np.int64, count=len(per_bucket))
+           by_room.setdefault(room_of.get(node), []).append((starts // step * step, counts))
+
+   def histogram(parts) -> Tuple[np.ndarray, np.ndarray]:
+       buckets, index = np.unique(np.concatenate([p[0] for p in parts]), return_inverse=True)
+       return buckets, np.bincount(index, weights=np.concatenate([p[1] for p in parts])).astype(np.int64)
+
+   rooms = []
+   for room_id, parts in by_room.items():
+       if room_id is None:
+           continue
+       buckets, counts = histogram(parts)
+       rooms.append({
+           "roomId": room_id,
+           "name": names.get(room_id),
+           "triggers": int(counts.sum()),
+           "histogram": list(zip(buckets.tolist(), counts.tolist())),
+       })
+   rooms.sort(key=lambda r: (-r["triggers"], r["roomId"]))
+
+   sensors = []
+   for node, (events, triggers, node_first, node_last) in nodes.items():
+       pairs = totals.pairs.get(node)
+       sensors.append({
+           "nodeId": node,
+           "events": events,
+           "triggers": triggers,
+           "first": ms(node_first),
+           "last": ms(node_last),
+           "dwell": {
+               "pairs": pairs[0] if pairs else 0,
+               "mean_s": round(pairs[1] / pairs[0], 3) if pairs else None,
+               "max_s": round(pairs[2], 3) if pairs else None,
+           },
+       })
+   sensors.sort(key=lambda n: (-n["events"], n["nodeId"]))
+
+   busiest = []
+   if by_room:
+       buckets, counts = histogram([part for parts in by_room.values() for part in parts])
+       top = np.lexsort((buckets, -counts))[:STATS_BUSIEST]
+       busiest = [{"bucket": int(buckets[i]), "triggers": int(counts[i])} for i in top]
+   return {
+       "layout_id": layout_id,
+       "version": version,
+       "range": {"first": ms(first), "last": ms(last)},
+       # Dwell pairs come from raw events only; compacted ones have no START/END order left.
+       "dwell_range": {
+           "first": ms(min((n[2] for n in totals.nodes.values()), default=None)),
+           "last": ms(max((n[3] for n in totals.nodes.values()), default=None)),
+       },
+       "interval_s": interval,
+       "sensors": sensors,
+       "rooms": rooms,
+       "busiest": busiest,
+       "logs": {"rooms": log_counts(layout_id, Log.room), "effects": log_counts(layout_id, Log.effect)},
+   }
+
+
+class StatsCache:
+   """
+   LRU of per-floor activity totals and the stats responses serialised from
+   them, keyed by layout id. Responses are valid for one (version, last log id)
+   and interval; the totals are carried forward across versions.
+
+   Totals are built under a lock of their own floor and swapped in when done,
+   so a slow rebuild (after a compaction, say) holds up only that floor's
+   requests; the cache lock itself is only held to look up and store entries.
+   """
+
+   def __init__(self, max_entries: int = STATS_CACHE_SIZE) -> None:
+       self.max_entries = max_entries
+       self.entries: "OrderedDict[str, list]" = OrderedDict()  # layout id -> [totals, token, {interval: body}]
+       self.builders: Dict[str, threading.Lock] = {}  # layout id -> lock held while building its entry
+       self.lock = threading.Lock()
+
+   def cached(self, layout_id: str, version: int, log_id: Optional[int], interval: int) -> Optional[bytes]:
+       with self.lock:
+           entry = self.entries.get(layout_id)
+           if entry is None or entry[1] != (version, log_id):
+               return None
+           self.entries.move_to_end(layout_id)
+           return entry[2].get(interval)
+
+   def render(self, layout_id: str, version: int, change_log_start: int, log_id: Optional[int], interval: int) -> bytes:
+       with self.lock:
+           builder = self.builders.setdefault(layout_id, threading.Lock())
+       with builder:
+           with self.lock:
+               entry = self.entries.get(layout_id)
+           # A copy: readers of the cached entry keep seeing a consistent token and bodies.
+           entry = [entry[0], entry[1], dict(entry[2])] if entry else [None, None, {}]
+           if entry[1] != (version, log_id):
+               try:
+                   entry[0] = activity_totals(layout_id, version, change_log_start, entry[0])
+               except Exception:
+                   # fold() updates the cached totals in place; don't keep them if it stopped halfway.
+                   with self.lock:
+                       self.entries.pop(layout_id, None)
+                   raise
+               entry[1], entry[2] = (version, log_id), {}
+           body = entry[2].get(interval)
+           if body is None:
+               body = entry[2][interval] = json_bytes(layout_stats(layout_id, version, entry[0], interval))
+           with self.lock:
+               self.entries[layout_id] = entry
+               self.entries.move_to_end(layout_id)
+               while len(self.entries) > self.max_entries:
+                   self.entries.popitem(last=False)
+           return body
+
+   def drop(self, layout_id: str) -> None:
+       with self.lock:
+           self.entries.pop(layout_id, None)
+           self.builders.pop(layout_id, None)
+
+
+stats_cache = StatsCache()